@@ -0,0 +1,42 @@
+'''Cost of an hourly almanac: BaZiChart.from_solar_date for every hour,
+against almanac.walk stepping through them and almanac.blocks doing them a
+block at a time, in both calendar modes. Every record is checked against
+from_solar_date for a sample of the hours.
+Run from the repo root with `python -m benchmarks.bench_almanac [years]`.'''
+
+import sys
+from datetime import date, datetime, timedelta
+from time import perf_counter
+import numpy as np
+from src.purple_star_chart.BaZiChart import BaZiChart
+from src.purple_star_chart.almanac import blocks, hours
+
+def main(years=10):
+    first, last = date(2000, 1, 1), date(2000 + years - 1, 12, 31)
+    stop = datetime(2000 + years, 1, 1)
+    print(f'every hour of {first} to {last}')
+    print(f'{"":14}{"from_solar_date":>17}{"walk":>12}{"blocks":>12}   (us per hour)')
+    for solar_terms in (False, True):
+        start = perf_counter()
+        records = list(hours(first, last, solar_terms))
+        walk_t = (perf_counter() - start) / len(records)
+
+        start = perf_counter()
+        codes = np.concatenate([b.pillar_codes() for b in blocks(datetime(2000, 1, 1), stop,
+                                                                 timedelta(hours=1), solar_terms)])
+        block_t = (perf_counter() - start) / len(codes)
+        assert np.array_equal(codes, np.array([r.pillar_codes() for r in records]))
+
+        sample = records[::97]
+        start = perf_counter()
+        charts = [BaZiChart.from_solar_date(r.solar_date, solar_terms) for r in sample]
+        naive_t = (perf_counter() - start) / len(sample)
+        for record, chart in zip(sample, charts):
+            assert record.chart().to_dict() == chart.to_dict()
+
+        label = 'solar terms' if solar_terms else 'default'
+        print(f'{label:14}{naive_t * 1e6:17.2f}{walk_t * 1e6:12.2f}{block_t * 1e6:12.3f}'
+              f'   ({naive_t / walk_t:.1f}x, {naive_t / block_t:.0f}x)')
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,38 @@
+'''Query and date mapping times for the chart space index.
+Run from the repo root with `python -m benchmarks.bench_chart_index`.'''
+
+from datetime import date
+from time import perf_counter
+from src.purple_star_chart.chart_index import ChartIndex, Star, Field
+
+QUERIES = {
+    'star in palace': Star('zi_wei', palace='life'),
+    'star on branch': Star('tian_fu', branch='wu'),
+    'and of 3': Star('zi_wei', palace='life') & Star('tian_fu', palace='wealth') & Field('gender', 'male'),
+    'or / not': (Star('tai_yang', palace='career') | Star('tai_yin', palace='career')) & ~Star('hua_ji', palace='life'),
+}
+
+def _best(fn, repeat=20):
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        out = fn()
+        best = min(best, perf_counter() - start)
+    return out, best
+
+def main():
+    start = perf_counter()
+    index = ChartIndex.build()
+    print(f'build: {perf_counter() - start:.2f}s, {(index.bitmaps.nbytes + index.life.nbytes) / 2 ** 20:.0f}MB')
+    for name, q in QUERIES.items():
+        # first run fills the (star, palace) cache, so time it separately
+        cold_start = perf_counter()
+        hits = index.query(q)
+        cold = perf_counter() - cold_start
+        _, warm = _best(lambda: index.query(q))
+        ranges, span = _best(lambda: list(index.datetimes(hits, date(1950, 1, 1), date(2049, 12, 31))), 3)
+        print(f'{name:<16} {hits.count():>7} keys  cold {cold * 1e3:6.2f}ms  warm {warm * 1e3:6.2f}ms  '
+              f'100 years of ranges {span * 1e3:6.1f}ms ({len(ranges)})')
+
+if __name__ == '__main__':
+    main()
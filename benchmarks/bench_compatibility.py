@@ -0,0 +1,52 @@
+'''Throughput of pairwise compatibility scoring: Scorer.block on Features
+against the reference score on pairs of PurpleStarCharts, and top_k over a
+whole corpus against every other chart in it.
+Run from the repo root with `python -m benchmarks.bench_compatibility [n]`.'''
+
+import sys
+from time import perf_counter
+import numpy as np
+from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+from src.purple_star_chart.chart_batch import ChartBatch
+from src.purple_star_chart.compatibility import Features, Scorer, top_k, verify
+from benchmarks.corpus import corpus
+
+def main(n=20000, block_size=2048):
+    dts, genders = corpus(n)
+    scorer = Scorer()
+
+    charts = []
+    for dt, g in zip(dts[:100], genders[:100]):
+        chart = PurpleStarChart.initialize_chart(dt, g)
+        chart.add_stars()
+        charts.append(chart)
+    start = perf_counter()
+    pairs, mismatches = verify(charts, scorer)
+    reference_t = (perf_counter() - start) / pairs
+    assert not mismatches, mismatches[:5]
+
+    features = Features.from_batch(ChartBatch.from_solar_dates(dts, genders))
+    block = features[:block_size]
+    scorer.block(block, block)
+    start = perf_counter()
+    for _ in range(5):
+        scorer.block(block, block)
+    block_t = (perf_counter() - start) / (5 * len(block) ** 2)
+
+    start = perf_counter()
+    idx, scores = top_k(features, 10, scorer, block_size=block_size)
+    top_t = perf_counter() - start
+
+    # spot check the tiled top_k against full score rows
+    for row in np.random.default_rng(0).choice(len(features), 20, replace=False):
+        full = scorer.block(features[row:row + 1], features)[0]
+        full[row] = -np.inf
+        assert np.allclose(np.sort(full)[::-1][:10], scores[row])
+
+    print(f'{len(features)} charts, {block_size} x {block_size} blocks')
+    print(f'reference          {reference_t * 1e6:9.2f}us per pair ({pairs} pairs, verified)')
+    print(f'Scorer.block       {block_t * 1e9:9.2f}ns per pair  ({reference_t / block_t:.0f}x)')
+    print(f'top_k(10)          {top_t:9.2f}s for {len(features) ** 2 / 1e6:.0f}M pairs')
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,124 @@
+'''Benchmarks for every hot path, from lunar conversion through each _plot_*
+stage to end-to-end charts per second with and without a process pool.
+Run from the repo root:
+
+    python -m benchmarks.bench_hot_paths                  # run and compare to baselines.json
+    python -m benchmarks.bench_hot_paths --save           # record new baselines
+    python -m benchmarks.bench_hot_paths --only stage --threshold 0.1
+
+Exits with status 1 if any case regressed past the threshold. Baselines are
+only meaningful on the machine that recorded them.'''
+
+import argparse
+import os
+import sys
+from multiprocessing import Pool
+from lunardate import LunarDate
+from src.purple_star_chart import _stage_slots
+from src.purple_star_chart.BaZiChart import BaZiChart
+from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+from src.purple_star_chart.chart_batch import ChartBatch
+from src.purple_star_chart.lunar_index import lunar_from_solar
+from benchmarks.corpus import corpus, SEED
+from benchmarks.harness import Case, BulkCase, run_case, format_result, save_baseline, load_baseline, regressions
+
+default_baseline = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+def _chart(dt, gender):
+    chart = PurpleStarChart.initialize_chart(dt, gender)
+    chart.add_stars()
+    return chart
+
+def _chart_chunk(chunk):
+    for dt, gender in chunk:
+        _chart(dt, gender)
+    return len(chunk)
+
+def _stage_prepare(stage):
+    '''chart with every stage before this one already run'''
+    earlier = list(_stage_slots)[:list(_stage_slots).index(stage)]
+    def prepare(dt, gender):
+        chart = PurpleStarChart.initialize_chart(dt, gender)
+        for name in earlier:
+            getattr(chart, name)()
+        return chart
+    return prepare
+
+def _details_prepare(dt, gender):
+    chart = PurpleStarChart.initialize_chart(dt, gender)
+    for stage in _stage_slots:
+        getattr(chart, stage)()
+    return chart
+
+def _single_process(dts, genders):
+    for dt, gender in zip(dts, genders):
+        _chart(dt, gender)
+    return len(dts)
+
+def _pooled(workers, chunk_size=250):
+    def run(dts, genders):
+        pairs = list(zip(dts, genders))
+        chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+        with Pool(workers) as pool:
+            return sum(pool.imap_unordered(_chart_chunk, chunks))
+    return run
+
+def _batched(dts, genders):
+    return len(ChartBatch.from_solar_dates(dts, genders))
+
+def cases(workers=None):
+    out = [
+        Case('lunardate.fromSolarDate', lambda ymd: LunarDate.fromSolarDate(*ymd),
+             lambda dt, gender: (dt.year, dt.month, dt.day)),
+        Case('lunar_from_solar', lambda state: lunar_from_solar(state[0])),
+        Case('BaZiChart.from_solar_date', lambda state: BaZiChart.from_solar_date(state[0])),
+        Case('initialize_chart', lambda state: PurpleStarChart.initialize_chart(*state)),
+    ]
+    for stage in _stage_slots:
+        out.append(Case(f'stage{stage}', lambda chart, stage=stage: getattr(chart, stage)(),
+                        _stage_prepare(stage)))
+    out += [
+        Case('stage_add_details_to_stars', lambda chart: chart._add_details_to_stars(), _details_prepare),
+        Case('add_stars', lambda chart: chart.add_stars(), PurpleStarChart.initialize_chart),
+        Case('chart', lambda state: _chart(*state)),
+        BulkCase('charts_single_process', _single_process),
+        BulkCase('charts_pool', _pooled(workers)),
+        BulkCase('charts_chart_batch', _batched),
+    ]
+    return out
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', type=int, default=2000, help='corpus size (default 2000)')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--only', nargs='*', help='only run cases whose name contains one of these')
+    parser.add_argument('--workers', type=int, default=None, help='pool size for charts_pool (default all cores)')
+    parser.add_argument('--baseline', default=default_baseline)
+    parser.add_argument('--save', action='store_true', help='write results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown against the baseline before failing (default 0.25 = 25%%)')
+    args = parser.parse_args(argv)
+
+    dts, genders = corpus(args.n, args.seed)
+    results = []
+    for case in cases(args.workers):
+        if args.only and not any(part in case.name for part in args.only):
+            continue
+        res = run_case(case, dts, genders)
+        print(format_result(res), flush=True)
+        results.append(res)
+
+    if args.save:
+        save_baseline(args.baseline, results, {'n': args.n, 'seed': args.seed, 'cpus': os.cpu_count()})
+        print(f'saved baseline to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print('no baseline to compare against, run with --save to make one')
+        return 0
+    failed = regressions(results, load_baseline(args.baseline), args.threshold)
+    for name, metric, old, new in failed:
+        print(f'REGRESSION {name}: {metric} {old:,.1f} -> {new:,.1f}')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+'''Cost of the instrumentation hooks, installed and not. Compares add_stars
+as shipped (hooks checked but none installed) against the bare stage loop it
+replaced, and against add_stars with a Metrics hook installed. Each chart
+is timed under all three back to back and the medians compared. Also times
+the `instrumentation.hooks` check on its own, times the number of checks one
+chart makes. Run from the repo root with
+
+    python -m benchmarks.bench_instrumentation [-n 2000] [--max-overhead 0.03]
+
+Exits with status 1 if the disabled overhead is above --max-overhead.'''
+
+import argparse
+import gc
+import sys
+import timeit
+from time import perf_counter_ns
+from src.purple_star_chart import _stage_slots, instrumentation
+from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+from src.purple_star_chart.instrumentation import Metrics, instrumented
+from benchmarks.corpus import corpus
+
+# one for lunar conversion, one for palace setup, one per stage plus details,
+# and one for the counters at the end of add_stars
+CHECKS_PER_CHART = 2 + len(_stage_slots) + 1 + 1
+
+def _bare_add_stars(chart):
+    '''add_stars the way it was before instrumentation'''
+    for stage in _stage_slots:
+        getattr(chart, stage)()
+    chart._add_details_to_stars()
+
+def _time_once(fn, chart):
+    start = perf_counter_ns()
+    fn(chart)
+    return perf_counter_ns() - start
+
+def _median_us(vals):
+    vals = sorted(vals)
+    return vals[len(vals) // 2] / 1e3
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', type=int, default=2000)
+    parser.add_argument('--max-overhead', type=float, default=0.03)
+    args = parser.parse_args(argv)
+
+    dts, genders = corpus(args.n)
+    metrics = Metrics()
+    variants = {
+        'bare': _bare_add_stars,
+        'disabled': PurpleStarChart.add_stars,
+        'enabled': PurpleStarChart.add_stars
+    }
+    times = {name: [] for name in variants}
+    # every variant charts the same input back to back, in rotating order, and
+    # the medians get compared, so machine noise hits all three alike
+    gc.disable()
+    try:
+        for i, (dt, gender) in enumerate(zip(dts, genders)):
+            names = list(variants)
+            names = names[i % 3:] + names[:i % 3]
+            for name in names:
+                chart = PurpleStarChart.initialize_chart(dt, gender)
+                if name == 'enabled':
+                    with instrumented(metrics):
+                        times[name].append(_time_once(variants[name], chart))
+                else:
+                    times[name].append(_time_once(variants[name], chart))
+            if i % 100 == 99:
+                gc.collect()
+    finally:
+        gc.enable()
+    bare, disabled, enabled = (_median_us(times[name]) for name in variants)
+
+    check_ns = min(timeit.repeat('instrumentation.hooks', globals={'instrumentation': instrumentation},
+                                 number=1000000, repeat=5)) * 1e3
+    overhead = disabled / bare - 1
+    print(f'add_stars, bare stage loop   {bare:8.1f}us')
+    print(f'add_stars, hooks disabled    {disabled:8.1f}us  ({overhead:+.2%})')
+    print(f'add_stars, Metrics installed {enabled:8.1f}us  ({enabled / bare - 1:+.2%})')
+    print(f'hooks check                  {check_ns:8.1f}ns  x {CHECKS_PER_CHART} per chart = '
+          f'{check_ns * CHECKS_PER_CHART / 1e3:.2f}us')
+    if overhead > args.max_overhead:
+        print(f'disabled overhead {overhead:.2%} is above {args.max_overhead:.2%}')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
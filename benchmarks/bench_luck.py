@@ -0,0 +1,82 @@
+'''Cost of a full lifespan of luck overlays: Lifespans reading everything off
+the natal placements, against building a chart per year and reading the
+same things off that.
+Run from the repo root with `python -m benchmarks.bench_luck [n] [years]`.'''
+
+import sys
+from datetime import datetime
+from time import perf_counter
+import numpy as np
+from src.purple_star_chart import _branches, _stems
+from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+from src.purple_star_chart.chart_batch import ChartBatch
+from src.purple_star_chart.luck import Lifespans, lifespan, annual_stars
+from src.purple_star_chart.star_engine import _TRANSFORMS
+from benchmarks.corpus import corpus
+
+def naive_lifespan(solar_dt, gender, years):
+    '''per year: a fresh natal chart for the decade and transformations, and
+    a chart born mid-year for the annual stars'''
+    phase_start = {'water': 2, 'wood': 3, 'metal': 4, 'earth': 5, 'fire': 6}
+    out = []
+    for n in range(years):
+        natal = PurpleStarChart.initialize_chart(solar_dt, gender)
+        natal.add_stars()
+        branch_of = lambda name: _branches.index(natal._get_branch_from_star(name))
+        life = _branches.index(natal.palaces.life.pillar.branch.name)
+        period = (n + 1 - phase_start[natal.elemental_phase]) // 10
+        decade = -1
+        if period >= 0:
+            decade = (life + (-period if natal._traverse_back else period)) % 12
+        year_chart = PurpleStarChart.initialize_chart(datetime(solar_dt.year + n, 6, 1), gender)
+        year_chart.add_stars()
+        ystem = _stems.index(year_chart.bazi.year.stem.name)
+        transforms = [branch_of(targets[ystem]) for targets in _TRANSFORMS.values()]
+        stars = [_branches.index(year_chart._get_branch_from_star(name)) for name in annual_stars]
+        out.append((decade, transforms, stars))
+    return out
+
+def main(n=200, years=120):
+    dts, genders = corpus(n)
+    dts = [dt for dt in dts if dt.year + years <= 2100][:n]
+    genders = genders[:len(dts)]
+
+    naive_n = min(len(dts), 5)
+    start = perf_counter()
+    naive = [naive_lifespan(dt, g, years) for dt, g in zip(dts[:naive_n], genders[:naive_n])]
+    naive_t = (perf_counter() - start) / naive_n
+
+    charts = []
+    for dt, g in zip(dts, genders):
+        chart = PurpleStarChart.initialize_chart(dt, g)
+        chart.add_stars()
+        charts.append(chart)
+    start = perf_counter()
+    singles = [lifespan(chart, years) for chart in charts]
+    single_t = (perf_counter() - start) / len(charts)
+
+    batch = ChartBatch.from_solar_dates(dts, genders)
+    start = perf_counter()
+    bulk = Lifespans.from_batch(batch, years)
+    bulk_t = (perf_counter() - start) / len(dts)
+
+    for i, expected in enumerate(naive):
+        for n, (decade, transforms, stars) in enumerate(expected):
+            for spans, row in ((singles[i], 0), (bulk, i)):
+                assert spans.decade_life[row, n] == decade
+                assert list(spans.annual_transforms[row, n]) == transforms
+                assert list(spans.annual_stars[row, n]) == stars
+    for i, spans in enumerate(singles):
+        for name in ('decade_life', 'decade_transforms', 'annual_transforms', 'annual_stars'):
+            assert np.array_equal(getattr(spans, name)[0], getattr(bulk, name)[i])
+
+    size = sum(a.nbytes for a in (bulk.year, bulk.decade_life, bulk.decade_stem, bulk.decade_transforms,
+                                  bulk.annual_life, bulk.annual_stem, bulk.annual_transforms, bulk.annual_stars))
+    print(f'{years} year lifespans, {len(dts)} charts ({naive_n} for the per year charts)')
+    print(f'chart per year      {naive_t * 1e3:9.2f}ms per lifespan')
+    print(f'lifespan(chart)     {single_t * 1e3:9.3f}ms per lifespan  ({naive_t / single_t:.0f}x)')
+    print(f'Lifespans (batch)   {bulk_t * 1e3:9.4f}ms per lifespan  ({naive_t / bulk_t:.0f}x)')
+    print(f'{size / len(dts):.0f} bytes per lifespan')
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,48 @@
+'''Resident memory per chart: full PurpleStarChart object graphs against
+CompactChart. Run from the repo root with
+`python -m benchmarks.bench_memory [n_charts]`.'''
+
+import gc
+import sys
+import tracemalloc
+from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+from src.purple_star_chart.chart_batch import ChartBatch
+from src.purple_star_chart.compact_chart import CompactChart
+from benchmarks.corpus import corpus
+
+def _measure(build):
+    '''bytes still allocated after build() returns, plus what it returned'''
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, kept
+
+def main(n=2000):
+    dts, genders = corpus(n)
+
+    def full_charts():
+        out = []
+        for dt, gender in zip(dts, genders):
+            chart = PurpleStarChart.initialize_chart(dt, gender)
+            chart.add_stars()
+            out.append(chart)
+        return out
+
+    full_bytes, charts = _measure(full_charts)
+    compact_bytes, compact = _measure(lambda: [CompactChart.from_chart(c) for c in charts])
+    del charts
+    batch = ChartBatch.from_solar_dates(dts, genders)
+    batch_bytes, _ = _measure(lambda: [CompactChart.from_batch(batch, i) for i in range(n)])
+
+    print(f'{n} charts')
+    print(f'PurpleStarChart           {full_bytes / n:10.0f} bytes/chart')
+    print(f'CompactChart              {compact_bytes / n:10.0f} bytes/chart')
+    print(f'CompactChart (from batch) {batch_bytes / n:10.0f} bytes/chart')
+    print(f'ratio                     {full_bytes / compact_bytes:10.1f}x')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
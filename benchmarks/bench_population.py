@@ -0,0 +1,58 @@
+'''Cost of population statistics: building a PurpleStarChart per birth and
+walking its palaces, against PopulationStats counting ChartBatch placements,
+against the analytic version weighting the key space by births per date.
+Run from the repo root with `python -m benchmarks.bench_population [n]`.'''
+
+import sys
+from collections import Counter
+from time import perf_counter
+import numpy as np
+from src.purple_star_chart import _palace_names, _star_slots
+from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+from src.purple_star_chart.chart_batch import ChartBatch
+from src.purple_star_chart.population import PopulationStats, key_weights
+from benchmarks.corpus import corpus
+
+def naive_counts(dts, genders):
+    '''(star name, palace) counts the slow way'''
+    counts = Counter()
+    for dt, gender in zip(dts, genders):
+        chart = PurpleStarChart.initialize_chart(dt, gender)
+        chart.add_stars()
+        for palace, stars in ((name, spec['stars']) for name, spec in chart.to_dict()['palaces'].items()):
+            counts.update((star, palace) for star in stars)
+    return counts
+
+def main(n=20000, chunk_size=5000):
+    dts, genders = corpus(n)
+
+    naive_n = min(n, 1000)
+    start = perf_counter()
+    naive = naive_counts(dts[:naive_n], genders[:naive_n])
+    naive_t = (perf_counter() - start) / naive_n
+
+    start = perf_counter()
+    stats = PopulationStats()
+    for c0 in range(0, n, chunk_size):
+        stats.add(ChartBatch.from_solar_dates(dts[c0:c0 + chunk_size], genders[c0:c0 + chunk_size]))
+    stream_t = (perf_counter() - start) / n
+
+    check = PopulationStats().add(ChartBatch.from_solar_dates(dts[:naive_n], genders[:naive_n]))
+    for (star, palace), count in naive.items():
+        slots = [slot for slot, name in enumerate(_star_slots) if name == star]
+        assert check.star_palace[slots, _palace_names.index(palace)].sum() == count, (star, palace)
+
+    start = perf_counter()
+    weights = key_weights()
+    analytic = PopulationStats.from_key_weights(weights)
+    analytic_t = perf_counter() - start
+    assert np.isclose(analytic.total, weights.sum())
+
+    print(f'{n} charts ({naive_n} built as PurpleStarCharts), chunks of {chunk_size}')
+    print(f'PurpleStarChart walk  {naive_t * 1e6:9.1f}us per chart')
+    print(f'PopulationStats.add   {stream_t * 1e6:9.2f}us per chart  ({naive_t / stream_t:.0f}x)')
+    print(f'analytic, every day   {analytic_t:9.2f}s for {analytic.total:.0f} days '
+          f'({(weights > 0).sum()} keys with births)')
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
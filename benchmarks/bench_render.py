@@ -0,0 +1,58 @@
+'''Chart rendering throughput: svg/html/text from built PurpleStarCharts,
+straight from ChartBatch rows, and export() of a whole record file into a
+zip.
+Run from the repo root with `python -m benchmarks.bench_render [n] [workers]`.'''
+
+import csv
+import os
+import sys
+import tempfile
+import zipfile
+from time import perf_counter
+from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+from src.purple_star_chart.chart_batch import ChartBatch
+from src.purple_star_chart.render import ChartView, renderers, export
+from benchmarks.corpus import corpus
+
+def main(n=5000, workers=0):
+    dts, genders = corpus(n)
+
+    start = perf_counter()
+    charts = []
+    for dt, gender in zip(dts, genders):
+        chart = PurpleStarChart.initialize_chart(dt, gender)
+        chart.add_stars()
+        charts.append(chart)
+    build_t = (perf_counter() - start) / n
+    batch = ChartBatch.from_solar_dates(dts, genders)
+
+    print(f'{n} charts')
+    print(f'{"":8}{"from chart":>14}{"from batch":>14}   (us per chart, drawing only)')
+    for fmt, draw in renderers.items():
+        start = perf_counter()
+        from_charts = [draw(chart) for chart in charts]
+        chart_t = (perf_counter() - start) / n
+        start = perf_counter()
+        from_batch = [draw(ChartView.from_batch(batch, i)) for i in range(n)]
+        batch_t = (perf_counter() - start) / n
+        assert from_charts == from_batch, fmt
+        print(f'{fmt:8}{chart_t * 1e6:14.1f}{batch_t * 1e6:14.1f}')
+    print(f'(building each PurpleStarChart first: {build_t * 1e6:.0f}us)')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'births.csv')
+        with open(source, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['datetime', 'gender'])
+            writer.writerows((dt.isoformat(), gender) for dt, gender in zip(dts, genders))
+        dest = os.path.join(tmp, 'charts.zip')
+        start = perf_counter()
+        stats = export(source, dest, 'svg', workers=workers)
+        export_t = perf_counter() - start
+        assert stats.charts == n and len(zipfile.ZipFile(dest).namelist()) == n
+        size = os.path.getsize(dest)
+    print(f'export svg to zip, {workers or "no"} workers: {n / export_t:.0f} charts/s, '
+          f'{size / n / 1024:.1f}KB per chart compressed')
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
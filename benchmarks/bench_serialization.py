@@ -0,0 +1,54 @@
+'''Size and speed of the binary chart codec against pickle and json.
+Run from the repo root with `python -m benchmarks.bench_serialization [n]`.'''
+
+import json
+import pickle
+import sys
+from time import perf_counter
+from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+from src.purple_star_chart.chart_batch import ChartBatch
+from src.purple_star_chart.chart_codec import encode_charts, encode_batch, ChartArchive
+from benchmarks.corpus import corpus
+
+def _timed(fn):
+    start = perf_counter()
+    out = fn()
+    return out, perf_counter() - start
+
+def main(n=2000):
+    dts, genders = corpus(n)
+    charts = []
+    for dt, gender in zip(dts, genders):
+        chart = PurpleStarChart.initialize_chart(dt, gender)
+        chart.add_stars()
+        charts.append(chart)
+
+    rows = []
+    data, enc = _timed(lambda: pickle.dumps(charts, protocol=pickle.HIGHEST_PROTOCOL))
+    _, dec = _timed(lambda: pickle.loads(data))
+    rows.append(('pickle', len(data), enc, dec, None))
+
+    data, enc = _timed(lambda: json.dumps([c.to_dict() for c in charts]).encode())
+    _, dec = _timed(lambda: json.loads(data))
+    rows.append(('json (to_dict)', len(data), enc, dec, None))
+
+    data, enc = _timed(lambda: encode_charts(charts))
+    _, lazy = _timed(lambda: [view.life_master for view in ChartArchive(data)])
+    _, dec = _timed(lambda: list(ChartArchive(data).charts()))
+    rows.append(('binary', len(data), enc, dec, lazy))
+
+    batch = ChartBatch.from_solar_dates(dts, genders)
+    data, enc = _timed(lambda: encode_batch(batch))
+    _, lazy = _timed(lambda: ChartArchive(data).records()['life_master'].sum())
+    rows.append(('binary (encode_batch)', len(data), enc, None, lazy))
+
+    print(f'{n} charts; times are per chart')
+    print(f'{"format":<22} {"bytes":>8} {"encode":>10} {"decode":>10} {"one field":>10}')
+    for name, size, enc, dec, lazy in rows:
+        fmt = lambda t: '-' if t is None else f'{t / n * 1e6:.1f}us'
+        print(f'{name:<22} {size / n:>8.0f} {fmt(enc):>10} {fmt(dec):>10} {fmt(lazy):>10}')
+    print('decode is back to full PurpleStarCharts for pickle and binary, plain dicts for json;')
+    print('one field reads life_master per chart (through the numpy record view for encode_batch)')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,74 @@
+'''Worker startup time and memory with shared tables: every worker building
+its own placement table and chart index, against the first one publishing
+them and the rest attaching. Workers are spawned fresh (not forked) so
+nothing is inherited from this process, each charts the same batch after
+startup, and memory is read from /proc/self/smaps_rollup: pss shares out
+mapped pages between the processes using them, uss is what a worker holds
+on its own.
+Run from the repo root with `python -m benchmarks.bench_shared_tables [workers]`.'''
+
+import multiprocessing as mp
+import sys
+import tempfile
+from time import perf_counter
+import numpy as np
+from src.purple_star_chart import shared_tables
+from benchmarks.corpus import corpus
+
+def _memory():
+    '''(pss, uss) of this process in MB'''
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return fields['Pss'], fields['Private_Clean'] + fields['Private_Dirty']
+
+def _worker(root, shared, dts, genders, ready, done, out):
+    from src.purple_star_chart.chart_batch import ChartBatch
+    from src.purple_star_chart.star_engine import use_key_table
+
+    start = perf_counter()
+    use_key_table(shared_tables.placement_table(root, shared))
+    index = shared_tables.chart_index(root, shared)
+    startup = perf_counter() - start
+    batch = ChartBatch.from_solar_dates(dts, genders)
+    hits = index.star_bits('zi_wei', palace='life').count()
+    ready.put(None)
+    # measure once every worker is up, so pss is shared out between all of them
+    done.wait()
+    out.put((startup, *_memory(), int(batch.placements.positions.sum()), hits))
+
+def run(n_workers, root, shared, dts, genders):
+    ctx = mp.get_context('spawn')
+    ready, out, done = ctx.Queue(), ctx.Queue(), ctx.Event()
+    procs = [ctx.Process(target=_worker, args=(root, shared, dts, genders, ready, done, out))
+             for _ in range(n_workers)]
+    for proc in procs:
+        proc.start()
+    for _ in procs:
+        ready.get()
+    done.set()
+    results = [out.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    return results
+
+def main(n_workers=4, n=20000):
+    dts, genders = corpus(n)
+    with tempfile.TemporaryDirectory() as root:
+        private = run(n_workers, root, False, dts, genders)
+        shared_tables.publish('placements', root)
+        shared_tables.publish('chart_index', root)
+        shared = run(n_workers, root, True, dts, genders)
+    assert len({r[3:] for r in private + shared}) == 1, 'workers disagree'
+
+    print(f'{n_workers} spawned workers, {n} charts each, tables under a temp dir')
+    print(f'{"":10}{"startup s":>12}{"pss MB":>10}{"uss MB":>10}')
+    for label, results in (('private', private), ('shared', shared)):
+        startup, pss, uss = np.array([r[:3] for r in results]).mean(axis=0)
+        print(f'{label:10}{startup:12.3f}{pss:10.1f}{uss:10.1f}')
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,18 @@
+'''Fixed, seeded inputs shared by every benchmark, so numbers from different
+runs (and machines) are charting the same births.'''
+
+import random
+from datetime import datetime, timedelta
+from src.purple_star_chart.lunar_index import first_date, last_date
+
+SEED = 20240101
+
+def corpus(n, seed=SEED):
+    '''n (datetime, gender) pairs spread uniformly over the whole supported
+    date range, to the minute, with both genders'''
+    rng = random.Random(seed)
+    start = datetime.combine(first_date, datetime.min.time())
+    minutes = ((last_date - first_date).days + 1) * 24 * 60
+    dts = [start + timedelta(minutes=rng.randrange(minutes)) for _ in range(n)]
+    genders = [rng.choice(['male', 'female']) for _ in range(n)]
+    return dts, genders
@@ -0,0 +1,121 @@
+'''Timing, allocation and baseline bookkeeping for the benchmark suite.
+A Case times one call per corpus entry, with an untimed prepare step for
+whatever setup the call needs, and reports throughput, latency percentiles
+and peak allocation per call. A BulkCase times one run over the whole corpus
+and only reports throughput. Results can be saved as a baseline json and
+later runs compared against it.'''
+
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from attrs import define, asdict
+
+@define
+class Case:
+    name: str
+    run: object             # run(state), the part that gets timed
+    prepare: object = None  # prepare(dt, gender) -> state, untimed; defaults to (dt, gender)
+
+@define
+class BulkCase:
+    name: str
+    run: object             # run(dts, genders) -> number of charts made
+
+@define
+class Result:
+    name: str
+    calls: int
+    seconds: float
+    throughput: float       # calls per second
+    p50_us: float = None
+    p90_us: float = None
+    p99_us: float = None
+    max_us: float = None
+    alloc_kb: float = None  # mean peak traced allocation per call
+
+def percentile(sorted_vals, pct):
+    '''nearest-rank percentile of an already sorted list'''
+    if not sorted_vals:
+        return None
+    rank = max(0, min(len(sorted_vals) - 1, round(pct / 100 * len(sorted_vals)) - 1))
+    return sorted_vals[rank]
+
+def _states(case, dts, genders):
+    prepare = case.prepare or (lambda dt, gender: (dt, gender))
+    return (prepare(dt, gender) for dt, gender in zip(dts, genders))
+
+def run_case(case, dts, genders, warmup=20, alloc_calls=200):
+    if isinstance(case, BulkCase):
+        gc.collect()
+        start = time.perf_counter()
+        made = case.run(dts, genders)
+        seconds = time.perf_counter() - start
+        return Result(case.name, made, seconds, made / seconds)
+
+    for state in _states(case, dts[:warmup], genders[:warmup]):
+        case.run(state)
+
+    gc.collect()
+    timings = []
+    clock = time.perf_counter_ns
+    for state in _states(case, dts, genders):
+        start = clock()
+        case.run(state)
+        timings.append(clock() - start)
+
+    # allocations get their own pass, tracemalloc slows everything down
+    peaks = []
+    tracemalloc.start()
+    for state in _states(case, dts[:alloc_calls], genders[:alloc_calls]):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        case.run(state)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    timings.sort()
+    seconds = sum(timings) / 1e9
+    return Result(
+        case.name, len(timings), seconds, len(timings) / seconds,
+        percentile(timings, 50) / 1e3, percentile(timings, 90) / 1e3,
+        percentile(timings, 99) / 1e3, timings[-1] / 1e3,
+        sum(peaks) / len(peaks) / 1024
+    )
+
+def format_result(res):
+    if res.p50_us is None:
+        return f'{res.name:<28} {res.throughput:>12,.0f}/s  ({res.calls} charts in {res.seconds:.2f}s)'
+    return (f'{res.name:<28} {res.throughput:>12,.0f}/s  p50 {res.p50_us:>9.1f}us  '
+            f'p90 {res.p90_us:>9.1f}us  p99 {res.p99_us:>9.1f}us  alloc {res.alloc_kb:>8.1f}KB')
+
+def save_baseline(path, results, meta):
+    out = {
+        'meta': {'python': sys.version.split()[0], 'platform': platform.platform(), **meta},
+        'results': {res.name: asdict(res) for res in results}
+    }
+    with open(path, 'w') as f:
+        json.dump(out, f, indent=2)
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+def regressions(results, baseline, threshold):
+    '''(name, metric, baseline, current) for every case that got slower than
+    the baseline by more than threshold (0.25 = 25%). Latency cases compare
+    p50, bulk cases throughput; cases missing from the baseline are skipped.'''
+    out = []
+    base = baseline['results']
+    for res in results:
+        old = base.get(res.name)
+        if old is None:
+            continue
+        if res.p50_us is not None and old.get('p50_us') is not None:
+            if res.p50_us > old['p50_us'] * (1 + threshold):
+                out.append((res.name, 'p50_us', old['p50_us'], res.p50_us))
+        elif res.throughput < old['throughput'] / (1 + threshold):
+            out.append((res.name, 'throughput', old['throughput'], res.throughput))
+    return out
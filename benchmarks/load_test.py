@@ -0,0 +1,92 @@
+'''Load test for the chart service. Opens --concurrency keep-alive
+connections that between them send --requests single chart requests drawn
+from the benchmark corpus, then reports throughput and latency percentiles.
+Starts its own service in-process unless --url points at a running one.
+
+    python -m benchmarks.load_test --concurrency 1000 --requests 20000
+    python -m benchmarks.load_test --url http://127.0.0.1:8080'''
+
+import argparse
+import asyncio
+import sys
+from time import perf_counter
+from urllib.parse import urlsplit, quote
+from src.purple_star_chart.service import ChartService
+from benchmarks.corpus import corpus
+from benchmarks.harness import percentile
+
+async def _get(reader, writer, host, path):
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+async def _client(host, port, paths, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for path in paths:
+            start = perf_counter()
+            status = await _get(reader, writer, host, path)
+            latencies.append(perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+async def run(url, concurrency, n_requests, workers, max_batch, max_delay):
+    service = None
+    if url is None:
+        service = await ChartService(port=0, workers=workers, max_batch=max_batch, max_delay=max_delay).start()
+        host, port = service.host, service.port
+    else:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port or 80
+
+    dts, genders = corpus(n_requests)
+    paths = [f'/chart?datetime={quote(dt.isoformat())}&gender={g}' for dt, g in zip(dts, genders)]
+    latencies, statuses = [], {}
+    try:
+        # warm the worker pool up so process start-up isn't in the numbers
+        await _client(host, port, paths[:10], [], {})
+        start = perf_counter()
+        await asyncio.gather(*(_client(host, port, paths[i::concurrency], latencies, statuses)
+                               for i in range(concurrency)))
+        elapsed = perf_counter() - start
+    finally:
+        if service is not None:
+            batches = service.metrics.snapshot()['counters']
+            await service.close()
+
+    latencies.sort()
+    print(f'{len(latencies)} requests over {concurrency} connections in {elapsed:.2f}s')
+    print(f'throughput  {len(latencies) / elapsed:10,.0f} req/s')
+    for pct in (50, 90, 99):
+        print(f'p{pct:<10} {percentile(latencies, pct) * 1e3:10.2f} ms')
+    print(f'max         {latencies[-1] * 1e3:10.2f} ms')
+    print(f'statuses    {statuses}')
+    if service is not None and batches.get('batches'):
+        print(f'mean batch  {batches["batched_charts"] / batches["batches"]:10.1f} charts')
+    return 0 if set(statuses) == {200} else 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default=None, help='service to test (default: start one in-process)')
+    parser.add_argument('--concurrency', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-delay-ms', type=float, default=2.0)
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args.url, args.concurrency, args.requests, args.workers,
+                           args.max_batch, args.max_delay_ms / 1000))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,8 +5,10 @@ the BaZiDate.from_datetime() method.'''
 from lunardate import LunarDate
 from attrs import define
 from datetime import datetime, date
-from src.purple_star_chart import _stem_lookup, _branch_lookup, _stems, _branches
+from src.purple_star_chart import _stem_lookup, _branch_lookup, _stems, _branches, instrumentation
 from src.purple_star_chart.constructor_classes import Pillar
+from src.purple_star_chart.lunar_index import lunar_from_solar
+from src.purple_star_chart.solar_terms import pillar_locs as solar_term_pillars, month_stem
 
 @define
 class BaZiChart():
@@ -18,12 +20,19 @@ class BaZiChart():
     hour: Pillar
 
     @classmethod
-    def from_solar_date(cls, dt):
+    def from_solar_date(cls, dt, solar_terms=False):
         '''Intended method for human initialization.
         Takes a gregorian date as a datetime object; does NOT work with
-        string input.'''
+        string input.
+        By default the year pillar follows the gregorian year and the month
+        branch the lunar month. With solar_terms=True they switch at solar
+        terms instead, the traditional way: the year at li chun and the
+        month at each jie, with the month stem counted on from the year's.'''
         # convert to lunar calendar for reference
-        ldate = LunarDate.fromSolarDate(dt.year, dt.month, dt.day)
+        if instrumentation.hooks:
+            ldate = instrumentation.timed('lunar_conversion', lunar_from_solar, dt)
+        else:
+            ldate = lunar_from_solar(dt)
         cycle_loc = (dt.year - 3) % 60
 
         # year init
@@ -39,6 +48,12 @@ class BaZiChart():
         mbranch = _branch_lookup[_branches[(ldate.month + 1) % 12]]
         mpillar = Pillar('month', mstem, mbranch)
 
+        if solar_terms:
+            cycle, mb_loc = solar_term_pillars(dt)
+            ypillar = Pillar('year', _stem_lookup[_stems[cycle % 10]], _branch_lookup[_branches[cycle % 12]])
+            mstem = _stem_lookup[_stems[month_stem(cycle % 10, mb_loc)]]
+            mpillar = Pillar('month', mstem, _branch_lookup[_branches[mb_loc]])
+
         # day init
         days_diff = (dt.date() - date(2000, 1, 7)).days
         if days_diff != 0:
@@ -59,14 +74,44 @@ class BaZiChart():
         hpillar = Pillar('hour', hstem, hbranch)
 
         return cls(dt, ldate, ypillar, mpillar, dpillar, hpillar)
+
+    @classmethod
+    def from_solar_dates(cls, dts, solar_terms=False):
+        '''batch version of from_solar_date for lots of datetimes at once.
+        Returns a BaZiBatch of integer coded numpy arrays rather than one
+        BaZiChart per datetime; use its chart(i) to get a BaZiChart back.'''
+        from src.purple_star_chart.bazi_batch import BaZiBatch
+        return BaZiBatch.from_solar_dates(dts, solar_terms)
     
-    def pprint(self):
-        '''pretty prints bazi results for human use'''
+    def to_dict(self):
+        '''plain dict version of the chart, e.g. for json'''
+        ldate = self.lunar_date
+        out = {
+            'solar_date': self.solar_date.isoformat() if self.solar_date is not None else None,
+            'lunar_date': {'year': ldate.year, 'month': ldate.month, 'day': ldate.day,
+                           'leap': ldate.isLeapMonth}
+        }
+        for pillar in [self.year, self.month, self.day, self.hour]:
+            out[pillar.type] = {'stem': pillar.stem.name, 'branch': pillar.branch.name}
+        return out
+
+    def pformat(self, compact=False):
+        '''the pprint text as a string; compact=True gives a single line
+        instead, e.g. for streaming lots of charts'''
+        pillars = [self.year, self.month, self.day, self.hour]
+        if compact:
+            when = self.solar_date.isoformat() if self.solar_date is not None else '-'
+            ldate = self.lunar_date
+            leap = 'L' if ldate.isLeapMonth else ''
+            pillar_strs = ' '.join(f'{p.stem.name}-{p.branch.name}' for p in pillars)
+            return f'{when} lunar {ldate.year}-{ldate.month:02d}{leap}-{ldate.day:02d} {pillar_strs}'
+
         pillar_fstr = '''
 {ptype} PILLAR: {sname} {bname}
-  {spol} {selem} {banim}'''
-        
-        for pillar in [self.year, self.month, self.day, self.hour]:
+  {spol} {selem} {banim}
+'''
+        out = []
+        for pillar in pillars:
             strvars = {
                 'ptype': pillar.type.upper(),
                 'sname': pillar.stem.name.capitalize(),
@@ -75,5 +120,9 @@ class BaZiChart():
                 'selem': pillar.stem.element.capitalize(),
                 'banim': pillar.branch.animal.capitalize()
             }
-            print(pillar_fstr.format(**strvars))
-        print()
+            out.append(pillar_fstr.format(**strvars))
+        return ''.join(out) + '\n'
+
+    def pprint(self):
+        '''pretty prints bazi results for human use'''
+        print(self.pformat(), end='')
@@ -3,10 +3,38 @@
 from attrs import define, field
 from datetime import datetime
 from .BaZiChart import BaZiChart
-from src.purple_star_chart import _stem_lookup, _branch_lookup, _stems, _branches
-from src.purple_star_chart.constructor_classes import Pillar, PSPalace, PSPalaces, Star
+from src.purple_star_chart import _stem_lookup, _branch_lookup, _stems, _branches, _palace_names, _star_slots, _stage_slots, instrumentation
+from src.purple_star_chart.constructor_classes import Pillar, PSPalace, PSPalaces, Star, LazyStarList
+from src.purple_star_chart.chart_key import ChartKey
+from src.purple_star_chart.magnitudes import slot_names as _slot_magnitudes
 from lunardate import LunarDate
 
+# what each _plot_* stage reads: chart values (see _stage_values) and stars
+# placed by earlier stages. Anything placed by palace name rather than branch
+# depends on 'life', since that's what decides which palace sits where.
+_stage_deps = {
+    '_plot_ziwei': ({'phase', 'day'}, set()),
+    '_plot_major_stars': (set(), {'zi_wei'}),
+    '_plot_hour_stars': ({'hour', 'ybranch'}, set()),
+    '_plot_month_stars': ({'month'}, set()),
+    '_plot_day_stars': ({'day'}, {'zuo_fu', 'you_bi', 'wen_chang', 'wen_qu'}),
+    '_plot_year_stars': ({'ystem'}, {'lian_zhen', 'tian_ji', 'tian_tong', 'tai_yin', 'tan_lang', 
+                                     'wu_qu', 'tai_yang', 'ju_men', 'tian_liang', 'po_jun', 
+                                     'zi_wei', 'wen_chang', 'you_bi', 'wen_qu', 'zuo_fu'}),
+    '_plot_boshi': ({'back'}, {'lu_cun'}),
+    '_plot_yearbr_stars': ({'ybranch', 'life', 'body'}, set()),
+    '_plot_changshen': ({'phase', 'back'}, set()),
+    '_plot_misc_stars': ({'ystem', 'ybranch', 'life'}, set())
+}
+
+_branch_locs = {name: loc for loc, name in enumerate(_branches)}
+
+# where each stage's placements sit in _placements / _star_slots
+_stage_spans = {}
+for _stage, _slots in _stage_slots.items():
+    _start = sum(len(v) for v in _stage_spans.values())
+    _stage_spans[_stage] = range(_start, _start + len(_slots))
+
 @define
 class PurpleStarChart:
     '''top level object for a purple star chart'''
@@ -20,14 +48,35 @@ class PurpleStarChart:
     _traverse_back: bool
     elemental_phase: str
     _palace_by_star: dict = field(factory=dict)
+    # (star name, palace, Star, branch index) for every placement, in slot order
+    _placements: list = field(factory=list, repr=False)
+    _lazy_stages: dict = field(default=None, repr=False, eq=False)
 
     @classmethod
     def initialize_chart(cls, solar_dt, gender):
         '''set up an empty chart based on date from gregorian calendar
         requires python datetime.date or datetime.datetime format'''
-        ldate = LunarDate.fromSolarDate(solar_dt.year, solar_dt.month, solar_dt.day)
         this_bazi = BaZiChart.from_solar_date(solar_dt)
+        if instrumentation.hooks:
+            return instrumentation.timed('palace_setup', cls._from_parts, solar_dt, this_bazi.lunar_date, 
+                                         this_bazi, gender)
+        return cls._from_parts(solar_dt, this_bazi.lunar_date, this_bazi, gender)
+
+    @classmethod
+    def from_key(cls, key):
+        '''set up an empty chart straight from a ChartKey, no gregorian date
+        needed. Only the parts of the bazi that star placement reads (year
+        pillar, hour branch) are filled in, and the lunar date is whatever
+        key.lunar_date() picks.'''
+        ystem = _stem_lookup[_stems[key.year_stem]]
+        ybranch = _branch_lookup[_branches[key.year_branch]]
+        ldate = key.lunar_date()
+        this_bazi = BaZiChart(None, ldate, Pillar('year', ystem, ybranch), None, None,
+                              Pillar('hour', None, _branch_lookup[_branches[key.hour]]))
+        return cls._from_parts(None, ldate, this_bazi, key.gender)
 
+    @classmethod
+    def _from_parts(cls, solar_dt, ldate, this_bazi, gender):
         # reorder branches from yin, reorder stems for matching based on year stem
         palace_branch_order = _branches[2:len(_branches)] + ['zi', 'chou']
         palace_stem_start = ((_stems.index(this_bazi.year.stem.name) % 5) * 2 + 2) % 10
@@ -54,9 +103,8 @@ class PurpleStarChart:
         # generate pillars for all palaces based on life palace location and reordered branches/stems
         palaces_dict = dict()
         palaces_bybranch = dict()
-        palace_names = ['life', 'siblings', 'spouse', 'children', 'wealth', 'health', 'travel', 'friends', 'career', 'property', 'fortune', 'parents']
-        for palace in palace_names:
-            distance = palace_names.index(palace)
+        for palace in _palace_names:
+            distance = _palace_names.index(palace)
             lookup_name = palace_branch_order[(lp_branch_loc + distance) % 12]
             this_stem, this_branch = palace_pillars[lookup_name]
             this_pillar = Pillar(palace, this_stem, this_branch)
@@ -97,15 +145,12 @@ class PurpleStarChart:
 
         this_loc = _branches.index(start_loc) if isinstance(start_loc, str) else start_loc
         offset = neg(offset) if back == True else offset
-        this_branch = _branches[(this_loc + offset) % 12]
-        palace = self._palace_by_branch[this_branch]
-        palace.stars.append(Star(star_name))
-        self._palace_by_star[star_name] = palace
+        br_loc = (this_loc + offset) % 12
+        self._place_star(star_name, self._palace_by_branch[_branches[br_loc]], br_loc)
 
     def _add_star_by_palace(self, star, palace):
         this_pal = getattr(self.palaces, palace) if isinstance(palace, str) else palace
-        this_pal.stars.append(Star(star))
-        self._palace_by_star[star] = this_pal
+        self._place_star(star, this_pal, _branch_locs[this_pal.pillar.branch.name])
 
     def _apply_branch_traversal(self, starmaps, backstars=[], **kwargs):
         for star, loc in starmaps.items():
@@ -326,7 +371,7 @@ class PurpleStarChart:
             self._add_star_by_branch(star, this_br)
 
         # fei lian
-        this_map = [_branches[8:11], _branches[5:8], _branches[2:5], _branches[-1:2]]
+        this_map = [_branches[8:11], _branches[5:8], _branches[2:5], _branches[-1:] + _branches[0:2]]
         selector = ybr_ind // 3
         mod3_ind = ybr_ind % 3
         this_br = this_map[selector][mod3_ind]
@@ -417,15 +462,238 @@ class PurpleStarChart:
         bm_star = self._get_star_obj(bm_name)
         bm_star.isBodyMaster = True
 
-    def add_stars(self):
-        self._plot_ziwei()
-        self._plot_major_stars()
-        self._plot_hour_stars()
-        self._plot_month_stars()
-        self._plot_day_stars()
-        self._plot_year_stars()
-        self._plot_boshi()
-        self._plot_yearbr_stars()
-        self._plot_changshen()
-        self._plot_misc_stars()
-        self._add_details_to_stars()
+        self._add_magnitudes()
+
+    def _add_magnitudes(self):
+        '''brightness of every placed star, by slot and the branch it's on'''
+        for (_, _, star, br_loc), names in zip(self._placements, _slot_magnitudes):
+            star.magnitude = names[br_loc]
+
+    def add_stars(self, lazy=False):
+        '''places every star on the chart. With lazy=True nothing is placed
+        yet; locate() and major_stars() run just the stages they need, and
+        the first time any palace's star list is touched the rest of the
+        chart gets filled in, ending up identical to the eager version.'''
+        if lazy:
+            self._lazy_stages = {}
+            for palace in self._palace_by_branch.values():
+                palace.stars = LazyStarList(palace.stars, self._finish_lazy)
+            return
+        for stage in _stage_slots:
+            self._run_stage(stage)
+        self._run_stage('_add_details_to_stars')
+        if instrumentation.hooks:
+            instrumentation.count('charts_built')
+            instrumentation.count('stars_placed', len(self._placements))
+
+    def _run_stage(self, stage):
+        if instrumentation.hooks:
+            instrumentation.timed(stage, getattr(self, stage), subject=self)
+        else:
+            getattr(self, stage)()
+
+    def _set_lazy_hooks(self, hook):
+        for palace in self._palace_by_branch.values():
+            palace.stars._force = hook
+
+    def _ensure_stages(self, stages):
+        '''runs any of these stages (and what they depend on) that a lazy
+        chart hasn't run yet'''
+        if self._lazy_stages is None:
+            return
+        order = list(_stage_slots)
+        needed = set(stages)
+        for i in reversed(range(len(order))):
+            if order[i] in needed:
+                stars = _stage_deps[order[i]][1]
+                needed.update(s for s in order[:i] if stars & set(_stage_slots[s]))
+
+        # stage methods append to the palace lists, which mustn't set off the
+        # lazy hooks while we're in here
+        self._set_lazy_hooks(None)
+        reorder = False
+        for i, stage in enumerate(order):
+            if stage not in needed or stage in self._lazy_stages:
+                continue
+            reorder = reorder or any(s in self._lazy_stages for s in order[i + 1:])
+            start = len(self._placements)
+            before = {name: len(getattr(self.palaces, name).stars) for name in _palace_names}
+            self._run_stage(stage)
+            added = {name: getattr(self.palaces, name).stars[n:] for name, n in before.items()}
+            self._lazy_stages[stage] = (self._placements[start:], added)
+        if reorder:
+            self._reorder_lazy()
+        self._set_lazy_hooks(self._finish_lazy)
+
+    def _reorder_lazy(self):
+        '''puts stars from stages that ran out of order back in add_stars
+        order, both in the palace lists and in _placements'''
+        placements = []
+        by_palace = {name: [] for name in _palace_names}
+        for stage in _stage_slots:
+            if stage in self._lazy_stages:
+                stage_placements, added = self._lazy_stages[stage]
+                placements += stage_placements
+                for name, stars in added.items():
+                    by_palace[name] += stars
+        self._placements[:] = placements
+        for name, stars in by_palace.items():
+            list.__setitem__(getattr(self.palaces, name).stars, slice(None), stars)
+        self._palace_by_star = {star_name: palace for star_name, palace, _, _ in placements}
+
+    def _finish_lazy(self):
+        if self._lazy_stages is None:
+            return
+        self._ensure_stages(_stage_slots)
+        self._set_lazy_hooks(None)
+        self._lazy_stages = None
+        self._run_stage('_add_details_to_stars')
+        if instrumentation.hooks:
+            instrumentation.count('charts_built')
+            instrumentation.count('stars_placed', len(self._placements))
+
+    def locate(self, star_name):
+        '''palace a star is in; on a lazy chart only runs the stages needed
+        to place it. Names placed twice give the later placement, same as
+        _palace_by_star.'''
+        stages = [stage for stage, stars in _stage_slots.items() if star_name in stars]
+        if not stages:
+            raise ValueError(f'unknown star {star_name}')
+        self._ensure_stages(stages)
+        return self._palace_by_star[star_name]
+
+    def major_stars(self):
+        '''names of the 14 major stars by palace name, without placing any
+        other stars on a lazy chart'''
+        self._ensure_stages(['_plot_ziwei', '_plot_major_stars'])
+        # these are the first two stages, so their placements always lead
+        # _placements (tian_fu gets placed again later, so not _palace_by_star)
+        out = {name: [] for name in _palace_names}
+        for star_name, palace, _, _ in self._placements[:_stage_spans['_plot_major_stars'].stop]:
+            out[palace.name].append(star_name)
+        return out
+
+    def _stage_values(self):
+        '''the chart values _stage_deps refers to'''
+        return {
+            'day': self.lunar_date.day,
+            'month': self.lunar_date.month,
+            'hour': self._hour_offset,
+            'ystem': self.bazi.year.stem.name,
+            'ybranch': self.bazi.year.branch.name,
+            'phase': self.elemental_phase,
+            'back': self._traverse_back,
+            'life': self.palaces.life.pillar.branch.name,
+            'body': self.palaces.body.pillar.branch.name
+        }
+
+    def with_inputs(self, solar_dt=None, gender=None):
+        '''new chart for a different birth datetime and/or gender, reusing
+        this one's work wherever it can. Only stages whose inputs actually
+        changed, or that read a star which moved, are rerun; everything else
+        is copied over by branch. The result is the same as building the new
+        chart from scratch.'''
+        self._finish_lazy()
+        solar_dt = self.solar_date if solar_dt is None else solar_dt
+        gender = self.gender if gender is None else gender
+        bazi = self.bazi if solar_dt == self.solar_date else BaZiChart.from_solar_date(solar_dt)
+        new = type(self)._from_parts(solar_dt, bazi.lunar_date, bazi, gender)
+        if len(self._placements) != len(_star_slots):
+            return new
+
+        old_values = self._stage_values()
+        changed = {k for k, v in new._stage_values().items() if old_values[k] != v}
+        moved = set()
+        for stage, span in _stage_spans.items():
+            values, stars = _stage_deps[stage]
+            old = [(name, br_loc) for name, _, _, br_loc in self._placements[span.start:span.stop]]
+            if values & changed or stars & moved:
+                getattr(new, stage)()
+                placed = new._placements[span.start:span.stop]
+                moved.update(name for (name, br_loc), placement in zip(old, placed) if placement[3] != br_loc)
+            else:
+                for name, br_loc in old:
+                    new._place_star(name, new._palace_by_branch[_branches[br_loc]], br_loc)
+        new._add_details_to_stars()
+        return new
+
+    def to_dict(self):
+        '''plain dict version of a chart that has had add_stars run'''
+        masters = {}
+        palaces = {}
+        for name in _palace_names:
+            palace = getattr(self.palaces, name)
+            for star in palace.stars:
+                if star.isLifeMaster:
+                    masters['life_master'] = star.name
+                if star.isBodyMaster:
+                    masters['body_master'] = star.name
+            palaces[name] = {
+                'stem': palace.pillar.stem.name,
+                'branch': palace.pillar.branch.name,
+                'stars': [star.name for star in palace.stars]
+            }
+        return {
+            'solar_date': self.solar_date.isoformat() if self.solar_date is not None else None,
+            'gender': self.gender,
+            'bazi': self.bazi.to_dict(),
+            'elemental_phase': self.elemental_phase,
+            'body_palace': self.palaces.body.name,
+            'life_master': masters.get('life_master'),
+            'body_master': masters.get('body_master'),
+            'palaces': palaces
+        }
+
+    def pformat(self):
+        '''the twelve palace board as text, see render.text'''
+        from src.purple_star_chart.render import text
+        return text(self)
+
+    def pprint(self):
+        '''prints the chart as a text board for human use'''
+        print(self.pformat(), end='')
+
+    @property
+    def key(self):
+        '''the ChartKey that fully determines this chart's stars'''
+        return ChartKey.from_bazi(self.bazi, self.gender)
+
+    def _slot_branches(self):
+        '''branch index of every star slot (see _star_slots), read back from
+        the placements made by add_stars'''
+        self._finish_lazy()
+        return [br_loc for _, _, _, br_loc in self._placements]
+
+    def _apply_placements(self, slot_branches, lm_slot, bm_slot):
+        '''fills in stars from precomputed slot branches instead of running
+        the _plot_* passes; the end result matches add_stars'''
+        palace_at = [self._palace_by_branch[branch] for branch in _branches]
+        for star_name, br_loc in zip(_star_slots, slot_branches, strict=True):
+            self._place_star(star_name, palace_at[br_loc], br_loc)
+        self._placement_star(lm_slot).isLifeMaster = True
+        self._placement_star(bm_slot).isBodyMaster = True
+        self._add_magnitudes()
+
+    def _master_slots(self):
+        '''star slots of the life master and body master'''
+        stars = self._slot_stars()
+        life_master = next(i for i, star in enumerate(stars) if star.isLifeMaster)
+        body_master = next(i for i, star in enumerate(stars) if star.isBodyMaster)
+        return life_master, body_master
+
+    def _slot_stars(self):
+        '''Star object for every placement, in _placements order, so names
+        placed twice are told apart by slot'''
+        self._finish_lazy()
+        return [star for _, _, star, _ in self._placements]
+
+    def _place_star(self, star_name, palace, br_loc):
+        '''bare bones placement for stars whose palace (on branch br_loc) is
+        already known'''
+        star = Star(star_name)
+        palace.stars.append(star)
+        self._palace_by_star[star_name] = palace
+        self._placements.append((star_name, palace, star, br_loc))
+
+    def _placement_star(self, slot):
+        return self._placements[slot][2]
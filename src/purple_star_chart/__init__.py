@@ -30,3 +30,48 @@ _branch_lookup = {
     'hai': Branch(0, 'hai', 'pig', 'water')
 }
 _branches = list(_branch_lookup)
+
+_palace_names = ['life', 'siblings', 'spouse', 'children', 'wealth', 'health', 
+                 'travel', 'friends', 'career', 'property', 'fortune', 'parents']
+
+# indexed by elemental phase number - 2
+_phase_names = ['water', 'wood', 'metal', 'earth', 'fire']
+
+_genders = ['male', 'female']
+
+# star brightness levels, brightest first
+_magnitude_names = ['miao', 'wang', 'de', 'li', 'ping', 'bu', 'xian']
+
+# every star placement made by PurpleStarChart.add_stars, grouped by the
+# _plot_* stage that makes it, in the order it happens; a few names (tian_fu,
+# tian_yue, fei_lian) are placed twice by different rules, so a slot is a 
+# placement rather than a unique star
+_stage_slots = {
+    '_plot_ziwei': ['zi_wei'],
+    '_plot_major_stars': [
+        'tian_ji', 'tai_yang', 'wu_qu', 'tian_tong', 'lian_zhen', 'tian_fu', 
+        'tai_yin', 'tan_lang', 'ju_men', 'tian_xiang', 'tian_liang', 'qi_sha', 
+        'po_jun'],
+    '_plot_hour_stars': [
+        'wen_chang', 'wen_qu', 'di_jie', 'di_kong', 'tai_fu', 'feng_gao',
+        'ling_xing', 'huo_xing'],
+    '_plot_month_stars': [
+        'zuo_fu', 'you_bi', 'tian_xing', 'tian yao', 'yue_ma', 'jie_shen',
+        'tian_wu', 'tian_yue', 'yin_sha'],
+    '_plot_day_stars': ['san_tai', 'ba_zuo', 'en_guang', 'tian_gui'],
+    '_plot_year_stars': [
+        'lu_cun', 'qing_yang', 'tuo_luo', 'tian_yue', 'tian_kui', 'tian_gong',
+        'tian_fu', 'hua_lu', 'hua_quan', 'hua_ke', 'hua_ji'],
+    '_plot_boshi': [
+        'bo_shi', 'li_shi', 'qing_long', 'xiao_hao', 'jiang_jun', 'zou_shu',
+        'fei_lian', 'xi_shen', 'bing_fu', 'da hao', 'fu_bing', 'guan_fu'],
+    '_plot_yearbr_stars': [
+        'tian_ku', 'tian_xu', 'long_chi', 'feng_ge', 'hong_luan', 'tian_xi',
+        'tian_kong', 'tai_sui', 'gu_chen', 'gua_su', 'fei_lian', 'po_sui',
+        'tian_cai', 'tian_shou', 'tian_ma', 'hua_gai', 'xian_chi'],
+    '_plot_changshen': [
+        'chang_shen', 'mu_yu', 'guan_dai', 'lin_guan', 'di_wang', 'shuai',
+        'bing', 'si', 'mu', 'jue', 'tai', 'yang'],
+    '_plot_misc_stars': ['jie_kong', 'xun_kong', 'tian_shang', 'tian_shi']
+}
+_star_slots = [star for stage in _stage_slots.values() for star in stage]
@@ -0,0 +1,411 @@
+'''Generated by build_solar_terms.py; do not edit by hand.'''
+
+first_year = 1900
+last_year = 2100
+
+# minutes since 1900-01-01 00:00 China Standard Time (UTC+8) of every
+# solar term, 24 per Gregorian year starting from xiao han
+term_minutes = (
+    7324, 28533, 49792, 71161, 92662, 114339, 136193, 158247, 180475, 202877, 225399, 248020,
+    270670, 293316, 315891, 338360, 360677, 382820, 404773, 426535, 448120, 469548, 490856, 512082,
+    533273, 554477, 575740, 597105, 618611, 640284, 662145, 684194, 706431, 728825, 751357, 773968,
+    796628, 819264, 841846, 864308, 886630, 908769, 930727, 952486, 974075, 995501, 1016813, 1038037,
+    1059232, 1080432, 1101698, 1123060, 1144568, 1166237, 1188098, 1210144, 1232379, 1254774, 1277300, 1299915,
+    1322566, 1345210, 1367782, 1390253, 1412567, 1434715, 1456665, 1478436, 1500018, 1521455, 1542761, 1563996,
+    1585184, 1606394, 1627651, 1649021, 1670519, 1692195, 1714046, 1736099, 1758326, 1780725, 1803247, 1825865,
+    1848517, 1871159, 1893736, 1916202, 1938522, 1960664, 1982622, 2004383, 2025973, 2047401, 2068715, 2089940,
+    2111137, 2132338, 2153604, 2174965, 2196472, 2218139, 2239999, 2262042, 2284279, 2306669, 2329201, 2351812,
+    2374472, 2397110, 2419692, 2442156, 2464478, 2486620, 2508576, 2530339, 2551925, 2573356, 2594665, 2615894,
+    2637087, 2658292, 2679556, 2700921, 2722426, 2744098, 2765955, 2788004, 2810234, 2832631, 2855154, 2877772,
+    2900420, 2923066, 2945637, 2968109, 2990422, 3012570, 3034520, 3056288, 3077870, 3099305, 3120611, 3141844,
+    3163034, 3184243, 3205504, 3226875, 3248376, 3270053, 3291907, 3313959, 3336189, 3358585, 3381109, 3403722,
+    3426375, 3449013, 3471592, 3494054, 3516376, 3538515, 3560475, 3582235, 3603827, 3625254, 3646569, 3667793,
+    3688992, 3710191, 3731459, 3752819, 3774327, 3795993, 3817855, 3839897, 3862134, 3884523, 3907053, 3929663,
+    3952319, 3974958, 3997536, 4020004, 4042322, 4064469, 4086423, 4108192, 4129776, 4151212, 4172519, 4193752,
+    4214941, 4236148, 4257407, 4278774, 4300274, 4321948, 4343800, 4365852, 4388079, 4410478, 4432999, 4455619,
+    4478268, 4500914, 4523487, 4545957, 4568272, 4590418, 4612371, 4634137, 4655722, 4677155, 4698464, 4719693,
+    4740885, 4762091, 4783353, 4804719, 4826221, 4847893, 4869750, 4891798, 4914031, 4936425, 4958954, 4981566,
+    5004224, 5026861, 5049443, 5071904, 5094227, 5116365, 5138323, 5160083, 5181673, 5203100, 5224415, 5245640,
+    5266838, 5288039, 5309308, 5330668, 5352177, 5373843, 5395703, 5417746, 5439980, 5462370, 5484897, 5507509,
+    5530161, 5552803, 5575377, 5597847, 5620162, 5642311, 5664261, 5686031, 5707614, 5729051, 5750357, 5771592,
+    5792781, 5813992, 5835250, 5856621, 5878119, 5899795, 5921645, 5943696, 5965921, 5988319, 6010838, 6033456,
+    6056105, 6078749, 6101324, 6123793, 6146113, 6168258, 6190215, 6211978, 6233567, 6254996, 6276308, 6297533,
+    6318728, 6339929, 6361194, 6382556, 6404061, 6425729, 6447588, 6469633, 6491867, 6514257, 6536788, 6559397,
+    6582057, 6604694, 6627277, 6649741, 6672066, 6694208, 6716167, 6737930, 6759519, 6780948, 6802259, 6823485,
+    6844678, 6865879, 6887143, 6908504, 6930009, 6951678, 6973536, 6995583, 7017815, 7040210, 7062734, 7085350,
+    7107999, 7130644, 7153216, 7175688, 7198002, 7220153, 7242104, 7263875, 7285458, 7306895, 7328201, 7349435,
+    7370623, 7391832, 7413089, 7434458, 7455956, 7477631, 7499482, 7521533, 7543760, 7566158, 7588680, 7611295,
+    7633947, 7656587, 7679165, 7701630, 7723953, 7746094, 7768055, 7789817, 7811411, 7832840, 7854157, 7875382,
+    7896580, 7917780, 7939046, 7960403, 7981908, 8003571, 8025429, 8047469, 8069703, 8092091, 8114620, 8137229,
+    8159888, 8182526, 8205108, 8227575, 8249897, 8272044, 8294001, 8315770, 8337358, 8358793, 8380104, 8401336,
+    8422528, 8443734, 8464994, 8486358, 8507858, 8529527, 8551378, 8573425, 8595650, 8618046, 8640566, 8663185,
+    8685834, 8708481, 8731055, 8753529, 8775845, 8797995, 8819948, 8841717, 8863302, 8884738, 8906046, 8927279,
+    8948470, 8969677, 8990938, 9012305, 9033805, 9055477, 9077330, 9099378, 9121606, 9143999, 9166523, 9189134,
+    9211790, 9234428, 9257010, 9279474, 9301799, 9323940, 9345902, 9367664, 9389257, 9410685, 9432001, 9453226,
+    9474424, 9495625, 9516893, 9538253, 9559761, 9581426, 9603285, 9625326, 9647558, 9669946, 9692471, 9715080,
+    9737732, 9760372, 9782947, 9805417, 9827735, 9849886, 9871840, 9893613, 9915199, 9936638, 9957946, 9979181,
+    10000372, 10021581, 10042839, 10064208, 10085706, 10107379, 10129229, 10151279, 10173502, 10195899, 10218417, 10241034,
+    10263681, 10286324, 10308898, 10331368, 10353688, 10375835, 10397793, 10419561, 10441152, 10462585, 10483898, 10505127,
+    10526321, 10547524, 10568787, 10590149, 10611651, 10633319, 10655175, 10677219, 10699452, 10721842, 10744371, 10766980,
+    10789639, 10812275, 10834858, 10857321, 10879647, 10901788, 10923749, 10945513, 10967105, 10988535, 11009850, 11031077,
+    11052274, 11073475, 11094740, 11116100, 11137605, 11159271, 11181129, 11203172, 11225404, 11247797, 11270322, 11292936,
+    11315587, 11338230, 11360804, 11383275, 11405590, 11427740, 11449691, 11471462, 11493046, 11514484, 11535791, 11557027,
+    11578217, 11599428, 11620687, 11642056, 11663554, 11685229, 11707078, 11729129, 11751353, 11773750, 11796270, 11818887,
+    11841538, 11864180, 11886757, 11909224, 11931546, 11953690, 11975649, 11997413, 12019005, 12040435, 12061751, 12082977,
+    12104174, 12125375, 12146641, 12168000, 12189505, 12211169, 12233026, 12255066, 12277298, 12299685, 12322214, 12344823,
+    12367482, 12390121, 12412705, 12435172, 12457497, 12479644, 12501603, 12523371, 12544960, 12566394, 12587705, 12608933,
+    12630126, 12651329, 12672590, 12693952, 12715453, 12737120, 12758973, 12781019, 12803246, 12825641, 12848162, 12870779,
+    12893429, 12916078, 12938652, 12961128, 12983446, 13005598, 13027552, 13049324, 13070909, 13092346, 13113653, 13134885,
+    13156073, 13177280, 13198537, 13219903, 13241400, 13263072, 13284923, 13306971, 13329198, 13351593, 13374117, 13396730,
+    13419385, 13442025, 13464607, 13487073, 13509400, 13531543, 13553508, 13575271, 13596866, 13618295, 13639612, 13660837,
+    13682034, 13703233, 13724498, 13745855, 13767360, 13789021, 13810878, 13832916, 13855149, 13877535, 13900062, 13922670,
+    13945326, 13967965, 13990544, 14013014, 14035336, 14057487, 14079445, 14101218, 14122808, 14144248, 14165559, 14186793,
+    14207985, 14229192, 14250450, 14271814, 14293310, 14314979, 14336826, 14358872, 14381093, 14403488, 14426005, 14448622,
+    14471270, 14493917, 14516491, 14538965, 14561285, 14583437, 14605395, 14627167, 14648757, 14670194, 14691506, 14712739,
+    14733931, 14755137, 14776397, 14797759, 14819257, 14840924, 14862775, 14884817, 14907044, 14929433, 14951957, 14974567,
+    14997224, 15019862, 15042448, 15064913, 15087242, 15109386, 15131350, 15153115, 15174710, 15196140, 15217457, 15238684,
+    15259882, 15281082, 15302349, 15323707, 15345212, 15366875, 15388731, 15410771, 15433001, 15455388, 15477911, 15500521,
+    15523172, 15545813, 15568389, 15590861, 15613180, 15635332, 15657287, 15679062, 15700648, 15722088, 15743396, 15764633,
+    15785823, 15807033, 15828291, 15849660, 15871157, 15892830, 15914678, 15936726, 15958947, 15981342, 16003858, 16026473,
+    16049120, 16071762, 16094337, 16116806, 16139128, 16161276, 16183238, 16205006, 16226600, 16248035, 16269351, 16290580,
+    16311776, 16332978, 16354241, 16375600, 16397102, 16418766, 16440621, 16462660, 16484890, 16507275, 16529802, 16552408,
+    16575066, 16597701, 16620285, 16642750, 16665077, 16687223, 16709187, 16730956, 16752550, 16773985, 16795300, 16816530,
+    16837725, 16858927, 16880190, 16901548, 16923050, 16944714, 16966566, 16988608, 17010835, 17033227, 17055748, 17078363,
+    17101012, 17123658, 17146232, 17168706, 17191023, 17213176, 17235130, 17256904, 17278490, 17299930, 17321238, 17342474,
+    17363663, 17384873, 17406129, 17427496, 17448992, 17470663, 17492511, 17514558, 17536782, 17559177, 17581698, 17604312,
+    17626965, 17649606, 17672186, 17694652, 17716978, 17739121, 17761084, 17782848, 17804443, 17825873, 17847191, 17868418,
+    17889617, 17910817, 17932084, 17953442, 17974946, 17996608, 18018464, 18040500, 18062731, 18085115, 18107642, 18130248,
+    18152905, 18175542, 18198124, 18220592, 18242916, 18265065, 18287025, 18308796, 18330387, 18351824, 18373137, 18394370,
+    18415562, 18436768, 18458029, 18479392, 18500890, 18522558, 18544406, 18566450, 18588672, 18611065, 18633582, 18656198,
+    18678846, 18701493, 18724068, 18746544, 18768864, 18791018, 18812976, 18834749, 18856338, 18877775, 18899085, 18920317,
+    18941507, 18962712, 18983969, 19005333, 19026829, 19048498, 19070347, 19092391, 19114617, 19137008, 19159531, 19182142,
+    19204798, 19227438, 19250023, 19272490, 19294821, 19316966, 19338933, 19360698, 19382295, 19403725, 19425042, 19446267,
+    19467464, 19488661, 19509926, 19531281, 19552785, 19574445, 19596302, 19618339, 19640571, 19662957, 19685483, 19708092,
+    19730746, 19753387, 19775965, 19798438, 19820759, 19842913, 19864871, 19886647, 19908235, 19929676, 19950986, 19972222,
+    19993411, 20014619, 20035875, 20057240, 20078734, 20100403, 20122249, 20144295, 20166515, 20188910, 20211427, 20234044,
+    20256691, 20279337, 20301913, 20324386, 20346708, 20368860, 20390821, 20412594, 20434188, 20455626, 20476942, 20498173,
+    20519368, 20540571, 20561831, 20583189, 20604686, 20626349, 20648198, 20670235, 20692461, 20714847, 20737372, 20759979,
+    20782638, 20805277, 20827863, 20850331, 20872662, 20894809, 20916777, 20938546, 20960144, 20981578, 21002897, 21024126,
+    21045324, 21066524, 21087788, 21109144, 21130644, 21152304, 21174155, 21196191, 21218416, 21240803, 21263324, 21285936,
+    21308588, 21331234, 21353812, 21376289, 21398609, 21420765, 21442722, 21464499, 21486087, 21507529, 21528838, 21550075,
+    21571264, 21592474, 21613730, 21635097, 21656590, 21678261, 21700105, 21722151, 21744370, 21766763, 21789279, 21811893,
+    21834543, 21857186, 21879766, 21902237, 21924564, 21946713, 21968678, 21990447, 22012044, 22033478, 22054796, 22076024,
+    22097222, 22118424, 22139689, 22161047, 22182549, 22204211, 22226064, 22248099, 22270327, 22292709, 22315233, 22337836,
+    22360492, 22383127, 22405710, 22428178, 22450506, 22472656, 22494622, 22516395, 22537991, 22559431, 22580747, 22601980,
+    22623175, 22644379, 22665640, 22687000, 22708499, 22730163, 22752011, 22774052, 22796274, 22818663, 22841179, 22863792,
+    22886439, 22909085, 22931658, 22954135, 22976455, 22998612, 23020570, 23042348, 23063939, 23085381, 23106693, 23127929,
+    23149119, 23170327, 23191583, 23212947, 23234441, 23256109, 23277954, 23299998, 23322220, 23344611, 23367131, 23389742,
+    23412396, 23435036, 23457619, 23480086, 23502416, 23524562, 23546529, 23568296, 23589895, 23611327, 23632648, 23653875,
+    23675075, 23696274, 23717540, 23738895, 23760398, 23782057, 23803912, 23825947, 23848177, 23870560, 23893086, 23915692,
+    23938347, 23960985, 23983565, 24006035, 24028358, 24050510, 24072469, 24094244, 24115834, 24137275, 24158588, 24179824,
+    24201016, 24222225, 24243484, 24264849, 24286345, 24308013, 24329859, 24351902, 24374122, 24396514, 24419029, 24441644,
+    24464291, 24486937, 24509512, 24531986, 24554307, 24576461, 24598421, 24620195, 24641787, 24663226, 24684540, 24705773,
+    24726966, 24748172, 24769430, 24790792, 24812288, 24833953, 24855800, 24877840, 24900063, 24922449, 24944971, 24967579,
+    24990236, 25012874, 25035461, 25057929, 25080261, 25102409, 25124377, 25146146, 25167744, 25189178, 25210496, 25231723,
+    25252920, 25274118, 25295382, 25316737, 25338238, 25359897, 25381750, 25403785, 25426012, 25448398, 25470920, 25493531,
+    25516184, 25538828, 25561406, 25583883, 25606205, 25628362, 25650320, 25672098, 25693687, 25715129, 25736438, 25757673,
+    25778861, 25800069, 25821323, 25842687, 25864179, 25885848, 25907692, 25929737, 25951957, 25974351, 25996867, 26019483,
+    26042132, 26064777, 26087355, 26109828, 26132154, 26154306, 26176271, 26198043, 26219640, 26241076, 26262393, 26283623,
+    26304819, 26326020, 26347281, 26368638, 26390135, 26411795, 26433645, 26455679, 26477905, 26500287, 26522811, 26545416,
+    26568073, 26590710, 26613295, 26635763, 26658094, 26680244, 26702212, 26723985, 26745584, 26767023, 26788342, 26809573,
+    26830770, 26851972, 26873234, 26894590, 26916087, 26937746, 26959593, 26981628, 27003849, 27026235, 27048753, 27071365,
+    27094014, 27116661, 27139237, 27161716, 27184038, 27206197, 27228156, 27249936, 27271527, 27292971, 27314282, 27335520,
+    27356710, 27377919, 27399173, 27420537, 27442027, 27463694, 27485535, 27507577, 27529794, 27552184, 27574700, 27597313,
+    27619965, 27642607, 27665191, 27687663, 27709994, 27732144, 27754112, 27775882, 27797482, 27818916, 27840236, 27861463,
+    27882662, 27903861, 27925126, 27946481, 27967983, 27989641, 28011493, 28033526, 28055752, 28078133, 28100656, 28123260,
+    28145915, 28168552, 28191135, 28213605, 28235933, 28258086, 28280050, 28301826, 28323421, 28344862, 28366177, 28387412,
+    28408605, 28429811, 28451071, 28472432, 28493929, 28515594, 28537439, 28559480, 28581698, 28604087, 28626601, 28649214,
+    28671859, 28694505, 28717079, 28739556, 28761878, 28784035, 28805997, 28827776, 28849371, 28870814, 28892128, 28913364,
+    28934556, 28955762, 28977018, 28998379, 29019871, 29041535, 29063379, 29085418, 29107638, 29130024, 29152543, 29175151,
+    29197806, 29220445, 29243030, 29265499, 29287832, 29309981, 29331952, 29353723, 29375325, 29396761, 29418083, 29439311,
+    29460510, 29481708, 29502972, 29524325, 29545825, 29567481, 29589331, 29611364, 29633590, 29655973, 29678496, 29701104,
+    29723758, 29746400, 29768980, 29791455, 29813779, 29835935, 29857896, 29879674, 29901266, 29922710, 29944022, 29965260,
+    29986451, 30007659, 30028915, 30050278, 30071770, 30093437, 30115279, 30137321, 30159538, 30181930, 30204445, 30227061,
+    30249708, 30272355, 30294932, 30317408, 30339732, 30361886, 30383850, 30405624, 30427220, 30448659, 30469976, 30491209,
+    30512404, 30533609, 30554869, 30576229, 30597725, 30619386, 30641232, 30663267, 30685489, 30707871, 30730392, 30752997,
+    30775653, 30798291, 30820877, 30843346, 30865679, 30887829, 30909799, 30931571, 30953172, 30974609, 30995930, 31017160,
+    31038358, 31059559, 31080822, 31102178, 31123677, 31145335, 31167183, 31189217, 31211439, 31233822, 31256340, 31278950,
+    31301600, 31324245, 31346824, 31369303, 31391628, 31413788, 31435750, 31457531, 31479122, 31500567, 31521877, 31543114,
+    31564303, 31585510, 31606763, 31628126, 31649616, 31671283, 31693124, 31715166, 31737383, 31759774, 31782289, 31804902,
+    31827553, 31850197, 31872780, 31895254, 31917585, 31939739, 31961709, 31983482, 32005082, 32026518, 32047838, 32069066,
+    32090263, 32111461, 32132722, 32154077, 32175575, 32197232, 32219082, 32241115, 32263341, 32285722, 32308246, 32330850,
+    32353507, 32376144, 32398728, 32421199, 32443529, 32465682, 32487651, 32509427, 32531026, 32552468, 32573786, 32595020,
+    32616215, 32637418, 32658677, 32680035, 32701530, 32723190, 32745034, 32767071, 32789290, 32811677, 32834191, 32856804,
+    32879451, 32902098, 32924674, 32947152, 32969475, 32991635, 33013598, 33035380, 33056975, 33078422, 33099737, 33120975,
+    33142167, 33163374, 33184628, 33205989, 33227477, 33249140, 33270979, 33293016, 33315232, 33337618, 33360134, 33382744,
+    33405398, 33428039, 33450625, 33473097, 33495432, 33517583, 33539556, 33561329, 33582932, 33604369, 33625693, 33646922,
+    33668122, 33689321, 33710585, 33731937, 33753436, 33775090, 33796938, 33818967, 33841191, 33863570, 33886092, 33908697,
+    33931352, 33953993, 33976576, 33999051, 34021379, 34043537, 34065501, 34087281, 34108875, 34130319, 34151633, 34172870,
+    34194062, 34215269, 34236526, 34257888, 34279381, 34301045, 34322887, 34344926, 34367142, 34389530, 34412042, 34434656,
+    34457301, 34479948, 34502525, 34525003, 34547328, 34569486, 34591451, 34613230, 34634826, 34656269, 34677585, 34698820,
+    34720014, 34741220, 34762478, 34783838, 34805331, 34826993, 34848837, 34870872, 34893091, 34915472, 34937990, 34960593,
+    34983247, 35005883, 35028469, 35050938, 35073272, 35095423, 35117397, 35139171, 35160775, 35182214, 35203538, 35224768,
+    35245968, 35267168, 35288431, 35309784, 35331282, 35352937, 35374785, 35396815, 35419038, 35441418, 35463936, 35486543,
+    35509193, 35531836, 35554415, 35576892, 35599218, 35621378, 35643341, 35665124, 35686717, 35708164, 35729478, 35750716,
+    35771906, 35793114, 35814368, 35835729, 35857218, 35878882, 35900721, 35922761, 35944976, 35967366, 35989879, 36012493,
+    36035142, 36057787, 36080367, 36102843, 36125171, 36147326, 36169294, 36191070, 36212669, 36234109, 36255428, 36276660,
+    36297857, 36319058, 36340319, 36361675, 36383171, 36404828, 36426675, 36448707, 36470930, 36493310, 36515832, 36538435,
+    36561092, 36583728, 36606314, 36628783, 36651115, 36673267, 36695237, 36717011, 36738611, 36760051, 36781371, 36802604,
+    36823802, 36845004, 36866266, 36887622, 36909119, 36930776, 36952622, 36974655, 36996874, 37019257, 37041772, 37064383,
+    37087030, 37109677, 37132254, 37154734, 37177058, 37199219, 37221182, 37242964, 37264558, 37286005, 37307317, 37328556,
+    37349745, 37370953, 37392206, 37413567, 37435055, 37456718, 37478556, 37500594, 37522808, 37545195, 37567709, 37590320,
+    37612971, 37635615, 37658200, 37680675, 37703010, 37725165, 37747139, 37768913, 37790517, 37811954, 37833276, 37854504,
+    37875702, 37896899, 37918160, 37939511, 37961008, 37982662, 38004509, 38026538, 38048761, 38071140, 38093662, 38116266,
+    38138923, 38161563, 38184149, 38206623, 38228955, 38251113, 38273082, 38294861, 38316459, 38337903, 38359219, 38380453,
+    38401645, 38422848, 38444104, 38465461, 38486953, 38508613, 38530454, 38552491, 38574707, 38597094, 38619607, 38642221,
+    38664867, 38687516, 38710093, 38732573, 38754899, 38777061, 38799027, 38820810, 38842407, 38863854, 38885170, 38906408,
+    38927600, 38948806, 38970060, 38991419, 39012907, 39034567, 39056405, 39078439, 39100654, 39123036, 39145552, 39168158,
+    39190811, 39213450, 39236037, 39258509, 39280845, 39302998, 39324975, 39346751, 39368358, 39389798, 39411125, 39432356,
+    39453558, 39474756, 39496019, 39517370, 39538866, 39560517, 39582362, 39604387, 39626607, 39648984, 39671502, 39694107,
+    39716759, 39739402, 39761985, 39784464, 39806793, 39828955, 39850922, 39872706, 39894303, 39915751, 39937066, 39958306,
+    39979497, 40000705, 40021960, 40043320, 40064808, 40086470, 40108307, 40130343, 40152555, 40174941, 40197451, 40220064,
+    40242711, 40265358, 40287938, 40310418, 40332748, 40354908, 40376878, 40398658, 40420259, 40441702, 40463021, 40484255,
+    40505451, 40526655, 40547913, 40569271, 40590764, 40612422, 40634266, 40656297, 40678516, 40700895, 40723412, 40746014,
+    40768668, 40791304, 40813890, 40836360, 40858696, 40880849, 40902824, 40924601, 40946206, 40967647, 40988971, 41010203,
+    41031403, 41052604, 41073867, 41095221, 41116718, 41138374, 41160219, 41182250, 41204469, 41226849, 41249363, 41271970,
+    41294617, 41317260, 41339838, 41362317, 41384642, 41406805, 41428771, 41450557, 41472154, 41493605, 41514920, 41536161,
+    41557352, 41578560, 41599812, 41621173, 41642660, 41664322, 41686158, 41708195, 41730407, 41752794, 41775305, 41797916,
+    41820565, 41843209, 41865791, 41888267, 41910600, 41932756, 41954730, 41976508, 41998113, 42019554, 42040878, 42062110,
+    42083309, 42104509, 42125770, 42147122, 42168617, 42190270, 42212115, 42234143, 42256365, 42278742, 42301264, 42323867,
+    42346524, 42369162, 42391749, 42414221, 42436553, 42458709, 42480679, 42502457, 42524058, 42545501, 42566821, 42588056,
+    42609253, 42630456, 42651715, 42673072, 42694565, 42716223, 42738065, 42760099, 42782315, 42804700, 42827213, 42849825,
+    42872472, 42895120, 42917697, 42940178, 42962503, 42984665, 43006629, 43028413, 43050008, 43071456, 43092771, 43114011,
+    43135203, 43156411, 43177665, 43199026, 43220515, 43242176, 43264013, 43286048, 43308260, 43330643, 43353156, 43375763,
+    43398415, 43421055, 43443642, 43466115, 43488452, 43510606, 43532582, 43554358, 43575964, 43597403, 43618728, 43639958,
+    43661159, 43682357, 43703620, 43724971, 43746467, 43768119, 43789964, 43811990, 43834211, 43856587, 43879106, 43901709,
+    43924363, 43947004, 43969590, 43992067, 44014400, 44036561, 44058531, 44080314, 44101912, 44123358, 44144674, 44165910,
+    44187101, 44208305, 44229559, 44250916, 44272405, 44294064, 44315902, 44337938, 44360151, 44382538, 44405049, 44427662,
+    44450309, 44472958, 44495538, 44518020, 44540350, 44562513, 44584482, 44606266, 44627865, 44649311, 44670628, 44691863,
+    44713055, 44734258, 44755512, 44776867, 44798356, 44820014, 44841854, 44863886, 44886103, 44908483, 44931000, 44953604,
+    44976259, 44998896, 45021484, 45043956, 45066293, 45088447, 45110424, 45132202, 45153809, 45175251, 45196576, 45217808,
+    45239008, 45260206, 45281468, 45302818, 45324312, 45345963, 45367806, 45389832, 45412051, 45434428, 45456944, 45479550,
+    45502201, 45524844, 45547426, 45569906, 45592235, 45614399, 45636367, 45658154, 45679753, 45701204, 45722521, 45743762,
+    45764953, 45786160, 45807412, 45828770, 45850254, 45871912, 45893744, 45915778, 45937986, 45960370, 45982879, 46005491,
+    46028139, 46050786, 46073369, 46095850, 46118184, 46140345, 46162320, 46184101, 46205706, 46227149, 46248472, 46269706,
+    46290904, 46312104, 46333363, 46354715, 46376207, 46397859, 46419699, 46441725, 46463942, 46486317, 46508835, 46531437,
+    46554093, 46576731, 46599320, 46621794, 46644131, 46666289, 46688264, 46710044, 46731649, 46753092, 46774414, 46795648,
+    46816846, 46838047, 46859307, 46880661, 46902154, 46923808, 46945650, 46967679, 46989894, 47012274, 47034785, 47057393,
+    47080039, 47102685, 47125264, 47147746, 47170074, 47192240, 47214207, 47235995, 47257594, 47279045, 47300361, 47321602,
+    47342793, 47364002, 47385254, 47406614, 47428099, 47449759, 47471593, 47493627, 47515836, 47538217, 47560726, 47583333,
+    47605980, 47628622, 47651205, 47673681, 47696017, 47718175, 47740154, 47761934, 47783544, 47804987, 47826314, 47847547,
+    47868748, 47889947, 47911208, 47932558, 47954052, 47975702, 47997545, 48019569, 48041787, 48064160, 48086678, 48109279,
+    48131933, 48154571, 48177157, 48199633, 48221967, 48244128, 48266101, 48287885, 48309488, 48330936, 48352256, 48373494,
+    48394689, 48415893, 48437148, 48458504, 48479992, 48501648, 48523485, 48545517, 48567729, 48590112, 48612622, 48635234,
+    48657880, 48680529, 48703107, 48725590, 48747918, 48770083, 48792051, 48813837, 48835437, 48856886, 48878204, 48899443,
+    48920636, 48941843, 48963097, 48984455, 49005943, 49027601, 49049437, 49071469, 49093682, 49116062, 49138575, 49161180,
+    49183832, 49206471, 49229058, 49251530, 49273868, 49296022, 49318000, 49339777, 49361385, 49382827, 49404154, 49425386,
+    49446588, 49467787, 49489051, 49510402, 49531898, 49553548, 49575392, 49597416, 49619634, 49642008, 49664525, 49687128,
+    49709779, 49732421, 49755004, 49777484, 49799815, 49821979, 49843949, 49865736, 49887335, 49908786, 49930103, 49951343,
+    49972534, 49993741, 50014993, 50036351, 50057836, 50079495, 50101328, 50123362, 50145570, 50167954, 50190462, 50213074,
+    50235721, 50258370, 50280952, 50303435, 50325769, 50347933, 50369907, 50391691, 50413296, 50434741, 50456062, 50477297,
+    50498491, 50519693, 50540948, 50562301, 50583790, 50605443, 50627282, 50649310, 50671526, 50693903, 50716421, 50739024,
+    50761680, 50784319, 50806909, 50829383, 50851722, 50873880, 50895859, 50917639, 50939247, 50960689, 50982014, 51003246,
+    51024444, 51045643, 51066902, 51088252, 51109744, 51131395, 51153236, 51175263, 51197480, 51219858, 51242373, 51264980,
+    51287629, 51310275, 51332856, 51355339, 51377669, 51399836, 51421805, 51443595, 51465194, 51486647, 51507965, 51529207,
+    51550398, 51571606, 51592857, 51614215, 51635697, 51657355, 51679185, 51701217, 51723423, 51745806, 51768314, 51790923,
+    51813570, 51836215, 51858800, 51881279, 51903616, 51925777, 51947756, 51969539, 51991148, 52012594, 52033922, 52055156,
+    52076357, 52097557, 52118817, 52140167, 52161658, 52183306, 52205145, 52227166, 52249381, 52271753, 52294269, 52316869,
+    52339525, 52362164, 52384754, 52407231, 52429570, 52451731, 52473708, 52495492, 52517098, 52538545, 52559868, 52581104,
+    52602301, 52623503, 52644760, 52666113, 52687603, 52709255, 52731092, 52753120, 52775330, 52797710, 52820219, 52842828,
+    52865474, 52888123, 52910703, 52933188, 52955519, 52977688, 52999658, 53021447, 53043048, 53064499, 53085817, 53107058,
+    53128249, 53149456, 53170709, 53192067, 53213553, 53235211, 53257045, 53279076, 53301285, 53323664, 53346174, 53368778,
+    53391427, 53414066, 53436652, 53459127, 53481466, 53503625, 53525605, 53547386, 53568997, 53590440, 53611769, 53633001,
+    53654204, 53675402, 53696664, 53718013, 53739508, 53761156, 53782998, 53805021, 53827237, 53849609, 53872125, 53894724,
+    53917376, 53940015, 53962599, 53985077, 54007411, 54029575, 54051549, 54073338, 54094942, 54116394, 54137714, 54158954,
+    54180148, 54201353, 54222606, 54243960, 54265445, 54287100, 54308933, 54330963, 54353171, 54375553, 54398060, 54420670,
+    54443316, 54465964, 54488544, 54511028, 54533360, 54555527, 54577501, 54599288, 54620893, 54642343, 54663665, 54684904,
+    54706099, 54727302, 54748556, 54769910, 54791396, 54813049, 54834883, 54856910, 54879123, 54901499, 54924014, 54946617,
+    54969271, 54991910, 55014500, 55036973, 55059313, 55081470, 55103449, 55125229, 55146839, 55168282, 55189609, 55210842,
+    55232043, 55253242, 55274503, 55295852, 55317345, 55338993, 55360834, 55382857, 55405073, 55427447, 55449962, 55472566,
+    55495217, 55517861, 55540443, 55562925, 55585257, 55607423, 55629393, 55651182, 55672782, 55694235, 55715553, 55736795,
+    55757987, 55779195, 55800447, 55821805, 55843289, 55864946, 55886776, 55908806, 55931011, 55953392, 55975897, 55998506,
+    56021151, 56043798, 56066381, 56088863, 56111199, 56133363, 56155341, 56177126, 56198735, 56220182, 56241507, 56262742,
+    56283940, 56305141, 56326398, 56347749, 56369238, 56390887, 56412725, 56434747, 56456960, 56479332, 56501847, 56524446,
+    56547102, 56569740, 56592331, 56614808, 56637149, 56659311, 56681292, 56703075, 56724684, 56746130, 56767454, 56788688,
+    56809885, 56831084, 56852340, 56873690, 56895179, 56916828, 56938666, 56960691, 56982904, 57005281, 57027792, 57050399,
+    57073047, 57095695, 57118276, 57140762, 57163094, 57185265, 57207237, 57229029, 57250631, 57272084, 57293402, 57314644,
+    57335834, 57357040, 57378290, 57399646, 57421128, 57442784, 57464614, 57486644, 57508851, 57531231, 57553739, 57576346,
+    57598994, 57621636, 57644221, 57666699, 57689038, 57711199, 57733180, 57754963, 57776576, 57798023, 57819352, 57840587,
+    57861789, 57882988, 57904248, 57925596, 57947086, 57968732, 57990571, 58012590, 58034804, 58057174, 58079689, 58102288,
+    58124942, 58147581, 58170169, 58192647, 58214985, 58237149, 58259127, 58280915, 58302523, 58323975, 58345298, 58366538,
+    58387735, 58408939, 58430193, 58451545, 58473030, 58494681, 58516512, 58538537, 58560743, 58583121, 58605627, 58628236,
+    58650882, 58673532, 58696113, 58718601, 58740934, 58763105, 58785079, 58806870, 58828475, 58849928, 58871249, 58892490,
+    58913684, 58934890, 58956142, 58977498, 58998981, 59020634, 59042466, 59064492, 59086700, 59109076, 59131586, 59154189,
+    59176841, 59199481, 59222071, 59244547, 59266889, 59289049, 59311032, 59332813, 59354426, 59375870, 59397199, 59418432,
+    59439634, 59460832, 59482093, 59503442, 59524935, 59546582, 59568423, 59590443, 59612658, 59635030, 59657543, 59680144,
+    59702795, 59725436, 59748020, 59770502, 59792836, 59815004, 59836978, 59858770, 59880374, 59901828, 59923149, 59944391,
+    59965584, 59986791, 60008043, 60029399, 60050882, 60072537, 60094367, 60116396, 60138599, 60160979, 60183483, 60206091,
+    60228735, 60251381, 60273963, 60296446, 60318781, 60340949, 60362928, 60384717, 60406327, 60427778, 60449104, 60470343,
+    60491541, 60512743, 60533999, 60555350, 60576836, 60598485, 60620319, 60642342, 60664553, 60686925, 60709438, 60732038,
+    60754692, 60777330, 60799921, 60822397, 60844740, 60866900, 60888883, 60910667, 60932279, 60953725, 60975053, 60996288,
+    61017488, 61038687, 61059946, 61081294, 61102784, 61124430, 61146268, 61168290, 61190502, 61212877, 61235389, 61257994,
+    61280643, 61303290, 61325873, 61348358, 61370691, 61392861, 61414833, 61436626, 61458228, 61479682, 61501001, 61522244,
+    61543436, 61564644, 61585894, 61607251, 61628733, 61650389, 61672217, 61694247, 61716451, 61738831, 61761337, 61783944,
+    61806591, 61829235, 61851820, 61874300, 61896639, 61918802, 61940782, 61962567, 61984178, 62005625, 62026953, 62048188,
+    62069389, 62090589, 62111849, 62133198, 62154688, 62176335, 62198173, 62220193, 62242405, 62264775, 62287289, 62309887,
+    62332542, 62355180, 62377771, 62400249, 62422590, 62444754, 62466735, 62488522, 62510132, 62531581, 62552906, 62574143,
+    62595339, 62616539, 62637794, 62659144, 62680630, 62702278, 62724111, 62746135, 62768343, 62790719, 62813226, 62835834,
+    62858481, 62881130, 62903713, 62926202, 62948537, 62970710, 62992686, 63014480, 63036084, 63057539, 63078858, 63100099,
+    63121290, 63142495, 63163743, 63185097, 63206577, 63228230, 63250058, 63272086, 63294292, 63316669, 63339178, 63361784,
+    63384434, 63407077, 63429666, 63452145, 63474488, 63496650, 63518635, 63540419, 63562034, 63583480, 63604809, 63626042,
+    63647243, 63668440, 63689699, 63711044, 63732534, 63754177, 63776015, 63798033, 63820247, 63842617, 63865132, 63887732,
+    63910385, 63933026, 63955614, 63978095, 64000433, 64022601, 64044579, 64066371, 64087979, 64109434, 64130757, 64151999,
+    64173194, 64194399, 64215651, 64237003, 64258484, 64280133, 64301960, 64323984, 64346186, 64368563, 64391066, 64413674,
+    64436318, 64458967, 64481549, 64504036, 64526372, 64548544, 64570522, 64592316, 64613925, 64635380, 64656706, 64677948,
+    64699145, 64720349, 64741603, 64762954, 64784436, 64806084, 64827913, 64849934, 64872139, 64894509, 64917018, 64939618,
+    64962271, 64984910, 65007503, 65029981, 65052327, 65074490, 65096476, 65118261, 65139876, 65161323, 65182653, 65203887,
+    65225089, 65246287, 65267547, 65288893, 65310383, 65332026, 65353862, 65375880, 65398090, 65420460, 65442970, 65465571,
+    65488220, 65510864, 65533449, 65555935, 65578271, 65600444, 65622420, 65644215, 65665820, 65687276, 65708597, 65729840,
+    65751033, 65772240, 65793490, 65814847, 65836327, 65857981, 65879809, 65901836, 65924037, 65946415, 65968917, 65991522,
+    66014165, 66036809, 66059391, 66081874, 66104212, 66126379, 66148361, 66170151, 66191764, 66213215, 66234544, 66255783,
+    66276983, 66298185, 66319442, 66340792, 66362279, 66383926, 66405760, 66427779, 66449989, 66472357, 66494868, 66517464,
+    66540117, 66562753, 66585343, 66607819, 66630161, 66652325, 66674309, 66696098, 66717712, 66739163, 66760492, 66781730,
+    66802930, 66824130, 66845386, 66866733, 66888219, 66909865, 66931697, 66953718, 66975925, 66998298, 67020806, 67043411,
+    67066057, 67088705, 67111287, 67133774, 67156108, 67178282, 67200257, 67222053, 67243658, 67265116, 67286437, 67307682,
+    67328875, 67350082, 67371331, 67392686, 67414165, 67435817, 67457643, 67479669, 67501872, 67524250, 67546756, 67569362,
+    67592010, 67614654, 67637241, 67659721, 67682062, 67704225, 67726208, 67747993, 67769607, 67791054, 67812385, 67833620,
+    67854822, 67876021, 67897281, 67918628, 67940117, 67961762, 67983598, 68005616, 68027828, 68050196, 68072710, 68095308,
+    68117962, 68140602, 68163192, 68185672, 68208012, 68230178, 68252158, 68273948, 68295557, 68317009, 68338334, 68359574,
+    68380770, 68401974, 68423228, 68444580, 68466063, 68487712, 68509541, 68531563, 68553766, 68576141, 68598644, 68621251,
+    68643895, 68666545, 68689127, 68711616, 68733953, 68756127, 68778105, 68799900, 68821508, 68842964, 68864287, 68885529,
+    68906723, 68927928, 68949178, 68970531, 68992011, 69013661, 69035488, 69057511, 69079715, 69102088, 69124596, 69147197,
+    69169849, 69192490, 69215083, 69237563, 69259910, 69282075, 69304063, 69325849, 69347465, 69368912, 69390243, 69411475,
+    69432676, 69453871, 69475129, 69496472, 69517960, 69539602, 69561437, 69583454, 69605666, 69628035, 69650548, 69673149,
+    69695801, 69718445, 69741033, 69763518, 69785858, 69808031, 69830010, 69851806, 69873414, 69894871, 69916193, 69937436,
+    69958628, 69979833, 70001081, 70022434, 70043912, 70065563, 70087388, 70109413, 70131614, 70153991, 70176493, 70199101,
+    70221745, 70244393, 70266976, 70289462, 70311800, 70333971, 70355954, 70377747, 70399361, 70420816, 70442145, 70463386,
+    70484584, 70505787, 70527041, 70548390, 70569872, 70591517, 70613346, 70635364, 70657569, 70679937, 70702446, 70725044,
+    70747697, 70770336, 70792929, 70815407, 70837754, 70859919, 70881907, 70903696, 70925313, 70946765, 70968097, 70989334,
+    71010536, 71031734, 71052992, 71074336, 71095822, 71117463, 71139294, 71161309, 71183515, 71205883, 71228391, 71250993,
+    71273641, 71296288, 71318874, 71341364, 71363702, 71385879, 71407857, 71429656, 71451264, 71472723, 71494045, 71515291,
+    71536483, 71557691, 71578940, 71600294, 71621772, 71643423, 71665246, 71687270, 71709469, 71731845, 71754347, 71776952,
+    71799597, 71822242, 71844829, 71867312, 71889655, 71911823, 71933809, 71955599, 71977214, 71998665, 72019996, 72041233,
+    72062434, 72083634, 72104891, 72126239, 72147726, 72169370, 72191204, 72213220, 72235429, 72257795, 72280307, 72302902,
+    72325555, 72348192, 72370783, 72393262, 72415605, 72437773, 72459758, 72481550, 72503164, 72524618, 72545947, 72567187,
+    72588387, 72609588, 72630843, 72652192, 72673675, 72695320, 72717149, 72739168, 72761371, 72783743, 72806245, 72828849,
+    72851492, 72874140, 72896721, 72919210, 72941546, 72963722, 72985701, 73007500, 73029111, 73050571, 73071896, 73093142,
+    73114336, 73135543, 73156793, 73178145, 73199623, 73221272, 73243096, 73265118, 73287318, 73309691, 73332195, 73354797,
+    73377446, 73400088, 73422678, 73445158, 73467504, 73489669, 73511657, 73533445, 73555063, 73576512, 73597845, 73619080,
+    73640283, 73661481, 73682740, 73704084, 73725571, 73747211, 73769045, 73791059, 73813269, 73835636, 73858148, 73880746,
+    73903399, 73926041, 73948630, 73971113, 73993454, 74015625, 74037605, 74059400, 74081009, 74102465, 74123790, 74145033,
+    74166228, 74187433, 74208685, 74230037, 74251518, 74273167, 74294992, 74317015, 74339214, 74361589, 74384090, 74406696,
+    74429338, 74451986, 74474568, 74497056, 74519393, 74541566, 74563547, 74585342, 74606953, 74628409, 74649736, 74670978,
+    74692175, 74713380, 74734633, 74755984, 74777466, 74799113, 74820940, 74842960, 74865163, 74887531, 74910038, 74932636,
+    74955287, 74977926, 75000519, 75022998, 75045345, 75067511, 75089500, 75111289, 75132907, 75154357, 75175689, 75196924,
+    75218125, 75239321, 75260579, 75281921, 75303408, 75325048, 75346880, 75368894, 75391102, 75413469, 75435978, 75458578,
+    75481228, 75503873, 75526461, 75548949, 75571290, 75593467, 75615447, 75637247, 75658856, 75680315, 75701637, 75722881,
+    75744072, 75765277, 75786524, 75807876, 75829351, 75851000, 75872823, 75894847, 75917045, 75939422, 75961924, 75984531,
+    76007176, 76029823, 76052408, 76074894, 76097236, 76119408, 76141393, 76163186, 76184802, 76206255, 76227585, 76248823,
+    76270022, 76291222, 76312476, 76333822, 76355305, 76376947, 76398777, 76420793, 76442999, 76465366, 76487877, 76510474,
+    76533128, 76555767, 76578359, 76600839, 76623185, 76645353, 76667340, 76689132, 76710749, 76732204, 76753535, 76774775,
+    76795976, 76817176, 76838431, 76859775, 76881258, 76902898, 76924725, 76946739, 76968940, 76991308, 77013812, 77036415,
+    77059060, 77081708, 77104293, 77126784, 77149123, 77171301, 77193282, 77215083, 77236694, 77258156, 77279481, 77300728,
+    77321922, 77343130, 77364378, 77385730, 77407205, 77428853, 77450673, 77472692, 77494888, 77517260, 77539761, 77562363,
+    77585010, 77607655, 77630246, 77652731, 77675078, 77697248, 77719237, 77741028, 77762647, 77784098, 77805431, 77826667,
+    77847869, 77869067, 77890324, 77911668, 77933154, 77954794, 77976625, 77998637, 78020844, 78043208, 78065718, 78088314,
+    78110967, 78133607, 78156199, 78178682, 78201028, 78223200, 78245186, 78266982, 78288597, 78310053, 78331380, 78352622,
+    78373818, 78395021, 78416273, 78437622, 78459103, 78480748, 78502574, 78524593, 78546792, 78569164, 78591663, 78614267,
+    78636909, 78659556, 78682138, 78704627, 78726965, 78749142, 78771125, 78792925, 78814538, 78835999, 78857326, 78878572,
+    78899768, 78920974, 78942224, 78963575, 78985053, 79006699, 79028523, 79050542, 79072742, 79095111, 79117614, 79140213,
+    79162861, 79185501, 79208092, 79230572, 79252920, 79275088, 79297080, 79318871, 79340493, 79361946, 79383281, 79404518,
+    79425722, 79446918, 79468176, 79489517, 79511002, 79532639, 79554469, 79576480, 79598687, 79621051, 79643560, 79666158,
+    79688809, 79711453, 79734041, 79756529, 79778871, 79801047, 79823030, 79844830, 79866442, 79887902, 79909228, 79930474,
+    79951668, 79972874, 79994123, 80015473, 80036949, 80058596, 80080417, 80102438, 80124635, 80147009, 80169509, 80192116,
+    80214760, 80237409, 80259993, 80282481, 80304822, 80326995, 80348979, 80370775, 80392389, 80413846, 80435175, 80456417,
+    80477616, 80498819, 80520073, 80541422, 80562903, 80584547, 80606374, 80628390, 80650593, 80672959, 80695467, 80718064,
+    80740717, 80763356, 80785950, 80808430, 80830778, 80852946, 80874936, 80896727, 80918346, 80939798, 80961132, 80982370,
+    81003572, 81024771, 81046028, 81067371, 81088855, 81110494, 81132323, 81154335, 81176538, 81198903, 81221407, 81244007,
+    81266653, 81289300, 81311887, 81334378, 81356719, 81378899, 81400882, 81422685, 81444296, 81465759, 81487083, 81508330,
+    81529522, 81550729, 81571975, 81593327, 81614801, 81636448, 81658268, 81680288, 81702484, 81724856, 81747356, 81769960,
+    81792605, 81815252, 81837841, 81860328, 81882675, 81904849, 81926839, 81948633, 81970252, 81991706, 82013038, 82034275,
+    82055475, 82076673, 82097927, 82119270, 82140752, 82162391, 82184220, 82206232, 82228438, 82250802, 82273312, 82295908,
+    82318562, 82341202, 82363796, 82386279, 82408627, 82430799, 82452789, 82474585, 82496203, 82517660, 82538991, 82560231,
+    82581430, 82602630, 82623882, 82645227, 82666707, 82688348, 82710172, 82732187, 82754386, 82776755, 82799256, 82821859,
+    82844502, 82867150, 82889734, 82912225, 82934564, 82956743, 82978726, 83000529, 83022142, 83043606, 83064934, 83086183,
+    83107378, 83128586, 83149834, 83171185, 83192660, 83214305, 83236124, 83258141, 83280336, 83302704, 83325204, 83347804,
+    83370451, 83393094, 83415685, 83438168, 83460518, 83482688, 83504681, 83526474, 83548097, 83569551, 83590887, 83612125,
+    83633329, 83654526, 83675784, 83697125, 83718608, 83740244, 83762072, 83784080, 83806284, 83828644, 83851152, 83873747,
+    83896399, 83919041, 83941632, 83964120, 83986466, 84008643, 84030630, 84052430, 84074045, 84095506, 84116833, 84138078,
+    84159274, 84180478, 84201728, 84223077, 84244554, 84266198, 84288019, 84310037, 84332233, 84354603, 84377101, 84399705,
+    84422347, 84444995, 84467579, 84490069, 84512410, 84534588, 84556573, 84578373, 84599989, 84621448, 84642777, 84664021,
+    84685218, 84706422, 84727674, 84749023, 84770501, 84792146, 84813970, 84835986, 84858186, 84880552, 84903056, 84925652,
+    84948302, 84970940, 84993533, 85016013, 85038362, 85060531, 85082524, 85104317, 85125940, 85147394, 85168730, 85189969,
+    85211172, 85232370, 85253627, 85274968, 85296451, 85318087, 85339915, 85361924, 85384127, 85406490, 85428994, 85451591,
+    85474238, 85496882, 85519469, 85541958, 85564300, 85586480, 85608464, 85630268, 85651882, 85673347, 85694674, 85715922,
+    85737117, 85758324, 85779571, 85800921, 85822394, 85844039, 85865857, 85887875, 85910068, 85932439, 85954937, 85977542,
+    86000185, 86022833, 86045420, 86067908, 86090253, 86112428, 86134417, 86156213, 86177832, 86199288, 86220620, 86241861,
+    86263061, 86284261, 86305515, 86326859, 86348339, 86369978, 86391804, 86413815, 86436018, 86458381, 86480890, 86503485,
+    86526139, 86548779, 86571374, 86593856, 86616206, 86638377, 86660368, 86682162, 86703781, 86725236, 86746569, 86767808,
+    86789009, 86810208, 86831463, 86852807, 86874289, 86895928, 86917754, 86939766, 86961965, 86984330, 87006832, 87029432,
+    87052076, 87074724, 87097309, 87119801, 87142142, 87164322, 87186306, 87208109, 87229722, 87251186, 87272512, 87293760,
+    87314954, 87336162, 87357409, 87378760, 87400234, 87421880, 87443697, 87465715, 87487908, 87510277, 87532776, 87555376,
+    87578022, 87600666, 87623257, 87645743, 87668093, 87690267, 87712261, 87734056, 87755679, 87777133, 87798468, 87819705,
+    87840907, 87862103, 87883357, 87904697, 87926178, 87947813, 87969640, 87991648, 88013852, 88036213, 88058721, 88081316,
+    88103969, 88126610, 88149205, 88171692, 88194042, 88216219, 88238211, 88260012, 88281630, 88303090, 88324420, 88345663,
+    88366859, 88388060, 88409309, 88430653, 88452129, 88473769, 88495589, 88517604, 88539800, 88562170, 88584669, 88607273,
+    88629917, 88652566, 88675151, 88697644, 88719985, 88742166, 88764153, 88785957, 88807573, 88829037, 88850366, 88871612,
+    88892808, 88914013, 88935261, 88956609, 88978082, 88999725, 89021544, 89043558, 89065754, 89088121, 89110623, 89133221,
+    89155871, 89178512, 89201106, 89223589, 89245940, 89268112, 89290107, 89311902, 89333527, 89354983, 89376322, 89397562,
+    89418767, 89439965, 89461221, 89482561, 89504042, 89525675, 89547499, 89569504, 89591704, 89614063, 89636568, 89659162,
+    89681812, 89704455, 89727046, 89749537, 89771883, 89794064, 89816053, 89837858, 89859475, 89880941, 89902270, 89923519,
+    89944716, 89965922, 89987170, 90008519, 90029992, 90051634, 90073450, 90095465, 90117655, 90140023, 90162518, 90185120,
+    90207762, 90230412, 90252999, 90275491, 90297837, 90320017, 90342008, 90363809, 90385428, 90406888, 90428220, 90449463,
+    90470663, 90491865, 90513117, 90534463, 90555941, 90577581, 90599403, 90621415, 90643613, 90665975, 90688480, 90711073,
+    90733725, 90756364, 90778959, 90801442, 90823795, 90845967, 90867963, 90889759, 90911383, 90932840, 90954176, 90975415,
+    90996618, 91017817, 91039072, 91060414, 91081896, 91103533, 91125359, 91147368, 91169567, 91191929, 91214430, 91237027,
+    91259670, 91282315, 91304900, 91327391, 91349733, 91371915, 91393901, 91415707, 91437324, 91458791, 91480120, 91501370,
+    91522566, 91543774, 91565021, 91586372, 91607844, 91629489, 91651305, 91673321, 91695513, 91717881, 91740377, 91762978,
+    91785621, 91808265, 91830853, 91853340, 91875688, 91897863, 91919857, 91941655, 91963279, 91984737, 92006074, 92027315,
+    92048517, 92069716, 92090970, 92112312, 92133791, 92155426, 92177251, 92199258, 92221459, 92243819, 92266326, 92288920,
+    92311573, 92334213, 92356808, 92379293, 92401643, 92423818, 92445811, 92467610, 92489231, 92510691, 92532024, 92553267,
+    92574467, 92595667, 92616919, 92638263, 92659740, 92681378, 92703200, 92725212, 92747408, 92769774, 92792274, 92814876,
+    92837520, 92860169, 92882754, 92905247, 92927588, 92949770, 92971754, 92993559, 93015173, 93036637, 93057965, 93079213,
+    93100408, 93121615, 93142863, 93164213, 93185686, 93207331, 93229148, 93251164, 93273358, 93295725, 93318224, 93340823,
+    93363470, 93386113, 93408706, 93431191, 93453543, 93475715, 93497710, 93519505, 93541130, 93562585, 93583922, 93605160,
+    93626364, 93647561, 93668817, 93690156, 93711637, 93733270, 93755096, 93777101, 93799301, 93821659, 93844164, 93866758,
+    93889408, 93912050, 93934644, 93957133, 93979483, 94001664, 94023656, 94045460, 94067079, 94088542, 94109872, 94131118,
+    94152313, 94173516, 94194763, 94216108, 94237581, 94259220, 94281037, 94303050, 94325242, 94347609, 94370106, 94392709,
+    94415351, 94438002, 94460589, 94483084, 94505430, 94527613, 94549603, 94571407, 94593027, 94614489, 94635820, 94657064,
+    94678259, 94699461, 94720708, 94742052, 94763525, 94785164, 94806982, 94828994, 94851190, 94873554, 94896057, 94918654,
+    94941305, 94963947, 94986543, 95009028, 95031382, 95053556, 95075554, 95097351, 95118978, 95140435, 95161773, 95183012,
+    95204216, 95225411, 95246666, 95268003, 95289482, 95311114, 95332937, 95354941, 95377140, 95399498, 95422001, 95444596,
+    95467243, 95489888, 95512477, 95534969, 95557314, 95579497, 95601486, 95623294, 95644912, 95666381, 95687711, 95708962,
+    95730158, 95751366, 95772612, 95793960, 95815430, 95837070, 95858883, 95880895, 95903083, 95925448, 95947942, 95970543,
+    95993185, 96015833, 96038421, 96060913, 96083262, 96105443, 96127437, 96149240, 96170864, 96192325, 96213661, 96234904,
+    96256106, 96277306, 96298558, 96319900, 96341376, 96363010, 96384830, 96406835, 96429031, 96451388, 96473892, 96496483,
+    96519135, 96541775, 96564372, 96586859, 96609214, 96631391, 96653389, 96675190, 96696815, 96718275, 96739611, 96760853,
+    96782055, 96803253, 96824506, 96845847, 96867325, 96888959, 96910780, 96932787, 96954983, 96977344, 96999842, 97022440,
+    97045083, 97067730, 97090316, 97112810, 97135154, 97157339, 97179327, 97201136, 97222753, 97244221, 97265551, 97286801,
+    97307996, 97329203, 97350449, 97371799, 97393270, 97414913, 97436728, 97458742, 97480933, 97503299, 97525794, 97548393,
+    97571036, 97593679, 97616269, 97638756, 97661107, 97683283, 97705280, 97727080, 97748707, 97770167, 97791507, 97812748,
+    97833953, 97855151, 97876406, 97897745, 97919223, 97940855, 97962677, 97984680, 98006879, 98029234, 98051738, 98074329,
+    98096980, 98119619, 98142213, 98164701, 98187052, 98209232, 98231227, 98253032, 98274655, 98296121, 98317455, 98338702,
+    98359902, 98381105, 98402355, 98423698, 98445172, 98466808, 98488624, 98510634, 98532824, 98555189, 98577684, 98600286,
+    98622928, 98645578, 98668164, 98690659, 98713004, 98735188, 98757177, 98778984, 98800603, 98822069, 98843400, 98864648,
+    98885845, 98907050, 98928298, 98949645, 98971117, 98992757, 99014572, 99036584, 99058776, 99081140, 99103640, 99126236,
+    99148886, 99171528, 99194123, 99216609, 99238964, 99261138, 99283136, 99304933, 99326560, 99348017, 99369356, 99390596,
+    99411801, 99432998, 99454254, 99475593, 99497074, 99518706, 99540530, 99562533, 99584732, 99607088, 99629590, 99652183,
+    99674831, 99697473, 99720064, 99742555, 99764904, 99787087, 99809078, 99830885, 99852504, 99873972, 99895303, 99916552,
+    99937748, 99958954, 99980202, 100001550, 100023021, 100044662, 100066476, 100088488, 100110676, 100133042, 100155535, 100178136,
+    100200776, 100223425, 100246012, 100268507, 100290855, 100313039, 100335033, 100356839, 100378462, 100399926, 100421259, 100442503,
+    100463702, 100484902, 100506150, 100527493, 100548966, 100570602, 100592420, 100614427, 100636623, 100658982, 100681485, 100704079,
+    100726731, 100749371, 100771969, 100794456, 100816813, 100838990, 100860991, 100882792, 100904420, 100925880, 100947218, 100968458,
+    100989660, 101010856, 101032108, 101053446, 101074922, 101096553, 101118374, 101140379, 101162576, 101184936, 101207437, 101230035,
+    101252681, 101275327, 101297916, 101320410, 101342756, 101364941, 101386931, 101408741, 101430360, 101451830, 101473161, 101494412,
+    101515607, 101536813, 101558058, 101579406, 101600874, 101622514, 101644326, 101666338, 101688526, 101710892, 101733386, 101755987,
+    101778630, 101801277, 101823867, 101846358, 101868709, 101890889, 101912886, 101934688, 101956315, 101977777, 101999117, 102020360,
+    102041564, 102062764, 102084017, 102105356, 102126831, 102148461, 102170280, 102192281, 102214475, 102236829, 102259332, 102281922,
+    102304574, 102327214, 102349811, 102372300, 102394656, 102416836, 102438835, 102460640, 102482266, 102503731, 102525068, 102546313,
+    102567515, 102588715, 102609967, 102631308, 102652782, 102674415, 102696231, 102718236, 102740426, 102762786, 102785280, 102807879,
+    102830521, 102853171, 102875758, 102898256, 102920603, 102942791, 102964782, 102986592, 103008212, 103029681, 103051011, 103072260,
+    103093456, 103114661, 103135906, 103157254, 103178723, 103200362, 103222175, 103244186, 103266375, 103288738, 103311234, 103333830,
+    103356476, 103379119, 103401713, 103424201, 103446557, 103468734, 103490735, 103512536, 103534166, 103555625, 103576965, 103598206,
+    103619410, 103640607, 103661862, 103683199, 103704678, 103726308, 103748130, 103770131, 103792328, 103814682, 103837183, 103859773,
+    103882421, 103905061, 103927653, 103950142, 103972493, 103994675, 104016670, 104038479, 104060103, 104081572, 104102907, 104124157,
+    104145356, 104166560, 104187808, 104209153, 104230624, 104252260, 104274073, 104296081, 104318268, 104340631, 104363123, 104385723,
+    104408362, 104431010, 104453596, 104476091, 104498438, 104520624, 104542617, 104564426, 104586050, 104607518, 104628852, 104650100,
+    104671299, 104692502, 104713749, 104735092, 104756562, 104778197, 104800011, 104822018, 104844209, 104866568, 104889068, 104911661,
+    104934311, 104956953, 104979550, 105002037, 105024394, 105046571, 105068572, 105090372, 105112002, 105133462, 105154803, 105176044,
+    105197249, 105218445, 105239700, 105261037, 105282514, 105304143, 105325963, 105347965, 105370161, 105392517, 105415018, 105437612,
+    105460259, 105482904, 105505494, 105527987, 105550335, 105572520, 105594511, 105616320, 105637940, 105659409, 105680740, 105701991,
+)
@@ -0,0 +1,142 @@
+'''BaZi almanacs: the pillars for every day or hour of a range, walked
+incrementally instead of running BaZiChart.from_solar_date on each moment.
+
+Each step only counts the day pillar on (stem and branch both go up by one
+a day), takes the hour pillar from a day stem x hour table, and bumps the
+lunar day. The lunar date, year and month are only worked out again when
+the walk crosses a boundary: the start of a lunar month, new year's day,
+or with solar_terms=True, the next solar term. Every record matches
+from_solar_date for the same moment, solar_terms included.
+
+    for rec in hours(date(2024, 1, 1), date(2024, 12, 31)):
+        rec.hour_stem, rec.hour_branch, ...
+    for batch in blocks(datetime(1950, 1, 1), datetime(2050, 1, 1), timedelta(hours=1)):
+        batch.pillar_codes()    # BaZiBatch of up to block_size rows
+
+Records hold integer codes (indexes into _stems and _branches) and turn
+into a BaZiChart with .chart() when needed.'''
+
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+import numpy as np
+from attrs import define
+from src.purple_star_chart.bazi_batch import BaZiBatch, to_datetime64
+from src.purple_star_chart.lunar_index import _month_starts, _month_years, _month_numbers, _month_leaps, month_loc
+from src.purple_star_chart.solar_terms import month_stem, pillar_locs, term_datetime, term_loc
+
+_day_zero = date(2000, 1, 7).toordinal()
+
+# (stem, branch) of each clock hour's pillar, by day stem; 23:00 is zi of
+# the same day
+_hour_pillars = tuple(tuple((((day_stem % 5) * 2 + (hour + 1) // 2 % 12) % 10, (hour + 1) // 2 % 12)
+                            for hour in range(24)) for day_stem in range(10))
+
+@define
+class PillarRecord:
+    '''pillars for one moment, as stem/branch indexes, plus its lunar date.
+    Not frozen: frozen attrs classes cost several times as much to make,
+    and walks make a lot of them.'''
+    solar_date: datetime
+    lunar_year: int
+    lunar_month: int
+    lunar_day: int
+    lunar_leap: bool
+    year_stem: int
+    year_branch: int
+    month_stem: int
+    month_branch: int
+    day_stem: int
+    day_branch: int
+    hour_stem: int
+    hour_branch: int
+
+    def pillar_codes(self):
+        return (self.year_stem, self.year_branch, self.month_stem, self.month_branch,
+                self.day_stem, self.day_branch, self.hour_stem, self.hour_branch)
+
+    def chart(self):
+        '''the BaZiChart from_solar_date gives for this moment'''
+        from lunardate import LunarDate
+        from src.purple_star_chart import _stem_lookup, _branch_lookup, _stems, _branches
+        from src.purple_star_chart.BaZiChart import BaZiChart
+        from src.purple_star_chart.constructor_classes import Pillar
+
+        codes = self.pillar_codes()
+        pillars = [Pillar(ptype, _stem_lookup[_stems[codes[2 * n]]], _branch_lookup[_branches[codes[2 * n + 1]]])
+                   for n, ptype in enumerate(('year', 'month', 'day', 'hour'))]
+        ldate = LunarDate(self.lunar_year, self.lunar_month, self.lunar_day, self.lunar_leap)
+        return BaZiChart(self.solar_date, ldate, *pillars)
+
+def _as_datetime(when):
+    return when if isinstance(when, datetime) else datetime(when.year, when.month, when.day)
+
+def walk(start, stop, step=timedelta(hours=1), solar_terms=False):
+    '''lazily yields a PillarRecord for start, start + step, ... up to but not
+    including stop. solar_terms as in BaZiChart.from_solar_date.'''
+    if step <= timedelta(0):
+        raise ValueError('step has to be positive')
+    start, stop = _as_datetime(start), _as_datetime(stop)
+    if start >= stop:
+        return
+    last = stop - timedelta(microseconds=1)
+    loc = month_loc(start)
+    month_loc(last)
+    if solar_terms:
+        term_loc(start)
+        term_loc(last)
+
+    next_day = start
+    year = None
+    next_term = None
+    dt = start
+    while dt < stop:
+        if dt >= next_day:
+            # a new day: day pillar and lunar day count on, the rest only
+            # changes on boundaries
+            ordinal = dt.toordinal()
+            next_day = datetime.combine(dt.date(), datetime.min.time()) + timedelta(days=1)
+            if ordinal >= _month_starts[loc + 1]:
+                loc = bisect_right(_month_starts, ordinal) - 1
+            lyear, lmonth, leap = _month_years[loc], _month_numbers[loc], _month_leaps[loc]
+            lday = ordinal - _month_starts[loc] + 1
+            diff = ordinal - _day_zero
+            dstem, dbranch = diff % 10, diff % 12
+            hour_pillars = _hour_pillars[dstem]
+            if not solar_terms:
+                if dt.year != year:
+                    year = dt.year
+                    cycle = (year - 4) % 60
+                    ystem, ybranch = cycle % 10, cycle % 12
+                    mstem = ((year - 3) % 60 % 5) * 2
+                mbranch = (lmonth + 1) % 12
+        if solar_terms and (next_term is None or dt >= next_term):
+            cycle, mbranch = pillar_locs(dt)
+            ystem, ybranch = cycle % 10, cycle % 12
+            mstem = month_stem(ystem, mbranch)
+            next_term = term_datetime(term_loc(dt) + 1)
+        hstem, hbranch = hour_pillars[dt.hour]
+        yield PillarRecord(dt, lyear, lmonth, lday, leap, ystem, ybranch, mstem, mbranch, dstem, dbranch, hstem, hbranch)
+        dt += step
+
+def days(first, last, solar_terms=False):
+    '''a PillarRecord for midnight of every date from first to last,
+    inclusive'''
+    return walk(first, _as_datetime(last) + timedelta(days=1), timedelta(days=1), solar_terms)
+
+def hours(first, last, solar_terms=False):
+    '''a PillarRecord for the start of every hour of every date from first to
+    last, inclusive'''
+    return walk(first, _as_datetime(last) + timedelta(days=1), timedelta(hours=1), solar_terms)
+
+def blocks(start, stop, step=timedelta(hours=1), solar_terms=False, block_size=8760):
+    '''the same moments as walk(), as BaZiBatch blocks of up to block_size
+    rows each, computed a whole block at a time with numpy'''
+    if step <= timedelta(0):
+        raise ValueError('step has to be positive')
+    start = to_datetime64([start])[0]
+    stop = to_datetime64([stop])[0]
+    step = np.timedelta64(step, 'us')
+    while start < stop:
+        block_stop = min(stop, start + step * block_size)
+        yield BaZiBatch.from_solar_dates(np.arange(start, block_stop, step), solar_terms)
+        start = block_stop
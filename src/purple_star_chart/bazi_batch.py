@@ -0,0 +1,127 @@
+'''Vectorized BaZi pillars for whole arrays of birth datetimes.
+Same arithmetic as BaZiChart.from_solar_date, done with numpy over every
+row at once. Pillars come back as integer stem/branch indexes (into _stems
+and _branches), one array per field, and any row can be turned back into
+a normal BaZiChart with BaZiBatch.chart().'''
+
+import numpy as np
+from attrs import define
+from datetime import date
+from src.purple_star_chart import _stem_lookup, _branch_lookup, _stems, _branches
+from src.purple_star_chart.constructor_classes import Pillar
+from src.purple_star_chart.lunar_index import _month_starts, _month_years, _month_numbers, _month_leaps, first_date, last_date
+from src.purple_star_chart._solar_term_table import first_year, term_minutes
+from lunardate import LunarDate
+
+_month_starts_arr = np.array(_month_starts, dtype=np.int64)
+_month_years_arr = np.array(_month_years, dtype=np.int16)
+_month_numbers_arr = np.array(_month_numbers, dtype=np.int8)
+_month_leaps_arr = np.array(_month_leaps, dtype=bool)
+_term_minutes_arr = np.array(term_minutes, dtype=np.int64)
+
+# datetime64 day 0 is 1970-01-01
+_term_epoch = np.datetime64('1900-01-01T00:00', 'm')
+_epoch_ordinal = date(1970, 1, 1).toordinal()
+_day_zero = date(2000, 1, 7).toordinal()
+
+pillar_fields = ('year', 'month', 'day', 'hour')
+
+def to_datetime64(solar_dts):
+    '''datetime64[us] array from datetimes or anything numpy can parse'''
+    return np.asarray(solar_dts, dtype='datetime64[us]').reshape(-1)
+
+def lunar_arrays(ordinals):
+    '''vectorized lunar_from_solar on date ordinals; returns (year, month,
+    day, is_leap) arrays'''
+    loc = np.searchsorted(_month_starts_arr, ordinals, side='right') - 1
+    if np.any(loc < 0) or np.any(loc >= len(_month_years_arr)):
+        raise ValueError(f'dates outside the supported range {first_date} to {last_date}')
+    day = (ordinals - _month_starts_arr[loc] + 1).astype(np.int8)
+    return _month_years_arr[loc], _month_numbers_arr[loc], day, _month_leaps_arr[loc]
+
+def solar_term_arrays(solar):
+    '''vectorized solar_terms.pillar_locs on a datetime64 array; returns
+    (year cycle position, month branch) arrays'''
+    minutes = (solar.astype('datetime64[m]') - _term_epoch).astype(np.int64)
+    loc = np.searchsorted(_term_minutes_arr, minutes, side='right') - 1
+    if np.any(loc < 0) or np.any(loc >= len(_term_minutes_arr) - 1):
+        raise ValueError('dates outside the solar term table')
+    year = first_year + loc // 24 - (loc % 24 < 2)
+    return (year - 4) % 60, (loc % 24 // 2 + 1) % 12
+
+@define
+class BaZiBatch:
+    '''structure of arrays version of BaZiChart; every array has one entry
+    per input datetime'''
+    solar_date: np.ndarray
+    lunar_year: np.ndarray
+    lunar_month: np.ndarray
+    lunar_day: np.ndarray
+    lunar_leap: np.ndarray
+    year_stem: np.ndarray
+    year_branch: np.ndarray
+    month_stem: np.ndarray
+    month_branch: np.ndarray
+    day_stem: np.ndarray
+    day_branch: np.ndarray
+    hour_stem: np.ndarray
+    hour_branch: np.ndarray
+
+    @classmethod
+    def from_solar_dates(cls, solar_dts, solar_terms=False):
+        '''solar_terms as in BaZiChart.from_solar_date'''
+        solar = to_datetime64(solar_dts)
+        days = solar.astype('datetime64[D]')
+        ordinals = days.astype(np.int64) + _epoch_ordinal
+        year = solar.astype('datetime64[Y]').astype(np.int64) + 1970
+        hour = (solar.astype('datetime64[h]') - days).astype(np.int64)
+        lyear, lmonth, lday, lleap = lunar_arrays(ordinals)
+        cycle_loc = (year - 3) % 60
+
+        # year, month
+        ystem = (cycle_loc % 10 - 1) % 10
+        ybranch = (cycle_loc % 12 - 1) % 12
+        mstem = (cycle_loc % 5) * 2
+        mbranch = (lmonth.astype(np.int64) + 1) % 12
+        if solar_terms:
+            cycle, mbranch = solar_term_arrays(solar)
+            ystem, ybranch = cycle % 10, cycle % 12
+            mstem = ((ystem % 5) * 2 + 2 + (mbranch - 2) % 12) % 10
+
+        # day, jia zi on the reference day itself
+        days_diff = ordinals - _day_zero
+        is_zero = days_diff == 0
+        dstem = np.where(is_zero, 0, days_diff % 10)
+        dbranch = np.where(is_zero, 0, days_diff % 12)
+
+        # hour, 23:00 rolls over to zi
+        hs_diff = np.where(hour < 23, (hour + 1) // 2, 0)
+        hstem = ((dstem % 5) * 2 + hs_diff) % 10
+
+        codes = [ystem, ybranch, mstem, mbranch, dstem, dbranch, hstem, hs_diff]
+        return cls(solar, lyear, lmonth, lday, lleap, *(c.astype(np.int8) for c in codes))
+
+    def __len__(self):
+        return len(self.solar_date)
+
+    def pillar_codes(self):
+        '''(n, 8) int8 matrix: stem, branch for year, month, day, hour'''
+        return np.stack([self.year_stem, self.year_branch, self.month_stem, self.month_branch,
+                         self.day_stem, self.day_branch, self.hour_stem, self.hour_branch], axis=1)
+
+    def chart(self, i):
+        '''normal BaZiChart for row i'''
+        from src.purple_star_chart.BaZiChart import BaZiChart
+
+        ldate = LunarDate(int(self.lunar_year[i]), int(self.lunar_month[i]), int(self.lunar_day[i]),
+                          bool(self.lunar_leap[i]))
+        pillars = []
+        for ptype in pillar_fields:
+            stem = _stem_lookup[_stems[getattr(self, ptype + '_stem')[i]]]
+            branch = _branch_lookup[_branches[getattr(self, ptype + '_branch')[i]]]
+            pillars.append(Pillar(ptype, stem, branch))
+        return BaZiChart(self.solar_date[i].item(), ldate, *pillars)
+
+    def charts(self):
+        for i in range(len(self)):
+            yield self.chart(i)
@@ -0,0 +1,44 @@
+'''Pieces shared by the binary chart formats (chart_table, chart_codec,
+compact_chart): solar dates as int64 microseconds since 1900, and the
+file header that carries a magic, a format version, the record size and
+count, and the star slot names the records were written for.
+
+Header layout (little endian):
+    magic, version, slot count, record size, record count, data offset,
+    slot name length, then the newline separated _star_slots, padded out
+    to a multiple of ALIGN so records start aligned'''
+
+import struct
+from datetime import datetime, timedelta
+from src.purple_star_chart import _star_slots
+
+EPOCH = datetime(1900, 1, 1)
+NO_DATE = -2 ** 63
+HEADER = struct.Struct('<4sHHHIIH')
+ALIGN = 64
+
+def micros(solar_dt):
+    '''microseconds from EPOCH to a date or datetime, NO_DATE for None'''
+    if solar_dt is None:
+        return NO_DATE
+    delta = solar_dt - EPOCH if isinstance(solar_dt, datetime) else solar_dt - EPOCH.date()
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def from_micros(value):
+    '''the datetime micros() was given, None for NO_DATE'''
+    return None if value == NO_DATE else EPOCH + timedelta(microseconds=value)
+
+def header_bytes(magic, version, record_size, count):
+    '''header plus slot names, padded to where the records start'''
+    names = '\n'.join(_star_slots).encode()
+    head_len = HEADER.size + len(names)
+    offset = -(-head_len // ALIGN) * ALIGN
+    header = HEADER.pack(magic, version, len(_star_slots), record_size, count, offset, len(names))
+    return (header + names).ljust(offset, b'\0')
+
+def read_header(buf):
+    '''(magic, version, record size, record count, data offset, slot names)
+    from the start of buf'''
+    magic, version, _, record_size, count, offset, names_len = HEADER.unpack_from(buf)
+    names = bytes(buf[HEADER.size:HEADER.size + names_len]).decode().split('\n')
+    return magic, version, record_size, count, offset, names
@@ -0,0 +1,230 @@
+'''Offline generator for _solar_term_table.py, the solar term instants
+solar_terms looks up. Run `python -m src.purple_star_chart.build_solar_terms`
+to rebuild the table, or with --check to compare the checked in table
+against a fresh computation and the existing (lunar month) boundaries.
+
+Each term is the moment the sun's apparent ecliptic longitude reaches a
+multiple of 15 degrees. Longitude comes from the truncated VSOP87 series in
+Meeus, Astronomical Algorithms (appendix III, ch. 25 and 32) with FK5,
+nutation and aberration corrections, which is good to a few arcseconds, so
+well under a minute in time; the instant is solved by Newton iteration in
+dynamical time and moved to UT with the Espenak & Meeus delta T fits, then
+written out as minutes in China Standard Time (UTC+8).'''
+
+import math
+import os
+from datetime import datetime, timedelta
+
+first_year = 1900
+last_year = 2100
+_EPOCH = datetime(1900, 1, 1)
+_UTC_OFFSET = timedelta(hours=8)
+_J2000 = 2451545.0
+_UNIX_JD = 2440587.5
+_ARCSEC = math.pi / (180 * 3600)
+
+# (amplitude, phase, frequency) terms of the earth's heliocentric longitude
+# (L0..L5) and radius (R0, R1), amplitudes in 1e-8 rad / au
+_L = (
+    ((175347046, 0, 0), (3341656, 4.6692568, 6283.07585), (34894, 4.6261, 12566.1517),
+     (3497, 2.7441, 5753.3849), (3418, 2.8289, 3.5231), (3136, 3.6277, 77713.7715),
+     (2676, 4.4181, 7860.4194), (2343, 6.1352, 3930.2097), (1324, 0.7425, 11506.7698),
+     (1273, 2.0371, 529.691), (1199, 1.1096, 1577.3435), (990, 5.233, 5884.927),
+     (902, 2.045, 26.298), (857, 3.508, 398.149), (780, 1.179, 5223.694),
+     (753, 2.533, 5507.553), (505, 4.583, 18849.228), (492, 4.205, 775.523),
+     (357, 2.92, 0.067), (317, 5.849, 11790.629), (284, 1.899, 796.298),
+     (271, 0.315, 10977.079), (243, 0.345, 5486.778), (206, 4.806, 2544.314),
+     (205, 1.869, 5573.143), (202, 2.458, 6069.777), (156, 0.833, 213.299),
+     (132, 3.411, 2942.463), (126, 1.083, 20.775), (115, 0.645, 0.98),
+     (103, 0.636, 4694.003), (102, 0.976, 15720.839), (102, 4.267, 7.114),
+     (99, 6.21, 2146.17), (98, 0.68, 155.42), (86, 5.98, 161000.69),
+     (85, 1.3, 6275.96), (85, 3.67, 71430.7), (80, 1.81, 17260.15),
+     (79, 3.04, 12036.46), (75, 1.76, 5088.63), (74, 3.5, 3154.69),
+     (74, 4.68, 801.82), (70, 0.83, 9437.76), (62, 3.98, 8827.39),
+     (61, 1.82, 7084.9), (57, 2.78, 6286.6), (56, 4.39, 14143.5),
+     (56, 3.47, 6279.55), (52, 0.19, 12139.55), (52, 1.33, 1748.02),
+     (51, 0.28, 5856.48), (49, 0.49, 1194.45), (41, 5.37, 8429.24),
+     (41, 2.4, 19651.05), (39, 6.17, 10447.39), (37, 6.04, 10213.29),
+     (37, 2.57, 1059.38), (36, 1.71, 2352.87), (36, 1.78, 6812.77),
+     (33, 0.59, 17789.85), (30, 0.44, 83996.85), (30, 2.74, 1349.87),
+     (25, 3.16, 4690.48)),
+    ((628331966747, 0, 0), (206059, 2.678235, 6283.07585), (4303, 2.6351, 12566.1517),
+     (425, 1.59, 3.523), (119, 5.796, 26.298), (109, 2.966, 1577.344),
+     (93, 2.59, 18849.23), (72, 1.14, 529.69), (68, 1.87, 398.15),
+     (67, 4.41, 5507.55), (59, 2.89, 5223.69), (56, 2.17, 155.42),
+     (45, 0.4, 796.3), (36, 0.47, 775.52), (29, 2.65, 7.11),
+     (21, 5.34, 0.98), (19, 1.85, 5486.78), (19, 4.97, 213.3),
+     (17, 2.99, 6275.96), (16, 0.03, 2544.31), (16, 1.43, 2146.17),
+     (15, 1.21, 10977.08), (12, 2.83, 1748.02), (12, 3.26, 5088.63),
+     (12, 5.27, 1194.45), (12, 2.08, 4694), (11, 0.77, 553.57),
+     (10, 1.3, 6286.6), (10, 4.24, 1349.87), (9, 2.7, 242.73),
+     (9, 5.64, 951.72), (8, 5.3, 2352.87), (6, 2.65, 9437.76),
+     (6, 4.67, 4690.48)),
+    ((52919, 0, 0), (8720, 1.0721, 6283.0758), (309, 0.867, 12566.152),
+     (27, 0.05, 3.52), (16, 5.19, 26.3), (16, 3.68, 155.42),
+     (10, 0.76, 18849.23), (9, 2.06, 77713.77), (7, 0.83, 775.52),
+     (5, 4.66, 1577.34), (4, 1.03, 7.11), (4, 3.44, 5573.14),
+     (3, 5.14, 796.3), (3, 6.05, 5507.55), (3, 1.19, 242.73),
+     (3, 6.12, 529.69), (3, 0.31, 398.15), (3, 2.28, 553.57),
+     (2, 4.38, 5223.69), (2, 3.75, 0.98)),
+    ((289, 5.844, 6283.076), (35, 0, 0), (17, 5.49, 12566.15),
+     (3, 5.2, 155.42), (1, 4.72, 3.52), (1, 5.3, 18849.23),
+     (1, 5.97, 242.73)),
+    ((114, 3.142, 0), (8, 4.13, 6283.08), (1, 3.84, 12566.15)),
+    ((1, 3.14, 0),)
+)
+_R = (
+    ((100013989, 0, 0), (1670700, 3.0984635, 6283.07585), (13956, 3.05525, 12566.1517),
+     (3084, 5.1985, 77713.7715), (1628, 1.1739, 5753.3849), (1576, 2.8469, 7860.4194)),
+    ((103019, 1.10749, 6283.07585), (1721, 1.0644, 12566.1517))
+)
+
+def _series(terms, tau):
+    return sum(sum(a * math.cos(b + c * tau) for a, b, c in series) * tau ** n
+               for n, series in enumerate(terms)) / 1e8
+
+def sun_longitude(jde):
+    '''apparent geocentric ecliptic longitude of the sun, in degrees, at a
+    julian ephemeris day'''
+    tau = (jde - _J2000) / 365250
+    t = tau * 10
+    longitude = _series(_L, tau) + math.pi
+    radius = _series(_R, tau)
+
+    omega = math.radians(125.04452 - 1934.136261 * t)
+    sun_mean = math.radians(280.4665 + 36000.7698 * t)
+    moon_mean = math.radians(218.3165 + 481267.8813 * t)
+    nutation = (-17.20 * math.sin(omega) - 1.32 * math.sin(2 * sun_mean)
+                - 0.23 * math.sin(2 * moon_mean) + 0.21 * math.sin(2 * omega))
+    correction = -0.09033 + nutation - 20.4898 / radius
+    return math.degrees(longitude + correction * _ARCSEC) % 360
+
+def delta_t(year):
+    '''TT - UT in seconds for a decimal year (Espenak & Meeus 2006)'''
+    if year < 1900:
+        t = year - 1860
+        return 7.62 + 0.5737 * t - 0.251754 * t ** 2 + 0.01680668 * t ** 3 - 0.0004473624 * t ** 4 + t ** 5 / 233174
+    if year < 1920:
+        t = year - 1900
+        return -2.79 + 1.494119 * t - 0.0598939 * t ** 2 + 0.0061966 * t ** 3 - 0.000197 * t ** 4
+    if year < 1941:
+        t = year - 1920
+        return 21.20 + 0.84493 * t - 0.076100 * t ** 2 + 0.0020936 * t ** 3
+    if year < 1961:
+        t = year - 1950
+        return 29.07 + 0.407 * t - t ** 2 / 233 + t ** 3 / 2547
+    if year < 1986:
+        t = year - 1975
+        return 45.45 + 1.067 * t - t ** 2 / 260 - t ** 3 / 718
+    if year < 2005:
+        t = year - 2000
+        return (63.86 + 0.3345 * t - 0.060374 * t ** 2 + 0.0017275 * t ** 3 + 0.000651814 * t ** 4
+                + 0.00002373599 * t ** 5)
+    if year < 2050:
+        t = year - 2000
+        return 62.92 + 0.32217 * t + 0.005589 * t ** 2
+    return -20 + 32 * ((year - 1820) / 100) ** 2 - 0.5628 * (2150 - year)
+
+def term_instant(year, longitude):
+    '''datetime (China Standard Time, naive) the sun reaches longitude
+    degrees, for the one crossing in Gregorian year year'''
+    # mean longitude is ~280 degrees at the start of the year
+    day_guess = ((longitude - 280) % 360) * 365.2422 / 360
+    jde = _UNIX_JD + (datetime(year, 1, 1) - datetime(1970, 1, 1)).days + day_guess
+    for _ in range(20):
+        diff = (longitude - sun_longitude(jde) + 180) % 360 - 180
+        jde += diff * 365.2422 / 360
+        if abs(diff) < 1e-7:
+            break
+    year_frac = year + day_guess / 365.2422
+    ut = (jde - _UNIX_JD) * 86400 - delta_t(year_frac)
+    return datetime(1970, 1, 1) + timedelta(seconds=ut) + _UTC_OFFSET
+
+def term_minutes():
+    '''minutes since 1900-01-01 00:00 CST of every term from xiao han of
+    first_year through dong zhi of last_year'''
+    out = []
+    for year in range(first_year, last_year + 1):
+        for n in range(24):
+            instant = term_instant(year, (285 + 15 * n) % 360)
+            out.append(round((instant - _EPOCH).total_seconds() / 60))
+    return out
+
+def write_table(path=None):
+    path = path or os.path.join(os.path.dirname(__file__), '_solar_term_table.py')
+    minutes = term_minutes()
+    lines = ['\'\'\'Generated by build_solar_terms.py; do not edit by hand.\'\'\'', '',
+             f'first_year = {first_year}', f'last_year = {last_year}', '',
+             '# minutes since 1900-01-01 00:00 China Standard Time (UTC+8) of every',
+             '# solar term, 24 per Gregorian year starting from xiao han',
+             'term_minutes = (']
+    for i in range(0, len(minutes), 12):
+        lines.append('    ' + ', '.join(str(m) for m in minutes[i:i + 12]) + ',')
+    lines.append(')')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+# published instants (CST) the computation should land within a minute or two of
+_REFERENCE = {
+    (2000, 5): datetime(2000, 3, 20, 15, 35),    # chun fen
+    (2000, 11): datetime(2000, 6, 21, 9, 48),    # xia zhi
+    (2023, 23): datetime(2023, 12, 22, 11, 27),  # dong zhi
+    (2024, 2): datetime(2024, 2, 4, 16, 27),     # li chun
+    (2024, 5): datetime(2024, 3, 20, 11, 6),     # chun fen
+}
+
+def check():
+    '''problems with the checked in table, as a list of strings (should be
+    empty): it has to match a fresh computation, land near published
+    instants, and only move pillars around term boundaries'''
+    from src.purple_star_chart import _solar_term_table as table
+    from src.purple_star_chart.BaZiChart import BaZiChart
+    from src.purple_star_chart.lunar_index import first_date, last_date
+    from src.purple_star_chart.solar_terms import term_datetime
+
+    problems = []
+    if list(table.term_minutes) != term_minutes():
+        problems.append('checked in table differs from a fresh build')
+    for (year, n), expected in _REFERENCE.items():
+        got = term_datetime((year - first_year) * 24 + n)
+        if abs(got - expected) > timedelta(minutes=2):
+            problems.append(f'term {n} of {year}: {got} vs published {expected}')
+    for k in range(len(table.term_minutes) - 1):
+        gap = table.term_minutes[k + 1] - table.term_minutes[k]
+        if not 14 * 1440 < gap < 17 * 1440:
+            problems.append(f'terms {k} and {k + 1} are {gap / 1440:.2f} days apart')
+
+    # against the existing gregorian year / lunar month pillars: the year can
+    # only differ between new year's day and li chun, and the month branch is
+    # never more than one off the lunar month's
+    this_day = first_date
+    while this_day <= last_date:
+        dt = datetime.combine(this_day, datetime.min.time()) + timedelta(hours=12)
+        plain = BaZiChart.from_solar_date(dt)
+        terms = BaZiChart.from_solar_date(dt, solar_terms=True)
+        li_chun = term_datetime((dt.year - first_year) * 24 + 2)
+        if (plain.year != terms.year) != (dt < li_chun):
+            problems.append(f'{dt}: year pillar {terms.year} vs {plain.year}')
+        month_off = (branch_loc(terms.month) - branch_loc(plain.month)) % 12
+        if month_off not in (0, 1, 11):
+            problems.append(f'{dt}: month pillar {terms.month} vs {plain.month}')
+        if (plain.day, plain.hour) != (terms.day, terms.hour):
+            problems.append(f'{dt}: day/hour pillars changed')
+        this_day += timedelta(days=1)
+    return problems
+
+def branch_loc(pillar):
+    from src.purple_star_chart import _branches
+    return _branches.index(pillar.branch.name)
+
+if __name__ == '__main__':
+    import sys
+
+    if '--check' in sys.argv:
+        problems = check()
+        print(f'{len(problems)} problems')
+        for problem in problems[:20]:
+            print(problem)
+        sys.exit(1 if problems else 0)
+    print(write_table())
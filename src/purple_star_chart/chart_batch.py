@@ -0,0 +1,103 @@
+'''Full Purple Star charts for many births at once.
+Glues the vectorized BaZi pillars (bazi_batch) to the compiled star engine
+(star_engine) so a whole array of datetimes and genders goes from input to
+star placements without building any per-chart objects. Rows can still be
+turned into a PurpleStarChart, or into the same dict PurpleStarChart.to_dict
+gives, on demand.'''
+
+import numpy as np
+from attrs import define
+from src.purple_star_chart import _stems, _branches, _genders, _palace_names, _phase_names, _star_slots
+from src.purple_star_chart.bazi_batch import BaZiBatch
+from src.purple_star_chart.chart_key import cycle_from_pillar
+from src.purple_star_chart.magnitudes import magnitude_codes
+from src.purple_star_chart.star_engine import Placements, place
+
+def gender_codes(genders):
+    '''0 for male, 1 for female; raises ValueError on anything else'''
+    if isinstance(genders, np.ndarray) and genders.dtype.kind in 'iub':
+        return genders.astype(np.int8)
+    return np.array([_genders.index(g) for g in genders], dtype=np.int8)
+
+@define
+class ChartBatch:
+    bazi: BaZiBatch
+    gender: np.ndarray
+    placements: Placements
+
+    @classmethod
+    def from_solar_dates(cls, solar_dts, genders):
+        bazi = BaZiBatch.from_solar_dates(solar_dts)
+        gender = gender_codes(genders)
+        year = cycle_from_pillar(bazi.year_stem.astype(np.int64), bazi.year_branch.astype(np.int64))
+        placed = place(year, bazi.lunar_month, bazi.lunar_day, bazi.hour_branch, gender)
+        return cls(bazi, gender, placed)
+
+    def __len__(self):
+        return len(self.gender)
+
+    def key_index(self):
+        '''ChartKey.index() for every row'''
+        year = cycle_from_pillar(self.bazi.year_stem.astype(np.int64), self.bazi.year_branch.astype(np.int64))
+        month = self.bazi.lunar_month.astype(np.int64) - 1
+        day = self.bazi.lunar_day.astype(np.int64) - 1
+        hour = self.bazi.hour_branch.astype(np.int64)
+        return (((year * 12 + month) * 30 + day) * 12 + hour) * 2 + self.gender
+
+    def magnitudes(self):
+        '''(n, len(_star_slots)) magnitude codes: 0 for none, otherwise index
+        into _magnitude_names + 1'''
+        return magnitude_codes(self.placements.positions)
+
+    def chart(self, i):
+        '''PurpleStarChart for row i, same as initialize_chart + add_stars'''
+        from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+
+        bazi = self.bazi.chart(i)
+        chart = PurpleStarChart._from_parts(bazi.solar_date, bazi.lunar_date, bazi, _genders[self.gender[i]])
+        chart._apply_placements(*self.placements.row(i))
+        return chart
+
+    def to_dict(self, i):
+        '''same dict as PurpleStarChart.to_dict for row i, built straight from
+        the arrays'''
+        bazi = self.bazi
+        placed = self.placements
+        life = int(placed.life[i])
+        palace_start = ((int(bazi.year_stem[i]) % 5) * 2 + 2) % 10
+        by_branch = [[] for _ in range(12)]
+        for name, br_loc in zip(_star_slots, placed.positions[i].tolist()):
+            by_branch[br_loc].append(name)
+        palaces = {}
+        for distance, name in enumerate(_palace_names):
+            br_loc = (life + distance) % 12
+            palaces[name] = {
+                'stem': _stems[(palace_start + (br_loc - 2) % 12) % 10],
+                'branch': _branches[br_loc],
+                'stars': by_branch[br_loc]
+            }
+        pillars = {}
+        for ptype in ('year', 'month', 'day', 'hour'):
+            pillars[ptype] = {
+                'stem': _stems[getattr(bazi, ptype + '_stem')[i]],
+                'branch': _branches[getattr(bazi, ptype + '_branch')[i]]
+            }
+        return {
+            'solar_date': bazi.solar_date[i].item().isoformat(),
+            'gender': _genders[self.gender[i]],
+            'bazi': {
+                'solar_date': bazi.solar_date[i].item().isoformat(),
+                'lunar_date': {'year': int(bazi.lunar_year[i]), 'month': int(bazi.lunar_month[i]),
+                               'day': int(bazi.lunar_day[i]), 'leap': bool(bazi.lunar_leap[i])},
+                **pillars
+            },
+            'elemental_phase': _phase_names[placed.phase[i]],
+            'body_palace': _palace_names[(int(placed.body[i]) - life) % 12],
+            'life_master': _star_slots[placed.life_master[i]],
+            'body_master': _star_slots[placed.body_master[i]],
+            'palaces': palaces
+        }
+
+    def to_dicts(self):
+        for i in range(len(self)):
+            yield self.to_dict(i)
@@ -0,0 +1,115 @@
+'''Thread-safe LRU cache of finished charts.
+Lots of different birth datetimes collapse to the same ChartKey, and the
+key is all star placement depends on, so the cache stores the placements
+for each key (slot branches plus life/body master slots) rather than chart
+objects. Cached values are immutable bytes/ints; every chart() call builds
+a fresh PurpleStarChart from them, so callers can mutate what they get back
+(palace star lists and all) without touching the cache.'''
+
+import threading
+import time
+from collections import OrderedDict
+from attrs import define, field, evolve
+from src.purple_star_chart import instrumentation
+from src.purple_star_chart.BaZiChart import BaZiChart
+from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+from src.purple_star_chart.chart_key import ChartKey
+
+def reference_placements(key):
+    '''placements for a key from the reference add_stars'''
+    chart = PurpleStarChart.from_key(key)
+    chart.add_stars()
+    return (bytes(chart._slot_branches()), *chart._master_slots())
+
+def _live(entry, now):
+    '''whether a (value, expires) entry is still good at now'''
+    return entry is not None and (entry[1] is None or now < entry[1])
+
+@define
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+@define
+class ChartCache:
+    '''maxsize bounds the number of keys kept; ttl (seconds), if set, drops
+    entries that old on their next lookup. compute turns a ChartKey into
+    (slot branches, life master slot, body master slot) on a miss.'''
+    maxsize: int = 4096
+    ttl: float = None
+    compute: object = reference_placements
+    clock: object = time.monotonic
+    _entries: OrderedDict = field(init=False, factory=OrderedDict, repr=False)
+    _lock: object = field(init=False, factory=threading.Lock, repr=False)
+    _stats: CacheStats = field(init=False, factory=CacheStats)
+
+    def placements(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or self.clock() < expires:
+                    self._entries.move_to_end(key)
+                    self._stats.hits += 1
+                    if instrumentation.hooks:
+                        instrumentation.count('cache_hits')
+                    return value
+                del self._entries[key]
+                self._stats.expirations += 1
+            self._stats.misses += 1
+        if instrumentation.hooks:
+            instrumentation.count('cache_misses')
+
+        # computed outside the lock; two threads missing on the same key at
+        # once both compute it, which is harmless
+        value = self.compute(key)
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats.evictions += 1
+        return value
+
+    def chart(self, solar_dt, gender):
+        '''same result as initialize_chart + add_stars, with the stars from
+        the cache when the key has been seen before'''
+        bazi = BaZiChart.from_solar_date(solar_dt)
+        value = self.placements(ChartKey.from_bazi(bazi, gender))
+        chart = PurpleStarChart._from_parts(solar_dt, bazi.lunar_date, bazi, gender)
+        chart._apply_placements(*value)
+        return chart
+
+    @property
+    def stats(self):
+        '''snapshot of the hit/miss/eviction counters'''
+        with self._lock:
+            return evolve(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = CacheStats()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        '''number of entries that haven't expired'''
+        with self._lock:
+            if self.ttl is None:
+                return len(self._entries)
+            now = self.clock()
+            return sum(_live(entry, now) for entry in self._entries.values())
+
+    def __contains__(self, key):
+        with self._lock:
+            return _live(self._entries.get(key), self.clock())
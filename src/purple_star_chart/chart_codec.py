@@ -0,0 +1,302 @@
+'''Versioned fixed-width binary encoding of finished Purple Star charts.
+Every chart becomes one _RECORD sized record, so a run of them is just a
+contiguous buffer (or file) that can be sliced by offset. ChartView reads
+fields straight out of a memoryview over its record only when asked, and
+ChartArchive wraps a whole buffer or memory-mapped file of them without
+copying anything.
+
+Archive layout (little endian):
+    header      magic, version, slot count, record size, record count,
+                data offset, slot name length
+    slot names  newline separated _star_slots, checked on read
+    records     count fixed-width records
+
+Record layout:
+    solar date      int64 microseconds since 1900-01-01, binary.NO_DATE if none
+    lunar date      uint16 year, uint8 month, uint8 day, uint8 leap flag
+    pillars         stem and branch index of the year, month, day and hour
+                    pillars (8 bytes, _NONE where a chart has no pillar)
+    life branch     branch of the life palace; palace n sits at (life + n) % 12
+    body palace     index into _palace_names
+    phase           index into _phase_names
+    flags           bit 0 female, bit 1 palaces traversed backwards
+    slot branches   branch index of every star slot, in _star_slots order
+    magnitudes      0 for none, otherwise index into _magnitude_names + 1
+    life master     star slot of the life master
+    body master     star slot of the body master'''
+
+import mmap
+import struct
+from lunardate import LunarDate
+from src.purple_star_chart import _stem_lookup, _branch_lookup, _stems, _branches, _genders, _palace_names, _phase_names, _star_slots, _magnitude_names
+from src.purple_star_chart.binary import EPOCH, micros, from_micros, header_bytes, read_header
+from src.purple_star_chart.constructor_classes import Pillar
+
+_MAGIC = b'PSCB'
+_VERSION = 1
+_N = len(_star_slots)
+_RECORD = struct.Struct(f'<qHBBB8sBBBB{_N}s{_N}sBB')
+_NONE = 255
+_FEMALE = 1
+_BACK = 2
+_PILLARS = ('year', 'month', 'day', 'hour')
+
+# name -> (offset, Struct) for every record field, so a view can pull out one
+# field without unpacking the rest
+_FIELDS = {}
+_offset = 0
+for _name, _fmt in [('solar', 'q'), ('lunar_year', 'H'), ('lunar_month', 'B'), ('lunar_day', 'B'),
+                    ('lunar_leap', 'B'), ('pillars', '8s'), ('life', 'B'), ('body', 'B'), ('phase', 'B'),
+                    ('flags', 'B'), ('slots', f'{_N}s'), ('magnitudes', f'{_N}s'), ('life_master', 'B'),
+                    ('body_master', 'B')]:
+    _FIELDS[_name] = (_offset, struct.Struct('<' + _fmt))
+    _offset += _FIELDS[_name][1].size
+assert _offset == _RECORD.size
+
+def _pillar_codes(bazi):
+    out = bytearray()
+    for ptype in _PILLARS:
+        pillar = getattr(bazi, ptype)
+        stem = getattr(pillar, 'stem', None)
+        branch = getattr(pillar, 'branch', None)
+        out.append(_NONE if stem is None else _stems.index(stem.name))
+        out.append(_NONE if branch is None else _branches.index(branch.name))
+    return bytes(out)
+
+def encode_chart(chart):
+    '''one record for a chart that has had add_stars run'''
+    slot_branches = chart._slot_branches()
+    life_master, body_master = chart._master_slots()
+    ldate = chart.lunar_date
+    life = _branches.index(chart.palaces.life.pillar.branch.name)
+    flags = (_FEMALE if chart.gender == 'female' else 0) | (_BACK if chart._traverse_back else 0)
+    magnitudes = bytes(0 if star.magnitude is None else _magnitude_names.index(star.magnitude) + 1
+                       for star in chart._slot_stars())
+    return _RECORD.pack(
+        micros(chart.solar_date), ldate.year, ldate.month, ldate.day, bool(ldate.isLeapMonth),
+        _pillar_codes(chart.bazi), life, _palace_names.index(chart.palaces.body.name),
+        _phase_names.index(chart.elemental_phase), flags, bytes(slot_branches), magnitudes,
+        life_master, body_master
+    )
+
+def encode_charts(charts):
+    '''archive bytes (header plus records) for a sequence of charts'''
+    records = b''.join(encode_chart(chart) for chart in charts)
+    return header_bytes(_MAGIC, _VERSION, _RECORD.size, len(records) // _RECORD.size) + records
+
+_DTYPES = {'q': '<i8', 'H': '<u2', 'B': 'u1'}
+
+def _record_dtype():
+    '''numpy structured dtype matching _RECORD field for field'''
+    import numpy as np
+
+    fields = []
+    for name, (_, st) in _FIELDS.items():
+        code = st.format[1:]
+        fields.append((name, _DTYPES[code]) if code in _DTYPES else (name, 'u1', (st.size,)))
+    return np.dtype(fields)
+
+def encode_batch(batch):
+    '''archive bytes for every row of a ChartBatch, built with numpy in one
+    go rather than chart by chart.'''
+    import numpy as np
+
+    bazi = batch.bazi
+    placed = batch.placements
+    out = np.zeros(len(batch), dtype=_record_dtype())
+    out['solar'] = (bazi.solar_date.astype('datetime64[us]') - np.datetime64(EPOCH, 'us')).astype(np.int64)
+    out['lunar_year'] = bazi.lunar_year
+    out['lunar_month'] = bazi.lunar_month
+    out['lunar_day'] = bazi.lunar_day
+    out['lunar_leap'] = bazi.lunar_leap
+    out['pillars'] = bazi.pillar_codes()
+    out['life'] = placed.life
+    out['body'] = (placed.body.astype(np.int64) - placed.life) % 12
+    out['phase'] = placed.phase
+    out['flags'] = batch.gender.astype(np.uint8) * _FEMALE + placed.traverse_back.astype(np.uint8) * _BACK
+    out['slots'] = placed.positions
+    out['magnitudes'] = batch.magnitudes()
+    out['life_master'] = placed.life_master
+    out['body_master'] = placed.body_master
+    return header_bytes(_MAGIC, _VERSION, _RECORD.size, len(batch)) + out.tobytes()
+
+def write_charts(path, charts):
+    '''writes an archive of charts (a sequence of PurpleStarCharts, or a
+    ChartBatch) to path'''
+    data = encode_batch(charts) if hasattr(charts, 'placements') else encode_charts(charts)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+class ChartView:
+    '''lazy, read-only view of one encoded chart; fields are decoded from
+    the underlying buffer each time they're asked for'''
+    __slots__ = ('_buf',)
+
+    def __init__(self, buf):
+        buf = memoryview(buf)
+        if len(buf) != _RECORD.size:
+            raise ValueError(f'chart records are {_RECORD.size} bytes, got {len(buf)}')
+        self._buf = buf
+
+    def _get(self, name):
+        offset, st = _FIELDS[name]
+        return st.unpack_from(self._buf, offset)[0]
+
+    @property
+    def solar_date(self):
+        return from_micros(self._get('solar'))
+
+    @property
+    def lunar_date(self):
+        return LunarDate(self._get('lunar_year'), self._get('lunar_month'), self._get('lunar_day'),
+                         bool(self._get('lunar_leap')))
+
+    @property
+    def gender(self):
+        return _genders[self._get('flags') & _FEMALE]
+
+    @property
+    def traverse_back(self):
+        return bool(self._get('flags') & _BACK)
+
+    @property
+    def elemental_phase(self):
+        return _phase_names[self._get('phase')]
+
+    @property
+    def body_palace(self):
+        return _palace_names[self._get('body')]
+
+    @property
+    def life_master(self):
+        return _star_slots[self._get('life_master')]
+
+    @property
+    def body_master(self):
+        return _star_slots[self._get('body_master')]
+
+    @property
+    def slot_branches(self):
+        '''memoryview of the branch index of every star slot'''
+        offset = _FIELDS['slots'][0]
+        return self._buf[offset:offset + _N]
+
+    def pillar(self, ptype):
+        '''(stem, branch) names of a bazi pillar, None where missing'''
+        offset = _FIELDS['pillars'][0] + 2 * _PILLARS.index(ptype)
+        stem, branch = self._buf[offset], self._buf[offset + 1]
+        return (None if stem == _NONE else _stems[stem], None if branch == _NONE else _branches[branch])
+
+    def palace_branch(self, palace):
+        return (self._get('life') + _palace_names.index(palace)) % 12
+
+    def stars(self, palace):
+        '''names of the stars in a palace, in add_stars order'''
+        br_loc = self.palace_branch(palace)
+        return [name for name, b in zip(_star_slots, self.slot_branches) if b == br_loc]
+
+    def magnitude(self, slot):
+        code = self._buf[_FIELDS['magnitudes'][0] + slot]
+        return None if code == 0 else _magnitude_names[code - 1]
+
+    def bazi(self):
+        from src.purple_star_chart.BaZiChart import BaZiChart
+
+        pillars = []
+        for ptype in _PILLARS:
+            stem, branch = self.pillar(ptype)
+            if stem is None and branch is None:
+                pillars.append(None)
+            else:
+                pillars.append(Pillar(ptype, _stem_lookup.get(stem), _branch_lookup.get(branch)))
+        return BaZiChart(self.solar_date, self.lunar_date, *pillars)
+
+    def to_chart(self):
+        '''full PurpleStarChart, the same as the one that was encoded'''
+        from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+
+        bazi = self.bazi()
+        chart = PurpleStarChart._from_parts(bazi.solar_date, bazi.lunar_date, bazi, self.gender)
+        chart._apply_placements(self.slot_branches, self._get('life_master'), self._get('body_master'))
+        offset = _FIELDS['magnitudes'][0]
+        magnitudes = self._buf[offset:offset + _N]
+        if any(magnitudes):
+            for star, code in zip(chart._slot_stars(), magnitudes):
+                if code:
+                    star.magnitude = _magnitude_names[code - 1]
+        return chart
+
+    def tobytes(self):
+        return self._buf.tobytes()
+
+class ChartArchive:
+    '''zero-copy reader over an encoded archive: bytes, any buffer, or (via
+    open) a memory-mapped file'''
+
+    def __init__(self, buf):
+        self._mm = None
+        self._file = None
+        self._buf = memoryview(buf)
+        magic, version, rec_size, count, offset, names = read_header(self._buf)
+        if magic != _MAGIC:
+            raise ValueError('not a chart archive')
+        if version != _VERSION:
+            raise ValueError(f'chart archive version {version}, this code reads version {_VERSION}')
+        if names != _star_slots or rec_size != _RECORD.size:
+            raise ValueError('chart archive was written for a different star layout')
+        self._offset = offset
+        self._count = count
+
+    @classmethod
+    def open(cls, path):
+        f = open(path, 'rb')
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        archive = cls(mm)
+        archive._file, archive._mm = f, mm
+        return archive
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError('chart index out of range')
+        start = self._offset + i * _RECORD.size
+        return ChartView(self._buf[start:start + _RECORD.size])
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def records(self):
+        '''numpy structured array over every record, no copy'''
+        import numpy as np
+        return np.frombuffer(self._buf, dtype=_record_dtype(), count=self._count, offset=self._offset)
+
+    def charts(self):
+        for view in self:
+            yield view.to_chart()
+
+    def close(self):
+        '''views and records() arrays handed out before closing stay usable;
+        a mapped file is unmapped once the last of them goes away'''
+        self._buf = None
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                # still exported; the mmap closes itself when it's freed
+                pass
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
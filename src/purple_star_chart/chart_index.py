@@ -0,0 +1,266 @@
+'''Inverted index over the whole chart key space, and boolean queries on it.
+For every star name and branch there's a packed bitmap (one bit per
+ChartKey.index()) of the keys that put that star on that branch, built in
+a couple of seconds from the star engine. Which palace a branch is depends
+only on the life palace branch, so (star, palace) bitmaps are put together
+on demand from the (star, branch) ones and 12 life branch bitmaps.
+
+Queries are built from Star, Field, &, | and ~:
+
+    q = Star('hua_ji', palace='spouse') & Star('tai_yang', palace='spouse')
+    hits = index.query(q)          # KeySet, evaluated in milliseconds
+    hits.count()
+    for start, end, gender in index.datetimes(hits, date(1950, 1, 1), date(2030, 12, 31)):
+        ...
+
+datetimes() maps matching keys back to concrete Gregorian datetime ranges
+the same way BaZiChart.from_solar_date does (solar year for the year pillar,
+23:00 counting as zi hour of the same day).'''
+
+import os
+from datetime import date, datetime, timedelta
+import numpy as np
+from attrs import define, field
+from src.purple_star_chart import _branches, _genders, _palace_names, _star_slots
+from src.purple_star_chart.bazi_batch import lunar_arrays
+from src.purple_star_chart.chart_key import ChartKey, N_KEYS, _key_shape
+from src.purple_star_chart.lunar_index import first_date, last_date
+
+# every distinct star name, in the order add_stars first places it
+star_names = list(dict.fromkeys(_star_slots))
+_N_BYTES = -(-N_KEYS // 8)
+
+default_path = os.path.join(os.path.dirname(__file__), 'data', 'chart_index.npy')
+
+def _pack(mask):
+    return np.packbits(mask)
+
+def _key_fields():
+    '''year, month, day, hour, gender value of every key, in index order,
+    month and day 1-based'''
+    year, month, day, hour, gender = np.indices(_key_shape, dtype=np.int16).reshape(5, -1)
+    return {'year': year, 'month': month + 1, 'day': day + 1, 'hour': hour, 'gender': gender}
+
+def build_bitmaps():
+    '''(len(star_names), 12, N_KEYS / 8) uint8 array of (star, branch) bitmaps,
+    plus the (12, N_KEYS / 8) life branch bitmaps'''
+    from src.purple_star_chart.star_engine import key_space
+
+    placed = key_space()
+    slot_cols = {}
+    for slot, name in enumerate(_star_slots):
+        slot_cols.setdefault(name, []).append(slot)
+    bitmaps = np.zeros((len(star_names), 12, _N_BYTES), dtype=np.uint8)
+    for n, name in enumerate(star_names):
+        for slot in slot_cols[name]:
+            col = placed.positions[:, slot]
+            for br_loc in range(12):
+                bitmaps[n, br_loc] |= _pack(col == br_loc)
+    life = np.stack([_pack(placed.life == br_loc) for br_loc in range(12)])
+    return bitmaps, life
+
+@define
+class KeySet:
+    '''set of chart keys, as a packed bitmap over ChartKey.index()'''
+    bits: np.ndarray
+
+    def __and__(self, other):
+        return KeySet(self.bits & other.bits)
+
+    def __or__(self, other):
+        return KeySet(self.bits | other.bits)
+
+    def __invert__(self):
+        out = ~self.bits
+        # clear the padding bits past N_KEYS
+        out[-1] &= np.uint8((0xFF << (_N_BYTES * 8 - N_KEYS)) & 0xFF)
+        return KeySet(out)
+
+    def mask(self):
+        return np.unpackbits(self.bits, count=N_KEYS).astype(bool)
+
+    def count(self):
+        return int(np.unpackbits(self.bits).sum())
+
+    def indices(self):
+        return np.flatnonzero(self.mask())
+
+    def keys(self):
+        for index in self.indices():
+            yield ChartKey.from_index(int(index))
+
+    def __contains__(self, key):
+        index = key.index()
+        return bool(self.bits[index >> 3] & (0x80 >> (index & 7)))
+
+    def __len__(self):
+        return self.count()
+
+class Query:
+    '''base for query terms; combine with &, | and ~'''
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+@define(frozen=True)
+class Star(Query):
+    '''star in a palace (by name) or on a branch (by name); with neither,
+    matches every key, since every star is placed somewhere'''
+    name: str
+    palace: str = None
+    branch: str = None
+
+    def evaluate(self, index):
+        return index.star_bits(self.name, palace=self.palace, branch=self.branch)
+
+@define(frozen=True)
+class Field(Query):
+    '''key component equal to value: year (60 cycle position), month, day,
+    hour (branch index or name) or gender'''
+    name: str
+    value: object
+
+    def evaluate(self, index):
+        return index.field_bits(self.name, self.value)
+
+@define(frozen=True)
+class And(Query):
+    left: Query
+    right: Query
+
+    def evaluate(self, index):
+        return self.left.evaluate(index) & self.right.evaluate(index)
+
+@define(frozen=True)
+class Or(Query):
+    left: Query
+    right: Query
+
+    def evaluate(self, index):
+        return self.left.evaluate(index) | self.right.evaluate(index)
+
+@define(frozen=True)
+class Not(Query):
+    term: Query
+
+    def evaluate(self, index):
+        return ~self.term.evaluate(index)
+
+@define
+class ChartIndex:
+    '''bitmaps is (len(star_names), 12, N_KEYS / 8), life is (12, N_KEYS / 8);
+    use build() or load() rather than making one directly'''
+    bitmaps: np.ndarray
+    life: np.ndarray
+    _cache: dict = field(init=False, factory=dict, repr=False)
+    _fields: dict = field(init=False, default=None, repr=False)
+
+    @classmethod
+    def build(cls):
+        return cls(*build_bitmaps())
+
+    def save(self, path=default_path):
+        '''writes the bitmaps to one .npy file that load() memory-maps'''
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.save(path, np.concatenate([self.bitmaps.reshape(-1, _N_BYTES), self.life]))
+        return path
+
+    @classmethod
+    def load(cls, path=default_path):
+        data = np.load(path, mmap_mode='r')
+        if data.shape != ((len(star_names) + 1) * 12, _N_BYTES):
+            raise ValueError(f'{path} was built for a different star layout; rebuild it')
+        return cls(data[:-12].reshape(len(star_names), 12, _N_BYTES), data[-12:])
+
+    @classmethod
+    def load_or_build(cls, path=default_path):
+        if os.path.exists(path):
+            return cls.load(path)
+        index = cls.build()
+        index.save(path)
+        return index
+
+    def star_bits(self, name, palace=None, branch=None):
+        if name not in star_names:
+            raise ValueError(f'unknown star {name}')
+        n = star_names.index(name)
+        if branch is not None:
+            br_loc = _branches.index(branch) if isinstance(branch, str) else branch
+            return KeySet(np.asarray(self.bitmaps[n, br_loc]))
+        if palace is None:
+            return ~KeySet(np.zeros(_N_BYTES, dtype=np.uint8))
+        ckey = (name, palace)
+        bits = self._cache.get(ckey)
+        if bits is None:
+            distance = _palace_names.index(palace)
+            # star on branch b and in this palace means life sits at b - distance
+            bits = np.zeros(_N_BYTES, dtype=np.uint8)
+            for br_loc in range(12):
+                bits |= self.bitmaps[n, br_loc] & self.life[(br_loc - distance) % 12]
+            self._cache[ckey] = bits
+        return KeySet(bits)
+
+    def field_bits(self, name, value):
+        if self._fields is None:
+            self._fields = _key_fields()
+        if name not in self._fields:
+            raise ValueError(f'unknown key field {name}')
+        if name == 'gender' and isinstance(value, str):
+            value = _genders.index(value)
+        elif name == 'hour' and isinstance(value, str):
+            value = _branches.index(value)
+        return KeySet(_pack(self._fields[name] == value))
+
+    def query(self, q):
+        return q.evaluate(self)
+
+    def datetimes(self, keys, start=first_date, end=last_date):
+        '''yields (start datetime, end datetime, gender) for every stretch of
+        time between the start and end dates (inclusive) whose births land
+        on a key in keys. Ends are exclusive; back to back matching hours
+        come out as one stretch.'''
+        if isinstance(keys, Query):
+            keys = self.query(keys)
+        start = max(start, first_date)
+        end = min(end, last_date)
+        if end < start:
+            return
+        ordinals = np.arange(start.toordinal(), end.toordinal() + 1)
+        _, lmonth, lday, _ = lunar_arrays(ordinals)
+        ycycle = (_solar_years(ordinals) - 4) % 60
+        day_base = ((ycycle * 12 + lmonth.astype(np.int64) - 1) * 30 + lday.astype(np.int64) - 1) * 12
+
+        # each day is 13 stretches: 00-01 (zi), then 2 hours per branch from
+        # chou at 01:00 to hai at 21:00, then 23-24 (zi again, same day)
+        seg_hour = np.array(list(range(12)) + [0])
+        seg_start = np.array([0] + [2 * h - 1 for h in range(1, 12)] + [23])
+        mask = keys.mask()
+        for g, gender in enumerate(_genders):
+            hits = mask[((day_base[:, None] + seg_hour[None, :]) * 2 + g).ravel()]
+            if not hits.any():
+                continue
+            # run boundaries in the flattened day x stretch timeline
+            padded = np.concatenate([[False], hits, [False]])
+            edges = np.flatnonzero(padded[1:] != padded[:-1])
+            base = datetime.combine(start, datetime.min.time())
+            for run_start, run_end in zip(edges[::2], edges[1::2]):
+                yield (base + _seg_offset(run_start, seg_start), base + _seg_offset(run_end, seg_start), gender)
+
+def _solar_years(ordinals):
+    days = (ordinals - date(1970, 1, 1).toordinal()).astype('datetime64[D]')
+    return days.astype('datetime64[Y]').astype(np.int64) + 1970
+
+def _seg_offset(seg, seg_start):
+    '''time from the first day's midnight to the start of flattened stretch seg'''
+    day, n = divmod(int(seg), 13)
+    return timedelta(days=day, hours=int(seg_start[n]))
+
+if __name__ == '__main__':
+    import sys
+    print(ChartIndex.build().save(sys.argv[1] if len(sys.argv) > 1 else default_path))
@@ -0,0 +1,97 @@
+'''The discrete inputs that fully determine a Purple Star chart.
+Star placement only ever looks at the year pillar, lunar month, lunar day,
+hour branch and gender, so any two birth datetimes that agree on those get
+identical palaces and stars. ChartKey pins those down and numbers them so
+the whole chart space can be enumerated or used as an array offset.'''
+
+from functools import cache
+from attrs import define
+from src.purple_star_chart import _stems, _branches, _genders
+
+# sizes of each key component, in index order
+_key_shape = (60, 12, 30, 12, 2)
+N_KEYS = 60 * 12 * 30 * 12 * 2
+
+@define(frozen=True)
+class ChartKey:
+    year: int    # position in the 60 year cycle, jia zi = 0
+    month: int   # lunar month, 1-12 (leap months share their month's number)
+    day: int     # lunar day, 1-30
+    hour: int    # hour branch index, zi = 0
+    gender: str
+
+    @classmethod
+    def from_bazi(cls, bazi, gender):
+        '''pull the key out of a BaZiChart plus gender'''
+        ys = _stems.index(bazi.year.stem.name)
+        yb = _branches.index(bazi.year.branch.name)
+        hb = _branches.index(bazi.hour.branch.name)
+        return cls(cycle_from_pillar(ys, yb), bazi.lunar_date.month, bazi.lunar_date.day, hb, gender)
+
+    @classmethod
+    def from_solar_date(cls, solar_dt, gender):
+        from src.purple_star_chart.BaZiChart import BaZiChart
+        return cls.from_bazi(BaZiChart.from_solar_date(solar_dt), gender)
+
+    @classmethod
+    def from_index(cls, index):
+        if not 0 <= index < N_KEYS:
+            raise ValueError(f'chart key index {index} out of range')
+        index, g = divmod(index, 2)
+        index, h = divmod(index, 12)
+        index, d = divmod(index, 30)
+        y, m = divmod(index, 12)
+        return cls(y, m + 1, d + 1, h, _genders[g])
+
+    def index(self):
+        '''position of this key in the flattened key space'''
+        g = _genders.index(self.gender)
+        return (((self.year * 12 + self.month - 1) * 30 + self.day - 1) * 12 + self.hour) * 2 + g
+
+    def lunar_date(self):
+        '''a lunar date that charts to this key: day and (non leap) month
+        of the first lunar year from 1924 on with the key's year pillar
+        whose month is long enough. Some month / year pillar pairs are only
+        ever 29 days long between 1900 and 2100, so day 30 of those
+        gets a KeyDate instead.'''
+        from lunardate import LunarDate
+        first, first_long = _cycle_years(self.year, self.month)
+        year = first_long if self.day == 30 else first
+        if year is None:
+            return KeyDate(1924 + self.year, self.month, self.day)
+        return LunarDate(year, self.month, self.day)
+
+    @property
+    def year_stem(self):
+        return self.year % 10
+
+    @property
+    def year_branch(self):
+        return self.year % 12
+
+def cycle_from_pillar(stem_loc, branch_loc):
+    '''60 year cycle position for a stem/branch index pair'''
+    return (6 * stem_loc - 5 * branch_loc) % 60
+
+@define(frozen=True)
+class KeyDate:
+    '''stands in for a LunarDate when a key's lunar day doesn't exist in
+    any year with its year pillar; has the same fields star placement and
+    to_dict read, but no conversion to a solar date'''
+    year: int
+    month: int
+    day: int
+    isLeapMonth: bool = False
+
+@cache
+def _cycle_years(cycle, month):
+    '''(first year, first year with a 30 day month) among the lunar years
+    at this year cycle position, 1924 on first and then the earlier ones,
+    looking at the non leap month; the second is None if there isn't one'''
+    from src.purple_star_chart.lunar_index import _month_starts, _month_years, _month_numbers, _month_leaps
+    lengths = {}
+    for loc, year in enumerate(_month_years):
+        if (year - 4) % 60 == cycle and _month_numbers[loc] == month and not _month_leaps[loc]:
+            lengths[year] = _month_starts[loc + 1] - _month_starts[loc]
+    years = sorted(lengths, key=lambda year: (year < 1924, year))
+    return years[0], next((year for year in years if lengths[year] == 30), None)
@@ -0,0 +1,159 @@
+'''Precomputed table of every possible Purple Star chart.
+A finished chart only depends on its ChartKey, and there are only N_KEYS of
+those, so build_table() runs the reference add_stars once per key and writes
+the results to a flat binary file. ChartTable memory-maps that file and
+answers chart requests with a single offset calculation.
+
+File layout (little endian):
+    header      magic, version, slot count, record size, key count,
+                data offset, slot name length
+    slot names  newline separated _star_slots, checked on load
+    records     one fixed-width record per key, in ChartKey.index() order
+
+Record layout, one byte per field:
+    slot branches   branch index of every star slot
+    palace stems    stem index of each palace, in _palace_names order
+    life branch     branch index of the life palace
+    body palace     index into _palace_names
+    phase           index into _phase_names
+    life master     star slot of the life master
+    body master     star slot of the body master
+
+Build it with `python -m src.purple_star_chart.chart_table [path]`.'''
+
+import mmap
+import os
+import struct
+from multiprocessing import Pool
+from attrs import define, field
+from src.purple_star_chart import _stems, _branches, _palace_names, _phase_names, _star_slots
+from src.purple_star_chart.BaZiChart import BaZiChart
+from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+from src.purple_star_chart.binary import header_bytes, read_header
+from src.purple_star_chart.chart_key import ChartKey, N_KEYS
+
+_MAGIC = b'PSCT'
+_VERSION = 1
+_RECORD = struct.Struct(f'<{len(_star_slots)}s12sBBBBB')
+_CHUNK = 720
+
+default_path = os.path.join(os.path.dirname(__file__), 'data', 'chart_table.bin')
+
+@define(frozen=True)
+class ChartRecord:
+    '''decoded table entry for one chart key'''
+    slot_branches: bytes
+    palace_stems: bytes
+    life_branch: int
+    body_palace: int
+    phase: int
+    life_master: int
+    body_master: int
+
+    @property
+    def elemental_phase(self):
+        return _phase_names[self.phase]
+
+    def palace_branch(self, palace):
+        '''branch index of a palace, by name or index'''
+        distance = _palace_names.index(palace) if isinstance(palace, str) else palace
+        return (self.life_branch + distance) % 12
+
+def encode_chart(chart):
+    '''packs a chart that has had add_stars run into a table record'''
+    life_master, body_master = chart._master_slots()
+    palace_stems = bytes(_stems.index(getattr(chart.palaces, p).pillar.stem.name) for p in _palace_names)
+    return _RECORD.pack(
+        bytes(chart._slot_branches()),
+        palace_stems,
+        _branches.index(chart.palaces.life.pillar.branch.name),
+        _palace_names.index(chart.palaces.body.name),
+        _phase_names.index(chart.elemental_phase),
+        life_master,
+        body_master
+    )
+
+def _encode_range(start):
+    out = bytearray()
+    for index in range(start, min(start + _CHUNK, N_KEYS)):
+        chart = PurpleStarChart.from_key(ChartKey.from_index(index))
+        chart.add_stars()
+        out += encode_chart(chart)
+    return bytes(out)
+
+def build_table(path=default_path, processes=None, progress=None):
+    '''enumerates the whole key space with the reference implementation and
+    writes the table to path. progress, if given, is called with the number
+    of keys done so far.'''
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f, Pool(processes) as pool:
+        f.write(header_bytes(_MAGIC, _VERSION, _RECORD.size, N_KEYS))
+        done = 0
+        for chunk in pool.imap(_encode_range, range(0, N_KEYS, _CHUNK)):
+            f.write(chunk)
+            done += len(chunk) // _RECORD.size
+            if progress is not None:
+                progress(done)
+    os.replace(tmp_path, path)
+    return path
+
+@define
+class ChartTable:
+    '''read-only, memory-mapped view of a table written by build_table'''
+    path: str = default_path
+    _file: object = field(init=False, default=None, repr=False)
+    _mm: mmap.mmap = field(init=False, default=None, repr=False)
+    _offset: int = field(init=False, default=0, repr=False)
+
+    def __attrs_post_init__(self):
+        self._file = open(self.path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, rec_size, n_keys, offset, names = read_header(self._mm)
+        if magic != _MAGIC or version != _VERSION:
+            self.close()
+            raise ValueError(f'{self.path} is not a version {_VERSION} chart table')
+        if names != _star_slots or rec_size != _RECORD.size or n_keys != N_KEYS:
+            self.close()
+            raise ValueError(f'{self.path} was built for a different star layout; rebuild it')
+        self._offset = offset
+
+    def record_at(self, index):
+        '''raw record bytes for a flattened key index'''
+        start = self._offset + index * _RECORD.size
+        return self._mm[start:start + _RECORD.size]
+
+    def lookup(self, key):
+        return ChartRecord(*_RECORD.unpack(self.record_at(key.index())))
+
+    def chart(self, solar_dt, gender):
+        '''same result as initialize_chart + add_stars, but the stars come
+        from the table instead of the _plot_* passes'''
+        bazi = BaZiChart.from_solar_date(solar_dt)
+        rec = self.lookup(ChartKey.from_bazi(bazi, gender))
+        chart = PurpleStarChart._from_parts(solar_dt, bazi.lunar_date, bazi, gender)
+        chart._apply_placements(rec.slot_branches, rec.life_master, rec.body_master)
+        return chart
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+if __name__ == '__main__':
+    import sys
+
+    out_path = sys.argv[1] if len(sys.argv) > 1 else default_path
+    def report(done):
+        if done % (_CHUNK * 60) == 0 or done == N_KEYS:
+            print(f'{done}/{N_KEYS} charts', file=sys.stderr)
+    print(build_table(out_path, progress=report))
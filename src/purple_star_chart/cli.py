@@ -0,0 +1,276 @@
+'''`purple-star-chart` command line interface.
+
+    purple-star-chart chart 1990-05-17T08:30 --gender female
+    purple-star-chart bazi 1990-05-17T08:30 --format text
+    purple-star-chart chart --input births.csv --format jsonl --workers 4 > charts.jsonl
+    cat births.jsonl | purple-star-chart bazi --format text
+    purple-star-chart render 1990-05-17T08:30 --gender female --format svg -o chart.svg
+    purple-star-chart render --input births.csv --output charts.zip --workers 4
+    purple-star-chart verify keys star_engine lazy --workers 8
+
+With a datetime argument one record is charted; otherwise records (a
+datetime and, for chart, a gender per row) are streamed from --input or
+stdin, as csv with a header row or jsonl, and written out in input order as
+they're done. Everything past click is imported inside the commands, and
+numpy and the process pool only come in for streams, so single charts in a
+shell loop start fast.'''
+
+import sys
+from functools import partial
+import click
+
+_FORMATS = ['json', 'jsonl', 'text']
+
+def chart_line(chart):
+    '''one line text version of a PurpleStarChart.to_dict'''
+    palaces = ' | '.join(f'{name} {p["stem"]}-{p["branch"]}: {" ".join(p["stars"]) or "-"}'
+                         for name, p in chart['palaces'].items())
+    return (f'{chart["solar_date"]} {chart["gender"]} {chart["elemental_phase"]} '
+            f'body={chart["body_palace"]} life_master={chart["life_master"]} '
+            f'body_master={chart["body_master"]} | {palaces}')
+
+def render_chunk(chunk, kind, fmt, dt_field, gender_field, solar_terms=False):
+    '''((record number, rendered record) pairs, error dicts) for a chunk of
+    (record number, record) pairs; runs in the worker processes'''
+    import json
+    from src.purple_star_chart.bazi_batch import BaZiBatch
+    from src.purple_star_chart.records import parse_record
+    from src.purple_star_chart.pipeline import _batch_rows, _error
+
+    nums, dts, genders, errors = [], [], [], []
+    for num, record in chunk:
+        try:
+            if kind == 'bazi':
+                record = {gender_field: 'male', **record}
+            solar_dt, gender = parse_record(record, dt_field, gender_field)
+        except (ValueError, TypeError, AttributeError) as err:
+            errors.append(_error(num, err))
+            continue
+        nums.append(num)
+        dts.append(solar_dt)
+        genders.append(gender)
+
+    if kind == 'bazi':
+        build = lambda dts, genders: BaZiBatch.from_solar_dates(dts, solar_terms)
+        batches, batch_errors = _batch_rows(nums, dts, genders, build) if nums else ([], [])
+    else:
+        batches, batch_errors = _batch_rows(nums, dts, genders) if nums else ([], [])
+    errors += batch_errors
+    out = []
+    for batch_nums, batch in batches:
+        for i, num in enumerate(batch_nums):
+            if kind == 'bazi':
+                bazi = batch.chart(i)
+                if fmt == 'text':
+                    out.append((num, bazi.pformat(compact=True)))
+                else:
+                    out.append((num, json.dumps({'record': num, **bazi.to_dict()})))
+            elif fmt == 'text':
+                out.append((num, chart_line(batch.to_dict(i))))
+            else:
+                out.append((num, json.dumps({'record': num, **batch.to_dict(i)})))
+    out.sort()
+    return out, errors
+
+def _single(kind, when, gender, fmt, solar_terms=False):
+    import json
+    from src.purple_star_chart.records import parse_record
+
+    try:
+        solar_dt, gender = parse_record({'datetime': when, 'gender': gender or ('male' if kind == 'bazi' else '')})
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+    if kind == 'bazi':
+        from src.purple_star_chart.BaZiChart import BaZiChart
+        bazi = BaZiChart.from_solar_date(solar_dt, solar_terms)
+        if fmt == 'text':
+            return bazi.pformat()
+        return json.dumps(bazi.to_dict(), indent=None if fmt == 'jsonl' else 2) + '\n'
+
+    from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+    chart = PurpleStarChart.initialize_chart(solar_dt, gender)
+    chart.add_stars()
+    if fmt == 'text':
+        return chart_line(chart.to_dict()) + '\n'
+    return json.dumps(chart.to_dict(), indent=None if fmt == 'jsonl' else 2) + '\n'
+
+def _stream(kind, source, in_fmt, out, fmt, workers, chunk_size, dt_field, gender_field, solar_terms=False):
+    '''writes every record as it comes back; returns the error count'''
+    import json
+    from src.purple_star_chart.pipeline import map_chunks
+
+    fn = partial(render_chunk, kind=kind, fmt=fmt, dt_field=dt_field, gender_field=gender_field,
+                 solar_terms=solar_terms)
+    n_errors = 0
+    first = True
+    if fmt == 'json':
+        out.write('[')
+    for (rendered, errors), _ in map_chunks(fn, source, in_fmt, workers, chunk_size):
+        n_errors += len(errors)
+        if fmt == 'jsonl':
+            # errors go in the stream, same as run_pipeline
+            rendered = sorted(rendered + [(e['record'], json.dumps(e)) for e in errors])
+        else:
+            for err in errors:
+                click.echo(f'record {err["record"]}: {err["error"]}', err=True)
+        for _, line in rendered:
+            if fmt == 'json':
+                out.write(('\n' if first else ',\n') + line)
+                first = False
+            else:
+                out.write(line + '\n')
+        out.flush()
+    if fmt == 'json':
+        out.write('\n]\n')
+    return n_errors
+
+def _run(kind, when, gender, source, in_fmt, out, fmt, workers, chunk_size, dt_field, gender_field,
+         solar_terms=False):
+    if when is not None:
+        out.write(_single(kind, when, gender, fmt or 'json', solar_terms))
+        return
+    source = sys.stdin if source in (None, '-') else source
+    if in_fmt is None and source is sys.stdin:
+        in_fmt = 'jsonl'
+    n_errors = _stream(kind, source, in_fmt, out, fmt or 'jsonl', workers, chunk_size, dt_field, gender_field,
+                       solar_terms)
+    if n_errors:
+        click.echo(f'{n_errors} record(s) could not be charted', err=True)
+        sys.exit(1)
+
+def _common(fn):
+    '''options shared by chart and bazi'''
+    options = [
+        click.argument('when', required=False, metavar='[DATETIME]'),
+        click.option('--input', '-i', 'source', help='csv or jsonl file of records, - for stdin (the default)'),
+        click.option('--in-format', 'in_fmt', type=click.Choice(['csv', 'jsonl']),
+                     help='input format (default: from the file extension, jsonl for stdin)'),
+        click.option('--output', '-o', type=click.File('w'), default='-', help='where to write (default stdout)'),
+        click.option('--format', '-f', 'fmt', type=click.Choice(_FORMATS),
+                     help='output format (default json for one record, jsonl for streams)'),
+        click.option('--workers', '-w', type=click.IntRange(0), default=None,
+                     help='worker processes for streams, 0 to stay in this process (default all cores)'),
+        click.option('--chunk-size', type=click.IntRange(1), default=10000, show_default=True,
+                     help='records per work chunk'),
+        click.option('--datetime-field', 'dt_field', default='datetime', show_default=True),
+        click.option('--gender-field', default='gender', show_default=True),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+@click.group()
+def main():
+    '''Purple Star and BaZi charts from the command line.'''
+
+@main.command()
+@_common
+@click.option('--gender', '-g', type=click.Choice(['male', 'female']), help='gender for a single DATETIME')
+def chart(when, source, in_fmt, output, fmt, workers, chunk_size, dt_field, gender_field, gender):
+    '''Purple Star chart for DATETIME, or for every record in a stream.'''
+    if when is not None and gender is None:
+        raise click.UsageError('--gender is needed with a DATETIME')
+    _run('chart', when, gender, source, in_fmt, output, fmt, workers, chunk_size, dt_field, gender_field)
+
+@main.command()
+@_common
+@click.option('--solar-terms', is_flag=True, help='switch year and month pillars at solar terms (li chun, jie)')
+def bazi(when, source, in_fmt, output, fmt, workers, chunk_size, dt_field, gender_field, solar_terms):
+    '''BaZi pillars for DATETIME, or for every record in a stream.'''
+    _run('bazi', when, None, source, in_fmt, output, fmt, workers, chunk_size, dt_field, gender_field, solar_terms)
+
+@main.command()
+@click.argument('when', required=False, metavar='[DATETIME]')
+@click.option('--gender', '-g', type=click.Choice(['male', 'female']), help='gender for a single DATETIME')
+@click.option('--input', '-i', 'source', help='csv or jsonl file of records, - for stdin (the default)')
+@click.option('--in-format', 'in_fmt', type=click.Choice(['csv', 'jsonl']),
+              help='input format (default: from the file extension, jsonl for stdin)')
+@click.option('--output', '-o', default='-',
+              help='file for one chart (default stdout); for streams a directory, .zip, .tar or .tar.gz')
+@click.option('--format', '-f', 'fmt', type=click.Choice(['svg', 'html', 'text']),
+              help='default text for one chart, svg for streams')
+@click.option('--workers', '-w', type=click.IntRange(0), default=None,
+              help='worker processes for streams, 0 to stay in this process (default all cores)')
+@click.option('--chunk-size', type=click.IntRange(1), default=1000, show_default=True, help='records per work chunk')
+@click.option('--datetime-field', 'dt_field', default='datetime', show_default=True)
+@click.option('--gender-field', default='gender', show_default=True)
+def render(when, gender, source, in_fmt, output, fmt, workers, chunk_size, dt_field, gender_field):
+    '''Draw the twelve palace board for DATETIME, or one file per record of a
+    stream into a directory, zip or tar.'''
+    if when is not None:
+        from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+        from src.purple_star_chart.records import parse_record
+        from src.purple_star_chart.render import renderers
+
+        if gender is None:
+            raise click.UsageError('--gender is needed with a DATETIME')
+        try:
+            solar_dt, gender = parse_record({'datetime': when, 'gender': gender})
+        except ValueError as err:
+            raise click.BadParameter(str(err))
+        chart = PurpleStarChart.initialize_chart(solar_dt, gender)
+        chart.add_stars()
+        with click.open_file(output, 'w') as out:
+            out.write(renderers[fmt or 'text'](chart))
+        return
+
+    from src.purple_star_chart.render import export
+
+    if output == '-':
+        raise click.UsageError('streams need --output: a directory, .zip, .tar or .tar.gz')
+    source = sys.stdin if source in (None, '-') else source
+    if in_fmt is None and source is sys.stdin:
+        in_fmt = 'jsonl'
+    stats = export(source, output, fmt or 'svg', in_fmt, workers, chunk_size, dt_field, gender_field)
+    click.echo(f'{stats.charts} chart(s) written to {output}', err=True)
+    if stats.errors:
+        click.echo(f'{stats.errors} record(s) could not be charted, see errors.jsonl', err=True)
+        sys.exit(1)
+
+@main.command()
+@click.argument('space', type=click.Choice(['keys', 'calendar']))
+@click.argument('engines', nargs=-1)
+@click.option('--workers', '-w', type=click.IntRange(0), default=None,
+              help='worker processes, 0 to stay in this process (default all cores)')
+@click.option('--start', type=int, default=0, show_default=True, help='first key index (keys)')
+@click.option('--stop', type=int, default=None, help='key index to stop before (keys, default all of them)')
+@click.option('--no-leap', is_flag=True, help="don't also chart every key as a leap month (keys)")
+@click.option('--first', type=click.DateTime(['%Y-%m-%d']), help='first date (calendar, default first supported)')
+@click.option('--last', type=click.DateTime(['%Y-%m-%d']), help='last date (calendar, default last supported)')
+@click.option('--step', type=click.Choice(['hour', 'day']), default='hour', show_default=True,
+              help='time between moments (calendar)')
+@click.option('--solar-terms', is_flag=True, help='switch year and month pillars at solar terms (calendar)')
+@click.option('--json', 'json_out', type=click.File('w'), help='also write the full report here as json')
+@click.option('--quiet', '-q', is_flag=True, help='no progress on stderr')
+def verify(space, engines, workers, start, stop, no_leap, first, last, step, solar_terms, json_out, quiet):
+    '''Check ENGINES against the reference implementation over the whole
+    chart key space or every moment of the calendar, and report where they
+    disagree. Exits 1 if any engine disagreed anywhere.'''
+    import json
+    from datetime import timedelta
+    from src.purple_star_chart import differential
+
+    def progress(done, total):
+        click.echo(f'{done}/{total} inputs', err=True)
+    progress = None if quiet else progress
+    try:
+        if space == 'keys':
+            stop = differential.N_KEYS if stop is None else stop
+            report = differential.check_keys(engines or ('star_engine', 'lazy'), not no_leap, start, stop,
+                                             workers, progress=progress)
+        else:
+            first = first.date() if first else differential.first_date
+            last = last.date() if last else differential.last_date
+            report = differential.check_calendar(engines or ('bazi_batch', 'almanac'), first, last,
+                                                 timedelta(**{step + 's': 1}), solar_terms, workers,
+                                                 progress=progress)
+    except ValueError as err:
+        raise click.UsageError(str(err))
+    click.echo(report.format())
+    if json_out is not None:
+        json.dump(report.to_dict(), json_out, indent=1)
+    if not report.ok:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
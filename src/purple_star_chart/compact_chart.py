@@ -0,0 +1,163 @@
+'''Compact, integer-coded Purple Star charts for keeping lots of them in memory.
+A finished PurpleStarChart is a graph of ~90 Star objects, 12 palaces, their
+pillars and a couple of string-keyed dicts, which adds up to ~20KB per
+chart. CompactChart packs everything needed to rebuild one into a single
+bytes object (see _LAYOUT) and hands out shared, interned Stem/Branch/Pillar
+objects instead of per-chart copies when asked about palaces.
+
+Per-chart footprint on 64-bit CPython 3.11 (sys.getsizeof, gc header
+included):
+    CompactChart instance (one slot)    48 bytes
+    packed bytes                        33 + 109 = 142 bytes
+    total                               190 bytes
+against roughly 20KB for the PurpleStarChart it came from (run
+`python -m benchmarks.bench_memory` for current numbers). Star objects aren't
+interned, since each one carries its own life/body master flags; stars are
+identified by their slot in _star_slots instead.'''
+
+import struct
+from attrs import define
+from src.purple_star_chart import _stem_lookup, _branch_lookup, _stems, _branches, _genders, _palace_names, _phase_names, _star_slots
+from src.purple_star_chart.binary import micros, from_micros
+from src.purple_star_chart.chart_key import ChartKey, cycle_from_pillar
+from src.purple_star_chart.constructor_classes import Pillar
+from src.purple_star_chart.magnitudes import slot_names as _slot_magnitudes
+
+# solar date (see binary.micros, NO_DATE for charts built from a key), key index, slot branches, life branch, body branch, phase, flags,
+# life master slot, body master slot
+_LAYOUT = struct.Struct(f'<qI{len(_star_slots)}sBBBBBB')
+_FEMALE = 1
+_BACK = 2
+
+# one Pillar per (palace, stem, branch) for the whole process; shared by every
+# CompactChart, so treat them as read only
+_pillars = {}
+
+def palace_pillar(palace, stem_loc, branch_loc):
+    '''interned Pillar for a palace, built from the _stem_lookup/_branch_lookup
+    singletons'''
+    pkey = (palace, stem_loc, branch_loc)
+    pillar = _pillars.get(pkey)
+    if pillar is None:
+        pillar = _pillars[pkey] = Pillar(palace, _stem_lookup[_stems[stem_loc]], _branch_lookup[_branches[branch_loc]])
+    return pillar
+
+@define
+class CompactChart:
+    '''everything a finished PurpleStarChart holds, packed into one bytes
+    object; to_chart() gives the full object graph back'''
+    _data: bytes
+
+    @classmethod
+    def pack(cls, solar_dt, key_index, slot_branches, life, body, phase, back, life_master, body_master):
+        '''life and body are branch indexes, phase an index into _phase_names'''
+        flags = (key_index % 2) * _FEMALE | (_BACK if back else 0)
+        return cls(_LAYOUT.pack(micros(solar_dt), key_index, bytes(slot_branches), life, body, phase,
+                                flags, life_master, body_master))
+
+    @classmethod
+    def from_chart(cls, chart):
+        '''packs a PurpleStarChart that has had add_stars run (a lazy one gets
+        finished first)'''
+        chart._finish_lazy()
+        return cls.pack(
+            chart.solar_date,
+            chart.key.index(),
+            chart._slot_branches(),
+            _branches.index(chart.palaces.life.pillar.branch.name),
+            _branches.index(chart.palaces.body.pillar.branch.name),
+            _phase_names.index(chart.elemental_phase),
+            chart._traverse_back,
+            *chart._master_slots()
+        )
+
+    @classmethod
+    def from_batch(cls, batch, i):
+        '''packs row i of a ChartBatch without building the chart object'''
+        bazi = batch.bazi
+        placed = batch.placements
+        ys, yb = int(bazi.year_stem[i]), int(bazi.year_branch[i])
+        key = ChartKey(cycle_from_pillar(ys, yb), int(bazi.lunar_month[i]), int(bazi.lunar_day[i]),
+                       int(bazi.hour_branch[i]), _genders[batch.gender[i]])
+        return cls.pack(bazi.solar_date[i].item(), key.index(), placed.positions[i].tobytes(),
+                        int(placed.life[i]), int(placed.body[i]), int(placed.phase[i]),
+                        bool(placed.traverse_back[i]), int(placed.life_master[i]), int(placed.body_master[i]))
+
+    def to_chart(self):
+        '''full PurpleStarChart, equal to initialize_chart + add_stars (or
+        from_key + add_stars for a chart that had no solar date)'''
+        from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+
+        solar_dt = self.solar_date
+        if solar_dt is None:
+            chart = PurpleStarChart.from_key(self.key)
+        else:
+            chart = PurpleStarChart.initialize_chart(solar_dt, self.gender)
+        _, _, slot_branches, _, _, _, _, life_master, body_master = _LAYOUT.unpack(self._data)
+        chart._apply_placements(slot_branches, life_master, body_master)
+        return chart
+
+    def _field(self, n):
+        return _LAYOUT.unpack(self._data)[n]
+
+    @property
+    def solar_date(self):
+        return from_micros(self._field(0))
+
+    @property
+    def key(self):
+        return ChartKey.from_index(self._field(1))
+
+    @property
+    def gender(self):
+        return _genders[self._field(6) & _FEMALE]
+
+    @property
+    def traverse_back(self):
+        return bool(self._field(6) & _BACK)
+
+    @property
+    def slot_branches(self):
+        '''branch index of every star slot, in _star_slots order'''
+        return self._field(2)
+
+    @property
+    def elemental_phase(self):
+        return _phase_names[self._field(5)]
+
+    @property
+    def life_master(self):
+        return _star_slots[self._field(7)]
+
+    @property
+    def body_master(self):
+        return _star_slots[self._field(8)]
+
+    @property
+    def body_palace(self):
+        return _palace_names[(self._field(4) - self._field(3)) % 12]
+
+    def palace_branch(self, palace):
+        '''branch index of a palace, by name'''
+        return (self._field(3) + _palace_names.index(palace)) % 12
+
+    def pillar(self, palace):
+        '''the (interned) pillar of a palace'''
+        br_loc = self.palace_branch(palace)
+        start = ((self.key.year_stem % 5) * 2 + 2) % 10
+        return palace_pillar(palace, (start + (br_loc - 2) % 12) % 10, br_loc)
+
+    def stars(self, palace):
+        '''names of the stars in a palace, in the order add_stars puts them'''
+        br_loc = self.palace_branch(palace)
+        return [name for name, b in zip(_star_slots, self.slot_branches) if b == br_loc]
+
+    def locate(self, star_name):
+        '''palace name a star ends up in; names placed twice give the later
+        placement, same as PurpleStarChart.locate'''
+        slot = len(_star_slots) - 1 - _star_slots[::-1].index(star_name)
+        return _palace_names[(self.slot_branches[slot] - self._field(3)) % 12]
+
+    def magnitude(self, slot):
+        '''brightness of the star in a slot, None if it has none'''
+        return _slot_magnitudes[slot][self.slot_branches[slot]]
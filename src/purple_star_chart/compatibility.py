@@ -0,0 +1,296 @@
+'''Pairwise chart compatibility over integer-coded chart features.
+Features (year pillar, life/spouse palace branches and their major stars,
+transformation branches) are pulled out of a ChartBatch, or anything with
+ChartKeys, into a handful of small arrays. Rules score a whole block of
+pairs at once from those arrays, and top_k tiles the N x M score matrix
+into blocks so memory stays at block_size x block_size however many charts
+there are.
+
+Every rule also has a scalar reference() that reads two PurpleStarCharts
+directly, and verify() checks the vectorized scores against it.
+
+Write your own rules by subclassing Rule (or PairTable, for anything that's
+a lookup on one feature of each chart) and pass them to Scorer.'''
+
+import numpy as np
+from attrs import define, field, fields
+from src.purple_star_chart import _stem_lookup, _branches, _star_slots, _stage_slots
+from src.purple_star_chart.chart_key import cycle_from_pillar
+
+_majors = _stage_slots['_plot_ziwei'] + _stage_slots['_plot_major_stars']
+_transform_slots = [_star_slots.index(name) for name in ('hua_lu', 'hua_quan', 'hua_ke', 'hua_ji')]
+_elements = ['wood', 'fire', 'earth', 'metal', 'water']
+
+def _major_masks():
+    '''(12, 12) bitmask of the majors (bit i for _majors[i]) on each branch,
+    by ziwei branch; the majors only ever depend on where ziwei is'''
+    from src.purple_star_chart.star_engine import _RULES, _term_value
+    masks = np.zeros((12, 12), dtype=np.int64)
+    for i, (_, base, step, const, direction) in enumerate(_RULES[:len(_majors)]):
+        for ziwei in range(12):
+            env = {'ziwei': ziwei}
+            masks[ziwei, (_term_value(base, env) + direction * (_term_value(step, env) + const)) % 12] |= 1 << i
+    return masks
+
+_major_mask = _major_masks()
+
+@define
+class Features:
+    '''compatibility features for n charts, one array entry per chart. The
+    last two are compound codes so rules can be small lookup tables.'''
+    year: np.ndarray          # year pillar as 60 cycle position
+    life: np.ndarray          # life palace branch
+    ziwei: np.ndarray         # ziwei branch, which fixes every major star
+    transforms: np.ndarray    # (n, 4) branch of hua_lu, hua_quan, hua_ke, hua_ji
+    palace_stars: np.ndarray  # ziwei * 12 + life
+    lu_ji: np.ndarray         # hua_lu branch * 12 + hua_ji branch
+
+    @classmethod
+    def from_placements(cls, placements, year):
+        positions = placements.positions
+        life = placements.life.astype(np.intp)
+        ziwei = positions[:, _star_slots.index('zi_wei')].astype(np.intp)
+        transforms = positions[:, _transform_slots].astype(np.intp)
+        return cls(np.asarray(year, dtype=np.intp), life, ziwei, transforms, ziwei * 12 + life,
+                   transforms[:, 0] * 12 + transforms[:, 3])
+
+    @classmethod
+    def from_batch(cls, batch):
+        year = cycle_from_pillar(batch.bazi.year_stem.astype(np.int64), batch.bazi.year_branch.astype(np.int64))
+        return cls.from_placements(batch.placements, year)
+
+    @classmethod
+    def from_keys(cls, keys):
+        '''from ChartKeys, e.g. [chart.key for chart in charts]'''
+        from src.purple_star_chart.star_engine import place_keys
+        keys = list(keys)
+        return cls.from_placements(place_keys(keys), [k.year for k in keys])
+
+    def __len__(self):
+        return len(self.year)
+
+    def __getitem__(self, rows):
+        return Features(*(getattr(self, f.name)[rows] for f in fields(Features)))
+
+class Rule:
+    '''one scoring rule. block() scores every pair of a and b (Features)
+    as a (len(a), len(b)) array; reference() scores one pair of finished
+    PurpleStarCharts the slow, obvious way. The two must agree. Rules that
+    can be written as a PairTable should return one from as_table(), so
+    Scorer can fold them together.'''
+    weight = 1.0
+
+    def block(self, a, b):
+        return self.as_table().block(a, b)
+
+    def reference(self, chart_a, chart_b):
+        raise NotImplementedError
+
+@define
+class PairTable(Rule):
+    '''score table[feature_a of a, feature_b of b], plus the same the other
+    way round when both_ways is set'''
+    feature_a: str
+    feature_b: str
+    table: np.ndarray
+    weight: float = 1.0
+    both_ways: bool = False
+
+    def as_table(self):
+        return self
+
+    def block(self, a, b):
+        # a row gather then a column gather is much faster than indexing
+        # with two broadcast arrays
+        table = self.table if self.weight == 1 else self.table * np.float32(self.weight)
+        out = table[getattr(a, self.feature_a)][:, getattr(b, self.feature_b)]
+        if self.both_ways:
+            flipped = np.ascontiguousarray(table.T)
+            out += flipped[getattr(a, self.feature_b)][:, getattr(b, self.feature_a)]
+        return out
+
+# six harmonies, harms; clashes are 6 apart and three harmonies share b % 4
+_HARMONY = [('zi', 'chou'), ('yin', 'hai'), ('mao', 'xu'), ('chen', 'you'), ('si', 'shen'), ('wu', 'wei')]
+_HARM = [('zi', 'wei'), ('chou', 'wu'), ('yin', 'si'), ('mao', 'chen'), ('shen', 'hai'), ('you', 'xu')]
+
+def _animal_score(branch_a, branch_b):
+    pair = {branch_a, branch_b}
+    loc_a, loc_b = _branches.index(branch_a), _branches.index(branch_b)
+    if any(pair == set(p) for p in _HARMONY):
+        return 2.0
+    if loc_a != loc_b and loc_a % 4 == loc_b % 4:
+        return 2.0
+    if (loc_a - loc_b) % 12 == 6:
+        return -2.0
+    if any(pair == set(p) for p in _HARM):
+        return -1.0
+    return 0.0
+
+def _element_score(element_a, element_b):
+    '''generating cycle either way +1, same element +0.5, controlling -1'''
+    loc_a, loc_b = _elements.index(element_a), _elements.index(element_b)
+    if loc_a == loc_b:
+        return 0.5
+    if (loc_a - loc_b) % 5 in (1, 4):
+        return 1.0
+    return -1.0
+
+@define
+class YearAnimalRule(Rule):
+    '''six and three harmonies of the year branches, against clashes and harms'''
+    weight: float = 1.0
+
+    def as_table(self):
+        table = [[_animal_score(_branches[a % 12], _branches[b % 12]) for b in range(60)] for a in range(60)]
+        return PairTable('year', 'year', np.array(table, dtype=np.float32), self.weight)
+
+    def reference(self, chart_a, chart_b):
+        return _animal_score(chart_a.bazi.year.branch.name, chart_b.bazi.year.branch.name) * self.weight
+
+@define
+class YearElementRule(Rule):
+    '''five element relation of the year stems'''
+    weight: float = 1.0
+
+    def as_table(self):
+        elements = [stem.element for stem in _stem_lookup.values()]
+        table = [[_element_score(elements[a % 10], elements[b % 10]) for b in range(60)] for a in range(60)]
+        return PairTable('year', 'year', np.array(table, dtype=np.float32), self.weight)
+
+    def reference(self, chart_a, chart_b):
+        return _element_score(chart_a.bazi.year.stem.element, chart_b.bazi.year.stem.element) * self.weight
+
+@define
+class SpouseStarsRule(Rule):
+    '''major stars in one chart's spouse palace that are also in the other's
+    life palace, counted both ways'''
+    weight: float = 1.0
+
+    def as_table(self):
+        code = np.arange(144)
+        life = _major_mask[code // 12, code % 12]
+        spouse = _major_mask[code // 12, (code % 12 + 2) % 12]
+        popcount = np.vectorize(lambda n: bin(n).count('1'))
+        table = popcount(spouse[:, None] & life[None, :]) + popcount(life[:, None] & spouse[None, :])
+        return PairTable('palace_stars', 'palace_stars', table.astype(np.float32), self.weight)
+
+    def reference(self, chart_a, chart_b):
+        majors_a, majors_b = chart_a.major_stars(), chart_b.major_stars()
+        shared = (len(set(majors_a['spouse']) & set(majors_b['life']))
+                  + len(set(majors_a['life']) & set(majors_b['spouse'])))
+        return shared * self.weight
+
+@define
+class TransformRule(Rule):
+    '''hua_lu landing on the branch of the other chart's life palace is
+    good, hua_ji there is bad; counted both ways'''
+    weight: float = 1.0
+    lu: float = 1.0
+    ji: float = -1.0
+
+    def as_table(self):
+        code = np.arange(144)[:, None]
+        life = np.arange(12)[None, :]
+        table = self.lu * (code // 12 == life) + self.ji * (code % 12 == life)
+        return PairTable('lu_ji', 'life', table.astype(np.float32), self.weight, both_ways=True)
+
+    def reference(self, chart_a, chart_b):
+        def one_way(chart, other):
+            life = other.palaces.life.pillar.branch.name
+            score = 0.0
+            if chart.locate('hua_lu').pillar.branch.name == life:
+                score += self.lu
+            if chart.locate('hua_ji').pillar.branch.name == life:
+                score += self.ji
+            return score
+        return (one_way(chart_a, chart_b) + one_way(chart_b, chart_a)) * self.weight
+
+def default_rules():
+    return [YearAnimalRule(), YearElementRule(), SpouseStarsRule(), TransformRule()]
+
+@define
+class Scorer:
+    '''sum of rules over every pair; PairTables (and rules with as_table())
+    on the same features get folded into a single table up front'''
+    rules: list = field(factory=default_rules)
+    _compiled: list = field(init=False, default=None, repr=False)
+
+    def _compile(self):
+        tables, others = {}, []
+        for rule in self.rules:
+            try:
+                table = rule.as_table()
+            except (AttributeError, NotImplementedError):
+                others.append(rule)
+                continue
+            group = (table.feature_a, table.feature_b, table.both_ways)
+            weighted = table.table * np.float32(table.weight)
+            tables[group] = tables[group] + weighted if group in tables else weighted
+        self._compiled = [PairTable(a, b, table, both_ways=both) for (a, b, both), table in tables.items()] + others
+        return self._compiled
+
+    def block(self, a, b):
+        '''(len(a), len(b)) float32 scores, all zero with no rules'''
+        rules = self._compile() if self._compiled is None else self._compiled
+        if not rules:
+            return np.zeros((len(a), len(b)), dtype=np.float32)
+        out = np.asarray(rules[0].block(a, b), dtype=np.float32)
+        for rule in rules[1:]:
+            out += rule.block(a, b)
+        return out
+
+    def reference(self, chart_a, chart_b):
+        return sum(rule.reference(chart_a, chart_b) for rule in self.rules)
+
+def top_k(features, k=10, scorer=None, candidates=None, block_size=2048, exclude_self=None):
+    '''(indices, scores), both (len(features), k): the k best scoring
+    candidates for every chart, best first. candidates defaults to features
+    itself, in which case a chart isn't matched with itself. Works block by
+    block, so memory is about block_size * (block_size + k) scores.'''
+    if k < 1:
+        raise ValueError(f'k has to be at least 1, got {k}')
+    scorer = scorer or Scorer()
+    if candidates is None:
+        candidates = features
+        exclude_self = True if exclude_self is None else exclude_self
+    k = min(k, len(candidates) - (1 if exclude_self else 0))
+    n = len(features)
+    best_idx = np.empty((n, k), dtype=np.int64)
+    best_score = np.empty((n, k), dtype=np.float32)
+    for q0 in range(0, n, block_size):
+        q1 = min(n, q0 + block_size)
+        queries = features[q0:q1]
+        run_idx = np.empty((q1 - q0, 0), dtype=np.int64)
+        run_score = np.empty((q1 - q0, 0), dtype=np.float32)
+        for c0 in range(0, len(candidates), block_size):
+            c1 = min(len(candidates), c0 + block_size)
+            scores = scorer.block(queries, candidates[c0:c1])
+            if exclude_self and c0 < q1 and q0 < c1:
+                rows = np.arange(max(q0, c0), min(q1, c1))
+                scores[rows - q0, rows - c0] = -np.inf
+            all_score = np.concatenate([run_score, scores], axis=1)
+            all_idx = np.concatenate([run_idx, np.broadcast_to(np.arange(c0, c1), scores.shape)], axis=1)
+            if all_score.shape[1] > k:
+                keep = np.argpartition(-all_score, k - 1, axis=1)[:, :k]
+                all_score = np.take_along_axis(all_score, keep, axis=1)
+                all_idx = np.take_along_axis(all_idx, keep, axis=1)
+            run_score, run_idx = all_score, all_idx
+        # best first, ties by candidate index
+        order = np.lexsort((run_idx, -run_score), axis=1)
+        best_idx[q0:q1] = np.take_along_axis(run_idx, order, axis=1)
+        best_score[q0:q1] = np.take_along_axis(run_score, order, axis=1)
+    return best_idx, best_score
+
+def verify(charts, scorer=None):
+    '''(pairs checked, mismatches) comparing scorer.block on Features built
+    from the charts' keys with scorer.reference on every pair of charts'''
+    scorer = scorer or Scorer()
+    features = Features.from_keys(chart.key for chart in charts)
+    scores = scorer.block(features, features)
+    mismatches = []
+    for i, chart_a in enumerate(charts):
+        for j, chart_b in enumerate(charts):
+            expected = scorer.reference(chart_a, chart_b)
+            if abs(scores[i, j] - expected) > 1e-4:
+                mismatches.append((i, j, float(scores[i, j]), expected))
+    return len(charts) ** 2, mismatches
@@ -65,3 +65,31 @@ class Star:
 
     def pretty_str(self):
         return self.name.replace('_', ' ').title()
+
+class LazyStarList(list):
+    '''list of stars for a palace on a lazily built chart; the first time it
+    gets read or changed it has the chart finish placing its stars'''
+    __slots__ = ('_force',)
+
+    def __init__(self, iterable=(), force=None):
+        super().__init__(iterable)
+        self._force = force
+
+    def _ready(self):
+        if self._force is not None:
+            self._force()
+
+def _forcing(name):
+    method = getattr(list, name)
+    def wrapper(self, *args, **kwargs):
+        self._ready()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+for _name in ('__iter__', '__len__', '__getitem__', '__contains__', '__repr__', '__eq__', 
+              '__ne__', '__lt__', '__le__', '__gt__', '__ge__', '__reversed__', '__add__', 
+              '__mul__', '__setitem__', '__delitem__', '__iadd__', '__imul__', 'index', 
+              'count', 'copy', 'append', 'extend', 'insert', 'remove', 'pop', 'clear', 
+              'sort', 'reverse'):
+    setattr(LazyStarList, _name, _forcing(_name))
@@ -0,0 +1,601 @@
+'''Differential verification: runs the reference implementation and one or
+more alternative engines over every input in a space and reports each
+input where they disagree.
+
+Spaces:
+    keys        every year pillar x lunar month x leap or not x lunar day x
+                hour branch x gender (1,036,800 inputs). The reference is
+                PurpleStarChart.add_stars on a chart set up from the key.
+                ChartKey has no leap flag (leap months share their month's
+                number), so every key is charted both as a normal and as a
+                leap month and the alternatives are held to both.
+    calendar    every hour (or day, or any other step) from first_date to
+                last_date. The reference is BaZiChart.from_solar_date, and
+                what gets compared is the lunar date, the four pillars and
+                the ChartKey index the moment lands on.
+
+Alternative engines are looked up by name in key_engines and
+calendar_engines. They're plain module level functions, so they can be
+sent to worker processes, and more can be registered there. A key engine
+takes an array of key indices, and a calendar engine takes (start, stop,
+step, solar_terms). Both return a dict of per-input arrays for any of the
+fields the reference produces.
+
+Work is cut into shards that run across a process pool, one worker per
+core by default. Each shard comes back as a Report, and reports merge, so
+nothing is kept per input: every check that fails is summed up as a
+Failures. That records how many inputs failed, the key components or date
+parts they all share, which slots or fields differ, the smallest failing
+input with its expected and actual values, and the first few failing
+inputs. Inputs are numbered so that smaller means earlier in every
+component, which makes the smallest failing input the minimal one to
+debug from. For keys, describe() turns it into a birth datetime that
+produces it, when one exists.
+
+The reference gets checked against itself along the way. Anything odd is
+a finding rather than a mismatch:
+    shadowed <star>     a name placed twice (tian_fu, tian_yue, fei_lian)
+                        landed in two palaces, and _palace_by_star (so
+                        locate()) only knows about the later one
+    doubled <star>      both placements of a name landed in the same
+                        palace, which then lists the name twice
+    lookup <star>       _palace_by_star doesn't hold a star's last placement
+    leap month          charting the month as a leap month changes the chart
+    master flags        not exactly one life master and one body master
+    lunar round trip    the lunar date doesn't convert back to the same day
+                        with lunardate
+    reference error     the reference raised
+Once per run, stale_reads() lists the places where the reference reads a
+name that's placed twice back out of _palace_by_star.
+
+    report = check_keys(['star_engine', 'lazy'])
+    print(report.format())
+
+or from the shell, `purple-star-chart verify keys star_engine lazy`.'''
+
+import os
+from collections import Counter
+from datetime import date, datetime, timedelta
+from multiprocessing import Pool
+from time import perf_counter
+import numpy as np
+from attrs import define, evolve, field
+from lunardate import LunarDate
+from src.purple_star_chart import _branches, _genders, _magnitude_names, _palace_names, _phase_names, _stems, _star_slots
+from src.purple_star_chart.BaZiChart import BaZiChart
+from src.purple_star_chart.PurpleStarChart import PurpleStarChart, _stage_deps
+from src.purple_star_chart.chart_key import ChartKey, KeyDate, N_KEYS, _key_shape, cycle_from_pillar
+from src.purple_star_chart.lunar_index import _month_starts, _month_numbers, _month_leaps, first_date, last_date
+
+# names with more than one slot; _palace_by_star can only hold one of them
+_twice = {name for name, n in Counter(_star_slots).items() if n > 1}
+_slot_labels = tuple(name if _star_slots.index(name) == slot else name + ' (2nd)'
+                     for slot, name in enumerate(_star_slots))
+
+# labels for each column of the multi-column fields
+_field_columns = {
+    'positions': _slot_labels,
+    'magnitudes': _slot_labels,
+    'palace_stems': tuple(_palace_names),
+    'lunar': ('year', 'month', 'day', 'leap'),
+    'pillars': ('year_stem', 'year_branch', 'month_stem', 'month_branch', 'day_stem', 'day_branch',
+                'hour_stem', 'hour_branch')
+}
+
+# what a key input's code unravels into: a key index times two plus the leap flag
+_key_parts = ('year', 'month', 'day', 'hour', 'gender', 'leap')
+_key_code_shape = _key_shape + (2,)
+_KEEP = 10
+
+@define
+class Failures:
+    '''every input that failed one check, summed up so shards can merge'''
+    count: int = 0
+    components: dict = field(factory=dict)  # input component -> set of values seen
+    columns: set = field(factory=set)       # labels of the slots / fields that differed
+    labels: tuple = ()                      # column labels for first's values
+    first: tuple = None                     # (input code, expected, got) for the smallest input
+    examples: list = field(factory=list)    # the smallest few failing input codes
+
+    def add(self, codes, components, expected, got, columns=(), labels=()):
+        '''codes are the failing inputs, components their unravelled parts
+        (name -> array), and expected / got their values row by row'''
+        codes = np.asarray(codes, dtype=np.int64)
+        self.count += len(codes)
+        for name, values in components.items():
+            self.components.setdefault(name, set()).update(np.unique(values).tolist())
+        self.columns.update(columns)
+        i = int(np.argmin(codes))
+        if self.first is None or codes[i] < self.first[0]:
+            self.first = (int(codes[i]), _plain(expected[i]), _plain(got[i]))
+            self.labels = tuple(labels)
+        self.examples = sorted(set(self.examples).union(np.sort(codes)[:_KEEP].tolist()))[:_KEEP]
+        return self
+
+    def merge(self, other):
+        self.count += other.count
+        for name, values in other.components.items():
+            self.components.setdefault(name, set()).update(values)
+        self.columns.update(other.columns)
+        if other.first is not None and (self.first is None or other.first[0] < self.first[0]):
+            self.first, self.labels = other.first, other.labels
+        self.examples = sorted(set(self.examples).union(other.examples))[:_KEEP]
+        return self
+
+    def shared(self):
+        '''components every failing input has the same value for'''
+        return {name: next(iter(values)) for name, values in self.components.items() if len(values) == 1}
+
+    def to_dict(self):
+        return {'count': self.count, 'components': {k: sorted(v) for k, v in self.components.items()},
+                'columns': sorted(self.columns), 'labels': list(self.labels),
+                'first': list(self.first) if self.first else None, 'examples': self.examples}
+
+def _plain(value):
+    return value.tolist() if isinstance(value, np.ndarray) else value.item() if isinstance(value, np.generic) else value
+
+@define
+class Report:
+    '''what a check found over some inputs; shard reports add up with merge()'''
+    space: str
+    engines: tuple
+    checked: int = 0
+    seconds: float = 0.0
+    mismatches: dict = field(factory=dict)  # '<engine> <field>' -> Failures
+    findings: dict = field(factory=dict)    # finding name -> Failures
+    notes: list = field(factory=list)       # findings about the code rather than any input
+
+    @property
+    def ok(self):
+        '''True if no engine disagreed with the reference anywhere'''
+        return not self.mismatches
+
+    def mismatch(self, name):
+        return self.mismatches.setdefault(name, Failures())
+
+    def finding(self, name):
+        return self.findings.setdefault(name, Failures())
+
+    def merge(self, other):
+        self.checked += other.checked
+        for mine, theirs in ((self.mismatches, other.mismatches), (self.findings, other.findings)):
+            for name, failures in theirs.items():
+                mine.setdefault(name, Failures()).merge(failures)
+        self.notes += [note for note in other.notes if note not in self.notes]
+        return self
+
+    def parts(self, codes):
+        '''the components of input codes, name -> array'''
+        return _key_code_parts(codes) if self.space == 'keys' else _calendar_code_parts(codes)
+
+    def describe(self, code):
+        '''readable dict for one input code'''
+        return describe_key(code) if self.space == 'keys' else describe_moment(code)
+
+    def to_dict(self):
+        '''plain dict, e.g. for json'''
+        return {
+            'space': self.space, 'engines': list(self.engines), 'checked': self.checked,
+            'seconds': self.seconds, 'ok': self.ok, 'notes': self.notes,
+            'mismatches': {name: dict(f.to_dict(), minimal=self.describe(f.first[0]))
+                           for name, f in sorted(self.mismatches.items())},
+            'findings': {name: dict(f.to_dict(), minimal=self.describe(f.first[0]))
+                         for name, f in sorted(self.findings.items())}
+        }
+
+    def format(self):
+        '''the report as text, for people'''
+        lines = [f'{self.space}: {self.checked} inputs against {", ".join(self.engines) or "no engines"} '
+                 f'in {self.seconds:.1f}s']
+        lines.append('no mismatches' if self.ok else 'mismatches:')
+        for title, table in (('', self.mismatches), ('findings:', self.findings)):
+            if title and table:
+                lines.append(title)
+            for name, f in sorted(table.items()):
+                lines.append(f'  {name}: {f.count} inputs')
+                if f.columns:
+                    lines.append(f'    differs in {", ".join(sorted(f.columns))}')
+                shared = f.shared()
+                if shared:
+                    shown = ', '.join(f'{k}={_part_text(k, v, self.space)}' for k, v in shared.items())
+                    lines.append(f'    every one has {shown}')
+                info = self.describe(f.first[0])
+                lines.append('    minimal: ' + ', '.join(f'{k}={v}' for k, v in info.items()))
+                lines.append('    ' + _diff_text(f))
+        if self.notes:
+            lines.append('notes:')
+            lines += [f'  {note}' for note in self.notes]
+        return '\n'.join(lines)
+
+def _part_text(name, value, space):
+    if space != 'keys':
+        return value
+    if name == 'year':
+        return f'{_stems[value % 10]} {_branches[value % 12]}'
+    if name == 'month' or name == 'day':
+        return value + 1
+    if name == 'hour':
+        return _branches[value]
+    if name == 'gender':
+        return _genders[value]
+    return bool(value)
+
+def _diff_text(f):
+    _, expected, got = f.first
+    if f.labels and isinstance(expected, list) and isinstance(got, list):
+        diffs = [f'{label} {want} != {have}' for label, want, have in zip(f.labels, expected, got) if want != have]
+        return 'expected != got: ' + ', '.join(diffs)
+    return f'expected {expected}, got {got}'
+
+# key space
+
+def _key_code_parts(codes):
+    return dict(zip(_key_parts, np.unravel_index(np.asarray(codes, dtype=np.int64), _key_code_shape)))
+
+def key_date(index, leap=False):
+    '''a birth datetime whose chart has the key at index (in a leap month if
+    leap), or None if no supported date has it'''
+    year, month, day, hour, _ = (int(v) for v in np.unravel_index(index, _key_shape))
+    for loc in range(len(_month_starts) - 1):
+        if _month_numbers[loc] != month + 1 or _month_leaps[loc] != leap:
+            continue
+        ordinal = _month_starts[loc] + day
+        if ordinal >= _month_starts[loc + 1]:
+            continue
+        this_date = date.fromordinal(ordinal)
+        if (this_date.year - 4) % 60 == year:
+            return datetime(this_date.year, this_date.month, this_date.day, max(hour * 2 - 1, 0))
+    return None
+
+def describe_key(code):
+    '''readable dict for a key input code (key index * 2 + leap)'''
+    index, leap = divmod(int(code), 2)
+    key = ChartKey.from_index(index)
+    when = key_date(index, bool(leap))
+    return {'key': index, 'year': f'{_stems[key.year_stem]} {_branches[key.year_branch]}', 'month': key.month,
+            'leap': bool(leap), 'day': key.day, 'hour': _branches[key.hour], 'gender': key.gender,
+            'date': when.isoformat() if when else None}
+
+def _key_chart(index, leap):
+    '''the reference chart for a key, its month a leap month if leap'''
+    key = ChartKey.from_index(index)
+    chart = PurpleStarChart.from_key(key)
+    if leap:
+        ldate = KeyDate(chart.lunar_date.year, key.month, key.day, True)
+        chart = PurpleStarChart._from_parts(None, ldate, evolve(chart.bazi, lunar_date=ldate), key.gender)
+    chart.add_stars()
+    return chart
+
+def _chart_fields(chart):
+    '''the values engines get compared on, for one finished chart'''
+    stars = chart._slot_stars()
+    return {
+        'positions': chart._slot_branches(),
+        'magnitudes': [0 if s.magnitude is None else _magnitude_names.index(s.magnitude) + 1 for s in stars],
+        'palace_stems': [_stems.index(getattr(chart.palaces, p).pillar.stem.name) for p in _palace_names],
+        'life': _branches.index(chart.palaces.life.pillar.branch.name),
+        'body': _branches.index(chart.palaces.body.pillar.branch.name),
+        'phase': _phase_names.index(chart.elemental_phase),
+        'traverse_back': chart._traverse_back,
+        'life_master': next(i for i, s in enumerate(stars) if s.isLifeMaster),
+        'body_master': next(i for i, s in enumerate(stars) if s.isBodyMaster)
+    }
+
+def _chart_findings(chart):
+    '''(finding, expected, got) for anything off about a reference chart'''
+    out = []
+    last = {}
+    by_name = {}
+    for star_name, palace, _, _ in chart._placements:
+        last[star_name] = palace
+        by_name.setdefault(star_name, []).append(palace)
+    for star_name, palace in last.items():
+        if chart._palace_by_star.get(star_name) is not palace:
+            held = chart._palace_by_star.get(star_name)
+            out.append((f'lookup {star_name}', palace.pillar.branch.name, held and held.pillar.branch.name))
+    for star_name in _twice:
+        palaces = by_name.get(star_name, [])
+        branches = [p.pillar.branch.name for p in palaces]
+        if len(set(map(id, palaces))) > 1:
+            out.append((f'shadowed {star_name}', branches, chart._palace_by_star[star_name].pillar.branch.name))
+        elif len(palaces) > 1:
+            out.append((f'doubled {star_name}', branches[:1], branches))
+    stars = [star for palace in chart._palace_by_branch.values() for star in palace.stars]
+    flags = (sum(star.isLifeMaster for star in stars), sum(star.isBodyMaster for star in stars))
+    if flags != (1, 1):
+        out.append(('master flags', [1, 1], list(flags)))
+    return out
+
+def stale_reads():
+    '''(reader, star) for every place the reference looks up a name that's
+    placed more than once through _palace_by_star, which only holds the
+    latest placement: a _plot_* stage reading it, or the life / body master
+    lookup in _add_details_to_stars'''
+    from src.purple_star_chart.star_engine import _LIFE_MASTER, _BODY_MASTER
+    reads = [(stage, star) for stage, (_, stars) in _stage_deps.items() for star in sorted(stars & _twice)]
+    reads += [('_add_details_to_stars', star) for star in sorted((set(_LIFE_MASTER) | set(_BODY_MASTER)) & _twice)]
+    return reads
+
+def _stack(rows):
+    return {name: np.array([row[name] for row in rows]) for name in rows[0]} if rows else {}
+
+def _compare(report, engine, codes, expected, got):
+    '''adds a mismatch for every field of got that differs from expected'''
+    parts = report.parts
+    for name, want in expected.items():
+        if name not in got:
+            continue
+        have = np.asarray(got[name])
+        if have.shape != want.shape:
+            report.mismatch(f'{engine} {name}').add(codes, parts(codes), [want.shape] * len(codes),
+                                                    [have.shape] * len(codes))
+            continue
+        diff = (want != have).reshape(len(want), -1)
+        bad = diff.any(axis=1)
+        if not bad.any():
+            continue
+        labels = _field_columns.get(name, ())
+        columns = [labels[c] if labels else name for c in np.flatnonzero(diff[bad].any(axis=0))]
+        report.mismatch(f'{engine} {name}').add(codes[bad], parts(codes[bad]), want[bad], have[bad],
+                                                columns, labels)
+
+def _run_engines(report, engines, call, codes, expected, keep=None):
+    '''call(engine) gives an engine's fields; keep, if given, picks the rows
+    of them that line up with codes'''
+    for engine in engines:
+        try:
+            got = call(engine)
+        except Exception as e:
+            report.mismatch(f'{engine} error').add(codes, report.parts(codes), [None] * len(codes),
+                                                   [repr(e)] * len(codes))
+            continue
+        if keep is not None:
+            got = {name: np.asarray(values)[keep] for name, values in got.items()}
+        _compare(report, engine, codes, expected, got)
+
+def _key_shard(args):
+    start, stop, engines, leap = args
+    report = Report('keys', engines)
+    codes, rows, leap_rows = [], [], {}
+    found = {}
+    for index in range(start, stop):
+        for is_leap in ((False, True) if leap else (False,)):
+            code = index * 2 + is_leap
+            try:
+                chart = _key_chart(index, is_leap)
+                row = _chart_fields(chart)
+                for name, want, have in _chart_findings(chart):
+                    found.setdefault(name, []).append((code, want, have))
+            except Exception as e:
+                found.setdefault('reference error', []).append((code, None, repr(e)))
+                continue
+            if is_leap:
+                normal = leap_rows.get(index)
+                if normal is not None and normal != row:
+                    differ = [name for name in row if row[name] != normal[name]]
+                    found.setdefault('leap month', []).append((code, normal, row, differ))
+            else:
+                leap_rows[index] = row
+            codes.append(code)
+            rows.append(row)
+    report.checked = (stop - start) * (2 if leap else 1)
+    for name, items in found.items():
+        item_codes = np.array([item[0] for item in items], dtype=np.int64)
+        columns = sorted({c for item in items for c in item[3]}) if name == 'leap month' else ()
+        report.finding(name).add(item_codes, report.parts(item_codes), [item[1] for item in items],
+                                 [item[2] for item in items], columns)
+    if rows:
+        codes = np.array(codes, dtype=np.int64)
+        # normal and leap rows share a key, so engines only see each key once
+        indices, rows_of = np.unique(codes // 2, return_inverse=True)
+        _run_engines(report, engines, lambda engine: key_engines[engine](indices), codes, _stack(rows), rows_of)
+    return report
+
+def check_keys(engines=('star_engine',), leap=True, start=0, stop=N_KEYS, workers=None, shard_size=720,
+               progress=None):
+    '''every key from start to stop (ChartKey.index() values), charted by
+    the reference and by each of engines; see key_engines. progress, if
+    given, is called with (inputs done, inputs in all) as shards finish.'''
+    for engine in engines:
+        if engine not in key_engines:
+            raise ValueError(f'unknown key engine {engine}, choose from {", ".join(key_engines)}')
+    shards = [(lo, min(lo + shard_size, stop), tuple(engines), leap) for lo in range(start, stop, shard_size)]
+    report = _run_shards('keys', engines, _key_shard, shards, (stop - start) * (2 if leap else 1),
+                         workers, progress)
+    report.notes += [f'{stage} reads {star} through _palace_by_star, but {star} is placed more than once'
+                     for stage, star in stale_reads()]
+    return report
+
+# key engines: key indices -> dict of field arrays
+
+def _key_columns(indices):
+    year, month, day, hour, gender = np.unravel_index(np.asarray(indices, dtype=np.int64), _key_shape)
+    return year, month + 1, day + 1, hour, gender
+
+def _placement_fields(placed):
+    from src.purple_star_chart.magnitudes import magnitude_codes
+    return {'positions': placed.positions, 'magnitudes': magnitude_codes(placed.positions),
+            'life': placed.life, 'body': placed.body, 'phase': placed.phase,
+            'traverse_back': placed.traverse_back, 'life_master': placed.life_master,
+            'body_master': placed.body_master}
+
+def star_engine(indices):
+    '''the compiled star engine, always computing (never a key table)'''
+    from src.purple_star_chart import star_engine as engine
+    table, engine._key_table = engine._key_table, None
+    try:
+        return _placement_fields(engine.place(*_key_columns(indices)))
+    finally:
+        engine._key_table = table
+
+_tables = {}
+
+def key_table(indices):
+    '''lookups in the shared placement table (see shared_tables)'''
+    if 'placements' not in _tables:
+        from src.purple_star_chart.shared_tables import placement_table
+        _tables['placements'] = placement_table()
+    return _placement_fields(_tables['placements'].take(np.asarray(indices, dtype=np.int64)))
+
+def chart_table(indices):
+    '''records of the prebuilt ChartTable at chart_table.default_path (or
+    $PURPLE_STAR_CHART_TABLE)'''
+    from src.purple_star_chart.chart_table import ChartTable, default_path
+    if 'chart_table' not in _tables:
+        _tables['chart_table'] = ChartTable(os.environ.get('PURPLE_STAR_CHART_TABLE', default_path))
+    table = _tables['chart_table']
+    rows = []
+    for index in indices:
+        rec = table.lookup(ChartKey.from_index(int(index)))
+        rows.append({'positions': list(rec.slot_branches), 'palace_stems': list(rec.palace_stems),
+                     'life': rec.life_branch, 'body': rec.palace_branch(rec.body_palace), 'phase': rec.phase,
+                     'life_master': rec.life_master, 'body_master': rec.body_master})
+    return _stack(rows)
+
+def lazy(indices):
+    '''add_stars(lazy=True), with locate() on the names placed twice and
+    major_stars() before the rest of the chart gets filled in'''
+    rows = []
+    for index in indices:
+        chart = PurpleStarChart.from_key(ChartKey.from_index(int(index)))
+        chart.add_stars(lazy=True)
+        for star_name in sorted(_twice):
+            chart.locate(star_name)
+        chart.major_stars()
+        rows.append(_chart_fields(chart))
+    return _stack(rows)
+
+key_engines = {'star_engine': star_engine, 'key_table': key_table, 'chart_table': chart_table, 'lazy': lazy}
+
+# calendar
+
+def _moments(start, stop, step):
+    return np.arange(np.datetime64(start, 'us'), np.datetime64(stop, 'us'), np.timedelta64(step, 'us'))
+
+def _calendar_code_parts(codes):
+    moments = np.asarray(codes, dtype=np.int64).astype('datetime64[us]')
+    years, months, days = (moments.astype(f'datetime64[{unit}]') for unit in 'YMD')
+    return {'year': years.astype(np.int64) + 1970, 'month': (months - years).astype(np.int64) + 1,
+            'day': (days - months).astype(np.int64) + 1,
+            'hour': (moments.astype('datetime64[h]') - days).astype(np.int64)}
+
+def describe_moment(code):
+    return {'datetime': np.datetime64(int(code), 'us').item().isoformat()}
+
+def _key_index(year_stem, year_branch, lunar_month, lunar_day, hour_branch):
+    year = cycle_from_pillar(np.asarray(year_stem, dtype=np.int64), np.asarray(year_branch, dtype=np.int64))
+    return (((year * 12 + np.asarray(lunar_month, dtype=np.int64) - 1) * 30
+             + np.asarray(lunar_day, dtype=np.int64) - 1) * 12 + np.asarray(hour_branch, dtype=np.int64)) * 2
+
+def _bazi_fields(bazi):
+    ldate = bazi.lunar_date
+    codes = [f(getattr(bazi, p)) for p in ('year', 'month', 'day', 'hour')
+             for f in (lambda pillar: _stems.index(pillar.stem.name), lambda pillar: _branches.index(pillar.branch.name))]
+    return {'lunar': [ldate.year, ldate.month, ldate.day, bool(ldate.isLeapMonth)], 'pillars': codes,
+            'key': ChartKey.from_bazi(bazi, 'male').index()}
+
+def _calendar_shard(args):
+    start, stop, step, engines, solar_terms = args
+    report = Report('calendar', engines)
+    moments = _moments(start, stop, step)
+    report.checked = len(moments)
+    codes, rows, found = [], [], {}
+    round_trips = {}
+    for code, when in zip(moments.astype(np.int64).tolist(), moments.tolist()):
+        try:
+            bazi = BaZiChart.from_solar_date(when, solar_terms)
+            row = _bazi_fields(bazi)
+            day = when.date()
+            if day not in round_trips:
+                ldate = bazi.lunar_date
+                round_trips[day] = LunarDate(ldate.year, ldate.month, ldate.day, ldate.isLeapMonth).toSolarDate()
+            if round_trips[day] != day:
+                found.setdefault('lunar round trip', []).append((code, day.isoformat(), round_trips[day].isoformat()))
+        except Exception as e:
+            found.setdefault('reference error', []).append((code, None, repr(e)))
+            continue
+        codes.append(code)
+        rows.append(row)
+    for name, items in found.items():
+        item_codes = np.array([item[0] for item in items], dtype=np.int64)
+        report.finding(name).add(item_codes, report.parts(item_codes), [item[1] for item in items],
+                                 [item[2] for item in items])
+    if rows:
+        codes = np.array(codes, dtype=np.int64)
+        # engines do the whole range; drop any rows the reference couldn't
+        keep = np.isin(moments.astype(np.int64), codes)
+        _run_engines(report, engines, lambda engine: calendar_engines[engine](start, stop, step, solar_terms),
+                     codes, _stack(rows), None if keep.all() else keep)
+    return report
+
+def check_calendar(engines=('bazi_batch', 'almanac'), first=first_date, last=last_date, step=timedelta(hours=1),
+                   solar_terms=False, workers=None, shard_size=8760, progress=None):
+    '''every moment from the start of first to the end of last, step apart,
+    through BaZiChart.from_solar_date and each of engines; see
+    calendar_engines. shard_size is in moments.'''
+    for engine in engines:
+        if engine not in calendar_engines:
+            raise ValueError(f'unknown calendar engine {engine}, choose from {", ".join(calendar_engines)}')
+    start = datetime(first.year, first.month, first.day)
+    stop = datetime(last.year, last.month, last.day) + timedelta(days=1)
+    total = -(-(stop - start) // step)
+    shards = [(start + n * step, min(start + min(n + shard_size, total) * step, stop), step, tuple(engines),
+               solar_terms) for n in range(0, total, shard_size)]
+    return _run_shards('calendar', engines, _calendar_shard, shards, total, workers, progress)
+
+# calendar engines: (start, stop, step, solar_terms) -> dict of field arrays
+
+def bazi_batch(start, stop, step, solar_terms):
+    '''BaZiBatch over the whole range at once'''
+    from src.purple_star_chart.bazi_batch import BaZiBatch
+    batch = BaZiBatch.from_solar_dates(_moments(start, stop, step), solar_terms)
+    return {'lunar': np.stack([batch.lunar_year, batch.lunar_month, batch.lunar_day, batch.lunar_leap], axis=1),
+            'pillars': batch.pillar_codes(),
+            'key': _key_index(batch.year_stem, batch.year_branch, batch.lunar_month, batch.lunar_day,
+                              batch.hour_branch)}
+
+def almanac(start, stop, step, solar_terms):
+    '''almanac.walk stepping through the range'''
+    from src.purple_star_chart.almanac import walk
+    records = list(walk(start, stop, step, solar_terms))
+    lunar = np.array([(r.lunar_year, r.lunar_month, r.lunar_day, r.lunar_leap) for r in records])
+    pillars = np.array([r.pillar_codes() for r in records])
+    return {'lunar': lunar, 'pillars': pillars,
+            'key': _key_index(pillars[:, 0], pillars[:, 1], lunar[:, 1], lunar[:, 2], pillars[:, 7])}
+
+def lunardate(start, stop, step, solar_terms):
+    '''the lunardate package's own conversion, for the lunar date only'''
+    conversions = {}
+    rows = []
+    for when in _moments(start, stop, step).tolist():
+        day = when.date()
+        if day not in conversions:
+            ldate = LunarDate.fromSolarDate(day.year, day.month, day.day)
+            conversions[day] = [ldate.year, ldate.month, ldate.day, bool(ldate.isLeapMonth)]
+        rows.append(conversions[day])
+    return {'lunar': np.array(rows)}
+
+calendar_engines = {'bazi_batch': bazi_batch, 'almanac': almanac, 'lunardate': lunardate}
+
+def _run_shards(space, engines, fn, shards, total, workers, progress):
+    '''runs fn on every shard, across a pool of workers processes (None for
+    one per core, 0 for this process), and merges the reports'''
+    began = perf_counter()
+    report = Report(space, tuple(engines))
+    if workers == 0:
+        results = map(fn, shards)
+        pool = None
+    else:
+        pool = Pool(workers)
+        results = pool.imap_unordered(fn, shards)
+    try:
+        for part in results:
+            report.merge(part)
+            if progress is not None:
+                progress(report.checked, total)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    report.seconds = perf_counter() - began
+    return report
+
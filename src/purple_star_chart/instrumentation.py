@@ -0,0 +1,158 @@
+'''Opt-in timing and counting for chart construction.
+Nothing is measured until a hook is installed. Construction code checks
+`instrumentation.hooks` (an empty list by default) before doing anything
+else, so with no hooks installed all it costs is that one check per stage.
+
+Stages reported to hooks:
+    lunar_conversion    solar to lunar date in BaZiChart.from_solar_date
+    palace_setup        palaces, pillars and phase in initialize_chart
+    _plot_*             each star plotting pass in add_stars (or a lazy chart)
+    _add_details_to_stars
+Counters: charts_built, stars_placed, cache_hits, cache_misses.
+
+Metrics is a ready-made hook that keeps a latency histogram per stage and
+totals per counter, and exports them as OpenMetrics text or a dict:
+
+    metrics = Metrics()
+    with instrumented(metrics):
+        ...build charts...
+    print(metrics.to_openmetrics())'''
+
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter_ns
+from attrs import define, field
+
+# installed hooks; replaced (never mutated) by install/uninstall so a
+# construction already looping over it isn't disturbed
+hooks = []
+
+class Hook:
+    '''base class for instrumentation hooks; override what you need'''
+
+    def stage_started(self, stage, subject):
+        pass
+
+    def stage_finished(self, stage, seconds, subject):
+        pass
+
+    def counted(self, counter, n):
+        pass
+
+def install(hook):
+    global hooks
+    hooks = hooks + [hook]
+    return hook
+
+def uninstall(hook):
+    global hooks
+    hooks = [h for h in hooks if h is not hook]
+
+@contextmanager
+def instrumented(hook):
+    install(hook)
+    try:
+        yield hook
+    finally:
+        uninstall(hook)
+
+def timed(stage, fn, *args, subject=None):
+    '''runs fn(*args), telling every hook when it starts and how long it took.
+    Callers check `hooks` first so this is only reached when instrumented.'''
+    current = hooks
+    for hook in current:
+        hook.stage_started(stage, subject)
+    start = perf_counter_ns()
+    try:
+        return fn(*args)
+    finally:
+        seconds = (perf_counter_ns() - start) / 1e9
+        for hook in current:
+            hook.stage_finished(stage, seconds, subject)
+
+def count(counter, n=1):
+    for hook in hooks:
+        hook.counted(counter, n)
+
+# upper bounds in seconds; stages run anywhere from a microsecond (lunar
+# conversion) to a few milliseconds (a slow add_stars)
+default_buckets = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 1e-2)
+
+@define
+class Histogram:
+    bounds: tuple
+    counts: list = None
+    total: float = 0.0
+    n: int = 0
+
+    def __attrs_post_init__(self):
+        if self.counts is None:
+            self.counts = [0] * (len(self.bounds) + 1)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.n += 1
+
+    def cumulative(self):
+        '''(upper bound, observations <= bound) pairs, ending with +Inf'''
+        out, running = [], 0
+        for bound, n in zip(list(self.bounds) + [float('inf')], self.counts):
+            running += n
+            out.append((bound, running))
+        return out
+
+def _label(value):
+    return '+Inf' if value == float('inf') else repr(value)
+
+@define
+class Metrics(Hook):
+    '''hook that aggregates stage timings into histograms and sums counters'''
+    buckets: tuple = default_buckets
+    _histograms: dict = field(init=False, factory=dict)
+    _counters: dict = field(init=False, factory=dict)
+    _lock: object = field(init=False, factory=threading.Lock, repr=False)
+
+    def stage_finished(self, stage, seconds, subject):
+        with self._lock:
+            hist = self._histograms.get(stage)
+            if hist is None:
+                hist = self._histograms[stage] = Histogram(self.buckets)
+            hist.observe(seconds)
+
+    def counted(self, counter, n):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + n
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        '''plain dict of everything recorded so far'''
+        with self._lock:
+            return {
+                'stages': {stage: {'count': h.n, 'sum': h.total,
+                                   'buckets': {_label(b): n for b, n in h.cumulative()}}
+                           for stage, h in self._histograms.items()},
+                'counters': dict(self._counters)
+            }
+
+    def to_openmetrics(self, prefix='purple_star'):
+        '''OpenMetrics text exposition (also readable as Prometheus text)'''
+        snap = self.snapshot()
+        name = f'{prefix}_stage_seconds'
+        lines = [f'# TYPE {name} histogram', f'# UNIT {name} seconds',
+                 f'# HELP {name} time spent in each chart construction stage']
+        for stage, h in sorted(snap['stages'].items()):
+            for bound, n in h['buckets'].items():
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {n}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {h["sum"]!r}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {h["count"]}')
+        for counter, n in sorted(snap['counters'].items()):
+            lines.append(f'# TYPE {prefix}_{counter} counter')
+            lines.append(f'{prefix}_{counter}_total {n}')
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,160 @@
+'''Decadal (da xian) and annual (liu nian) luck overlays for a whole lifespan.
+Nothing here builds another chart: every overlay is read off the natal
+placements (the branch of every star slot) plus the values the natal chart
+already worked out, so a lifespan for any number of charts is a handful of
+numpy gathers over (chart, year) arrays.
+
+Ages are nominal (xu sui): the birth year is age 1, and year n of a lifespan
+is solar year birth_year + n - 1, with its pillar taken from the solar year
+the same way BaZiChart does for the natal year.
+
+Decades start from the life palace at age phase number (water 2 ... fire 6)
+and move one palace per ten years, forward or back following the chart's
+traversal direction; years before the first decade have no decadal palace
+(-1). Each decade and each year also gets the four transformations
+(hua_lu, hua_quan, hua_ke, hua_ji) of its own stem, placed on the natal
+branch of the star they transform, and each year gets the annual (liu)
+versions of the stem and branch driven stars listed in annual_stars.'''
+
+import numpy as np
+from attrs import define
+from src.purple_star_chart import _stems, _branches, _palace_names, _phase_names, _star_slots
+from src.purple_star_chart.star_engine import _RULES, _TRANSFORMS, _term_inputs, _term_value
+
+transform_names = list(_TRANSFORMS)
+
+# annual stars that follow the year stem, then the year branch, reusing the
+# natal rules for each
+_STEM_STARS = ['lu_cun', 'qing_yang', 'tuo_luo', 'tian_kui', 'tian_yue']
+_BRANCH_STARS = ['tian_ma', 'hong_luan', 'tian_xi']
+annual_stars = _STEM_STARS + _BRANCH_STARS
+
+def _rule_table(name, source, size):
+    '''branch of star name for every value of source ('ystem' or 'ybranch'),
+    from the natal rule that places it off that value alone'''
+    for star, base, step, const, direction in _RULES:
+        if star == name and set(_term_inputs(base) + _term_inputs(step)) == {source}:
+            return [(_term_value(base, {source: v}) + direction * (_term_value(step, {source: v}) + const)) % 12
+                    for v in range(size)]
+    raise ValueError(f'no {source} rule for {name}')
+
+# (10, 4) transformed star slot by stem
+_transform_slots = np.array([[_star_slots.index(targets[s]) for targets in _TRANSFORMS.values()]
+                             for s in range(10)], dtype=np.intp)
+_stem_stars = np.array([_rule_table(name, 'ystem', 10) for name in _STEM_STARS], dtype=np.int8).T
+_branch_stars = np.array([_rule_table(name, 'ybranch', 12) for name in _BRANCH_STARS], dtype=np.int8).T
+_annual_table = np.concatenate([np.repeat(_stem_stars[:, None], 12, axis=1),
+                                np.repeat(_branch_stars[None], 10, axis=0)], axis=2)
+
+def palace_stems(year_stem):
+    '''(n, 12) stem index of the palace on each branch, by natal year stem'''
+    start = ((np.asarray(year_stem, dtype=np.int64) % 5) * 2 + 2) % 10
+    return ((start[:, None] + (np.arange(12) - 2) % 12) % 10).astype(np.int8)
+
+@define
+class Lifespans:
+    '''per year overlays for a batch of charts. Every array is (charts, years)
+    or (charts, years, k), branches and stems as indices, -1 for none.'''
+    year: np.ndarray                # solar year
+    life: np.ndarray                # natal life palace branch, (charts,)
+    decade_life: np.ndarray         # decadal life palace branch
+    decade_stem: np.ndarray
+    decade_transforms: np.ndarray   # (charts, years, 4) branches, transform_names order
+    annual_life: np.ndarray         # annual life palace branch (the year branch)
+    annual_stem: np.ndarray
+    annual_transforms: np.ndarray   # (charts, years, 4)
+    annual_stars: np.ndarray        # (charts, years, len(annual_stars))
+
+    @classmethod
+    def from_placements(cls, placements, year_stem, birth_year, years=120):
+        '''overlays for years years from each chart's birth year. placements
+        is a star_engine.Placements, year_stem the natal year stem index'''
+        n = len(placements)
+        birth_year = np.broadcast_to(np.asarray(birth_year, dtype=np.int64), (n,))
+        age = np.arange(1, years + 1)
+        year = birth_year[:, None] + age - 1
+        life = placements.life.astype(np.int64)
+        stems = palace_stems(year_stem)
+        rows = np.arange(n)[:, None]
+
+        # decades: period k covers ages start + 10k .. start + 10k + 9
+        start = placements.phase.astype(np.int64) + 2
+        period = (age - start[:, None]) // 10
+        step = np.where(placements.traverse_back, -1, 1)[:, None]
+        decade_life = np.where(period >= 0, (life[:, None] + step * period) % 12, -1)
+        decade_stem = np.where(period >= 0, stems[rows, decade_life], -1)
+
+        cycle = (year - 4) % 60
+        annual_stem, annual_life = cycle % 10, cycle % 12
+        positions = placements.positions
+        decade_transforms = np.take_along_axis(positions, _transform_slots[decade_stem].reshape(n, -1), axis=1)
+        decade_transforms = np.where(period[..., None] >= 0, decade_transforms.reshape(n, years, 4), -1)
+        annual_transforms = np.take_along_axis(positions, _transform_slots[annual_stem].reshape(n, -1), axis=1)
+
+        return cls(
+            year.astype(np.int16),
+            life.astype(np.int8),
+            decade_life.astype(np.int8),
+            decade_stem.astype(np.int8),
+            decade_transforms.astype(np.int8),
+            annual_life.astype(np.int8),
+            annual_stem.astype(np.int8),
+            annual_transforms.reshape(n, years, 4).astype(np.int8),
+            _annual_table[annual_stem, annual_life]
+        )
+
+    @classmethod
+    def from_batch(cls, batch, years=120):
+        '''overlays for every row of a ChartBatch'''
+        birth_year = batch.bazi.solar_date.astype('datetime64[Y]').astype(np.int64) + 1970
+        return cls.from_placements(batch.placements, batch.bazi.year_stem, birth_year, years)
+
+    def __len__(self):
+        return len(self.year)
+
+    def overlay(self, i, n):
+        '''readable dict for chart i, year n of its lifespan (0 = birth year)'''
+        life = int(self.life[i])
+        palace = lambda br_loc: _palace_names[(br_loc - life) % 12]
+        decade = None
+        if self.decade_life[i, n] >= 0:
+            br_loc = int(self.decade_life[i, n])
+            decade = {
+                'palace': palace(br_loc),
+                'stem': _stems[self.decade_stem[i, n]],
+                'branch': _branches[br_loc],
+                'transforms': {name: palace(int(b)) for name, b in zip(transform_names, self.decade_transforms[i, n])}
+            }
+        br_loc = int(self.annual_life[i, n])
+        return {
+            'year': int(self.year[i, n]),
+            'age': n + 1,
+            'decade': decade,
+            'annual': {
+                'palace': palace(br_loc),
+                'stem': _stems[self.annual_stem[i, n]],
+                'branch': _branches[br_loc],
+                'transforms': {name: palace(int(b)) for name, b in zip(transform_names, self.annual_transforms[i, n])},
+                'stars': {name: palace(int(b)) for name, b in zip(annual_stars, self.annual_stars[i, n])}
+            }
+        }
+
+def lifespan(chart, years=120, birth_year=None):
+    '''Lifespans of one PurpleStarChart that has had add_stars run. birth_year
+    defaults to the chart's solar year (its lunar year for from_key charts).'''
+    from src.purple_star_chart.star_engine import Placements
+
+    if birth_year is None:
+        birth_year = chart.solar_date.year if chart.solar_date is not None else chart.lunar_date.year
+    chart._finish_lazy()
+    positions = np.array([chart._slot_branches()], dtype=np.uint8)
+    placed = Placements(
+        positions,
+        np.array([_branches.index(chart.palaces.life.pillar.branch.name)]),
+        np.array([_branches.index(chart.palaces.body.pillar.branch.name)]),
+        np.array([_phase_names.index(chart.elemental_phase)]),
+        np.array([chart._traverse_back]),
+        None,
+        None
+    )
+    return Lifespans.from_placements(placed, [_stems.index(chart.bazi.year.stem.name)], birth_year, years)
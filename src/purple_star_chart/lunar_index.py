@@ -0,0 +1,66 @@
+'''Fast gregorian to lunar date conversion.
+LunarDate.fromSolarDate walks year by year from 1900 on every call, which
+made it the slowest part of building a chart. This builds a table of the
+date ordinal each lunar month starts on, once at import, from the same
+year data lunardate uses, so a conversion is just a bisect.'''
+
+from bisect import bisect_right
+from datetime import date
+import lunardate
+from lunardate import LunarDate
+
+def _build_month_table():
+    starts, years, months, leaps = [], [], [], []
+    ordinal = date(1900, 1, 31).toordinal()
+    for year_loc, year_info in enumerate(lunardate.yearInfos):
+        for month, days, is_leap in LunarDate._enumMonth(year_info):
+            starts.append(ordinal)
+            years.append(1900 + year_loc)
+            months.append(month)
+            leaps.append(bool(is_leap))
+            ordinal += days
+    # one past the last supported day
+    starts.append(ordinal)
+    return starts, years, months, leaps
+
+# date ordinal of the first day of every lunar month lunardate knows about,
+# with the lunar year, month number and leap flag for each
+_month_starts, _month_years, _month_numbers, _month_leaps = _build_month_table()
+
+first_date = date.fromordinal(_month_starts[0])
+last_date = date.fromordinal(_month_starts[-1] - 1)
+
+def month_loc(solar_date):
+    '''index into the month table for a date (or datetime)'''
+    ordinal = solar_date.toordinal()
+    loc = bisect_right(_month_starts, ordinal) - 1
+    if loc < 0 or loc >= len(_month_years):
+        raise ValueError(f'{solar_date} is outside the supported range {first_date} to {last_date}')
+    return loc
+
+def lunar_from_solar(solar_date):
+    '''drop-in for LunarDate.fromSolarDate that takes a date or datetime'''
+    loc = month_loc(solar_date)
+    day = solar_date.toordinal() - _month_starts[loc] + 1
+    return LunarDate(_month_years[loc], _month_numbers[loc], day, _month_leaps[loc])
+
+def verify_against_lunardate():
+    '''converts every supported day both ways and returns the dates where
+    this table and lunardate disagree (should be empty)'''
+    mismatches = []
+    for ordinal in range(_month_starts[0], _month_starts[-1]):
+        this_date = date.fromordinal(ordinal)
+        ours = lunar_from_solar(this_date)
+        theirs = LunarDate.fromSolarDate(this_date.year, this_date.month, this_date.day)
+        ours_t = (ours.year, ours.month, ours.day, ours.isLeapMonth)
+        theirs_t = (theirs.year, theirs.month, theirs.day, theirs.isLeapMonth)
+        if ours_t != theirs_t:
+            mismatches.append(this_date)
+    return mismatches
+
+if __name__ == '__main__':
+    bad = verify_against_lunardate()
+    total = _month_starts[-1] - _month_starts[0]
+    print(f'checked {total} days from {first_date} to {last_date}, {len(bad)} mismatches')
+    for this_date in bad[:20]:
+        print(this_date)
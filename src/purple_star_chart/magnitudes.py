@@ -0,0 +1,55 @@
+'''Star magnitudes (brightness), by star and the branch it lands on.
+Brightness is only charted for the 14 major stars and the six stars below;
+everything else stays None. The table is expanded once at import into a
+star slot by branch matrix of codes (0 for none, otherwise index into
+_magnitude_names + 1, the same codes chart_codec stores), so a chart is
+one lookup per slot and a whole batch is one numpy gather.'''
+
+from src.purple_star_chart import _branches, _star_slots, _stage_slots, _magnitude_names
+
+# zi through hai
+_magnitudes = {
+    'zi_wei': ('miao', 'miao', 'wang', 'wang', 'de', 'wang', 'miao', 'miao', 'wang', 'wang', 'de', 'wang'),
+    'tian_ji': ('miao', 'xian', 'de', 'wang', 'li', 'ping', 'miao', 'xian', 'de', 'wang', 'li', 'ping'),
+    'tai_yang': ('xian', 'bu', 'wang', 'miao', 'wang', 'wang', 'wang', 'de', 'de', 'xian', 'bu', 'xian'),
+    'wu_qu': ('wang', 'miao', 'de', 'li', 'miao', 'ping', 'wang', 'miao', 'de', 'li', 'miao', 'ping'),
+    'tian_tong': ('wang', 'bu', 'li', 'ping', 'ping', 'miao', 'xian', 'bu', 'wang', 'ping', 'ping', 'miao'),
+    'lian_zhen': ('ping', 'li', 'miao', 'ping', 'li', 'xian', 'ping', 'li', 'miao', 'ping', 'li', 'xian'),
+    'tian_fu': ('miao', 'miao', 'miao', 'de', 'miao', 'de', 'wang', 'miao', 'de', 'wang', 'miao', 'de'),
+    'tai_yin': ('miao', 'miao', 'wang', 'xian', 'xian', 'xian', 'bu', 'bu', 'li', 'bu', 'wang', 'miao'),
+    'tan_lang': ('wang', 'miao', 'ping', 'li', 'miao', 'xian', 'wang', 'miao', 'ping', 'li', 'miao', 'xian'),
+    'ju_men': ('wang', 'bu', 'miao', 'miao', 'xian', 'wang', 'wang', 'bu', 'miao', 'miao', 'xian', 'wang'),
+    'tian_xiang': ('miao', 'miao', 'miao', 'xian', 'de', 'de', 'miao', 'de', 'miao', 'xian', 'de', 'de'),
+    'tian_liang': ('miao', 'wang', 'miao', 'miao', 'miao', 'xian', 'miao', 'wang', 'xian', 'de', 'miao', 'xian'),
+    'qi_sha': ('wang', 'miao', 'miao', 'wang', 'miao', 'ping', 'wang', 'miao', 'miao', 'miao', 'miao', 'ping'),
+    'po_jun': ('miao', 'wang', 'de', 'xian', 'wang', 'ping', 'miao', 'wang', 'de', 'xian', 'wang', 'ping'),
+    'wen_chang': ('de', 'miao', 'xian', 'li', 'de', 'miao', 'xian', 'li', 'de', 'miao', 'xian', 'li'),
+    'wen_qu': ('de', 'miao', 'ping', 'wang', 'de', 'miao', 'xian', 'wang', 'de', 'miao', 'xian', 'wang'),
+    'huo_xing': ('xian', 'de', 'miao', 'li', 'xian', 'de', 'miao', 'li', 'xian', 'de', 'miao', 'li'),
+    'ling_xing': ('xian', 'de', 'miao', 'li', 'xian', 'de', 'miao', 'li', 'xian', 'de', 'miao', 'li'),
+    'qing_yang': ('xian', 'miao', None, 'xian', 'miao', None, 'xian', 'miao', None, 'xian', 'miao', None),
+    'tuo_luo': (None, 'miao', 'xian', None, 'miao', 'xian', None, 'miao', 'xian', None, 'miao', 'xian')
+}
+
+# the year stem tian_fu shares its name with the major star but is a
+# different star with no brightness, so the table goes by slot, not name
+_majors = _stage_slots['_plot_ziwei'] + _stage_slots['_plot_major_stars']
+_no_magnitudes = (None,) * 12
+slot_names = tuple(_no_magnitudes if slot >= len(_majors) and name in _majors else _magnitudes.get(name, _no_magnitudes)
+                   for slot, name in enumerate(_star_slots))
+# row major (slot, branch) codes
+slot_codes = bytes(0 if m is None else _magnitude_names.index(m) + 1 for row in slot_names for m in row)
+
+def magnitude(star_name, branch):
+    '''magnitude name of a star on a branch (name or index), None if the
+    star has no brightness; tian_fu means the major star'''
+    br_loc = _branches.index(branch) if isinstance(branch, str) else branch
+    return _magnitudes.get(star_name, _no_magnitudes)[br_loc]
+
+def magnitude_codes(positions):
+    '''magnitude codes for an (n, len(_star_slots)) array of slot branches,
+    like Placements.positions'''
+    import numpy as np
+
+    table = np.frombuffer(slot_codes, dtype=np.uint8).reshape(len(_star_slots), 12)
+    return table[np.arange(len(_star_slots)), positions]
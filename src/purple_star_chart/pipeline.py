@@ -0,0 +1,239 @@
+'''Streaming batch pipeline for charting large birth record files.
+Records (a datetime and a gender per row) are read lazily from csv or jsonl,
+cut into chunks, and fanned out to a process pool where each chunk is
+charted in one go with ChartBatch. Results are written back in input order,
+either as jsonl (one PurpleStarChart.to_dict per line) or as a directory of
+flat columnar arrays. Only a bounded number of chunks are ever in flight,
+so memory stays flat no matter how big the input is, and a bad record only
+produces an error entry for itself.'''
+
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+import numpy as np
+from attrs import define, field
+from src.purple_star_chart import _star_slots
+from src.purple_star_chart.chart_batch import ChartBatch
+from src.purple_star_chart.records import read_records, parse_record
+from src.purple_star_chart.shared_tables import init_worker, publish
+
+@define
+class PipelineStats:
+    records: int = 0
+    charts: int = 0
+    errors: int = 0
+
+def _error(num, err):
+    return {'record': num, 'error': f'{type(err).__name__}: {err}'}
+
+def _batch_rows(nums, dts, genders, build=ChartBatch.from_solar_dates):
+    '''ChartBatch (or whatever build makes) over the parsed rows; if the batch
+    as a whole blows up, fall back to one row at a time so only the bad rows
+    turn into errors'''
+    try:
+        return [(nums, build(dts, genders))], []
+    except Exception:
+        batches, errors = [], []
+        for num, dt, gender in zip(nums, dts, genders):
+            try:
+                batches.append(([num], build([dt], [gender])))
+            except Exception as err:
+                errors.append(_error(num, err))
+        return batches, errors
+
+def chart_chunk(chunk, out_fmt='jsonl', dt_field='datetime', gender_field='gender'):
+    '''charts one chunk of (record number, record) pairs. Runs in the worker
+    processes; jsonl output comes back already encoded so the parent only
+    has to write it.'''
+    nums, dts, genders, errors = [], [], [], []
+    for num, record in chunk:
+        try:
+            solar_dt, gender = parse_record(record, dt_field, gender_field)
+        except (ValueError, TypeError, AttributeError) as err:
+            errors.append(_error(num, err))
+            continue
+        nums.append(num)
+        dts.append(solar_dt)
+        genders.append(gender)
+
+    batches, batch_errors = _batch_rows(nums, dts, genders) if nums else ([], [])
+    errors += batch_errors
+    if out_fmt == 'columnar':
+        return [(batch_nums, _columns(batch)) for batch_nums, batch in batches], errors
+
+    lines = [(e['record'], json.dumps(e)) for e in errors]
+    for batch_nums, batch in batches:
+        for i, num in enumerate(batch_nums):
+            lines.append((num, json.dumps({'record': num, **batch.to_dict(i)})))
+    lines.sort()
+    return ''.join(line + '\n' for _, line in lines), len(errors)
+
+def _columns(batch):
+    placed = batch.placements
+    return {
+        'key': batch.key_index().astype(np.uint32),
+        'bazi': batch.bazi.pillar_codes(),
+        'lunar_leap': batch.bazi.lunar_leap.astype(np.uint8),
+        'life': placed.life,
+        'body': placed.body,
+        'phase': placed.phase,
+        'life_master': placed.life_master,
+        'body_master': placed.body_master,
+        'positions': placed.positions
+    }
+
+@define
+class _JsonlWriter:
+    dest: object
+    stats: PipelineStats
+    _file: object = field(init=False)
+
+    def __attrs_post_init__(self):
+        self._file = open(self.dest, 'w') if isinstance(self.dest, (str, os.PathLike)) else self.dest
+
+    def write(self, result):
+        text, n_errors = result
+        self._file.write(text)
+        self.stats.errors += n_errors
+        self.stats.charts += text.count('\n') - n_errors
+
+    def close(self):
+        if self._file is not self.dest:
+            self._file.close()
+        else:
+            self._file.flush()
+
+@define
+class _ColumnarWriter:
+    dest: str
+    stats: PipelineStats
+    _files: dict = field(init=False, factory=dict)
+    _shapes: dict = field(init=False, factory=dict)
+    _errors: object = field(init=False)
+
+    def __attrs_post_init__(self):
+        os.makedirs(self.dest, exist_ok=True)
+        self._errors = open(os.path.join(self.dest, 'errors.jsonl'), 'w')
+
+    def _write_col(self, name, arr):
+        if name not in self._files:
+            self._files[name] = open(os.path.join(self.dest, name + '.bin'), 'wb')
+            self._shapes[name] = (str(arr.dtype), list(arr.shape[1:]))
+        self._files[name].write(np.ascontiguousarray(arr).tobytes())
+
+    def write(self, result):
+        batches, errors = result
+        for err in errors:
+            self._errors.write(json.dumps(err) + '\n')
+        self.stats.errors += len(errors)
+        for nums, cols in batches:
+            self._write_col('record', np.array(nums, dtype=np.int64))
+            for name, arr in cols.items():
+                self._write_col(name, arr)
+            self.stats.charts += len(nums)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._errors.close()
+        manifest = {
+            'rows': self.stats.charts,
+            'columns': {name: {'dtype': dtype, 'shape': [self.stats.charts] + inner}
+                        for name, (dtype, inner) in self._shapes.items()},
+            'star_slots': _star_slots
+        }
+        with open(os.path.join(self.dest, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+def read_columnar(path):
+    '''memory-maps every column written by a columnar pipeline run'''
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    out = {}
+    for name, spec in manifest['columns'].items():
+        out[name] = np.memmap(os.path.join(path, name + '.bin'), dtype=spec['dtype'], mode='r',
+                              shape=tuple(spec['shape']))
+    return out
+
+def _chunks(source, in_fmt, chunk_size):
+    records = enumerate(read_records(source, in_fmt))
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def map_chunks(fn, source, in_fmt=None, workers=None, chunk_size=10000, max_pending=None, initializer=None):
+    '''lazily yields (fn(chunk), chunk length) for each chunk of (record
+    number, record) pairs read from source, in input order. fn runs in this
+    process if workers=0, otherwise across a process pool (all cores by
+    default) with at most max_pending chunks (2 per worker by default) in
+    flight, so fn has to be picklable. initializer, if given, runs once in
+    each worker (or here, with workers=0) first; here, any key table it
+    installs (see shared_tables.init_worker) is taken down again after.'''
+    _check_chunk_size(chunk_size)
+    return _map_chunks(fn, source, in_fmt, workers, chunk_size, max_pending, initializer)
+
+def _check_chunk_size(chunk_size):
+    if chunk_size < 1:
+        raise ValueError(f'chunk_size has to be at least 1, got {chunk_size}')
+
+def _map_chunks(fn, source, in_fmt, workers, chunk_size, max_pending, initializer):
+    if workers == 0:
+        from src.purple_star_chart import star_engine
+        key_table = star_engine._key_table
+        try:
+            if initializer is not None:
+                initializer()
+            for chunk in _chunks(source, in_fmt, chunk_size):
+                yield fn(chunk), len(chunk)
+        finally:
+            star_engine.use_key_table(key_table)
+        return
+    max_pending = max_pending or 2 * (workers or os.cpu_count())
+    with ProcessPoolExecutor(workers, initializer=initializer) as pool:
+        pending = deque()
+        for chunk in _chunks(source, in_fmt, chunk_size):
+            pending.append((pool.submit(fn, chunk), len(chunk)))
+            while len(pending) >= max_pending:
+                future, n_records = pending.popleft()
+                yield future.result(), n_records
+        while pending:
+            future, n_records = pending.popleft()
+            yield future.result(), n_records
+
+def run_pipeline(source, dest, out_fmt='jsonl', in_fmt=None, workers=None, chunk_size=10000,
+                 max_pending=None, dt_field='datetime', gender_field='gender', progress=None, shared_tables=False):
+    '''charts every record in source and writes them to dest in input order.
+    workers=0 does everything in this process; otherwise chunks go to a
+    process pool (all cores by default) with at most max_pending chunks
+    (2 per worker by default) in flight at once. progress, if given, is
+    called with the running PipelineStats after each chunk is written.
+    shared_tables=True has the workers look placements up in the host's
+    shared placement table (see shared_tables) instead of computing them.'''
+    _check_chunk_size(chunk_size)
+    stats = PipelineStats()
+    if out_fmt == 'jsonl':
+        writer = _JsonlWriter(dest, stats)
+    elif out_fmt == 'columnar':
+        writer = _ColumnarWriter(dest, stats)
+    else:
+        raise ValueError(f'unknown output format {out_fmt}')
+    fn = partial(chart_chunk, out_fmt=out_fmt, dt_field=dt_field, gender_field=gender_field)
+    initializer = None
+    if shared_tables:
+        publish('placements')
+        initializer = init_worker
+
+    try:
+        for result, n_records in map_chunks(fn, source, in_fmt, workers, chunk_size, max_pending, initializer):
+            writer.write(result)
+            stats.records += n_records
+            if progress is not None:
+                progress(stats)
+        return stats
+    finally:
+        writer.close()
@@ -0,0 +1,245 @@
+'''Distributions over whole populations of charts, without building any
+PurpleStarCharts. PopulationStats is a fixed-shape set of counters (star by
+palace, star by branch, elemental phase by year branch, body palace, life
+and body masters) filled straight from star engine placements, so it can be
+fed chunk after chunk of ChartBatches, ChartKeys or key indices:
+
+    stats = collect(batches)             # or PopulationStats().add(chunk)
+    stats.star_palace[_star_slots.index('zi_wei')] / stats.total
+
+Partials from different processes or machines add up with merge() (or +),
+and round trip through to_dict() / from_dict() or save() / load(), so big
+jobs can be sharded and reduced map-reduce style; collect_records() does
+that across a process pool for a record file, via pipeline.map_chunks.
+
+The same numbers come out analytically from the chart key space: every
+chart is one of N_KEYS keys, so key_weights() counts how many births land on
+each key for a range of dates (or any per-date counts you have) and
+from_key_weights() weights one placement per key by that, with no per-birth
+work at all.
+
+Counters are float64 so weighted counts work too; star rows are indexed by
+slot (see _star_slots), so a star name that's placed twice, like tian_fu,
+has a row per placement.'''
+
+import json
+from datetime import datetime
+from functools import partial
+import numpy as np
+from attrs import define, field, fields
+from src.purple_star_chart import _genders, _palace_names, _phase_names, _star_slots
+from src.purple_star_chart.bazi_batch import lunar_arrays
+from src.purple_star_chart.chart_batch import ChartBatch
+from src.purple_star_chart.chart_index import _solar_years
+from src.purple_star_chart.chart_key import ChartKey, N_KEYS, _key_shape, cycle_from_pillar
+from src.purple_star_chart.lunar_index import first_date, last_date
+from src.purple_star_chart.star_engine import place
+
+_n_slots = len(_star_slots)
+
+def _zeros(*shape):
+    return field(factory=lambda: np.zeros(shape))
+
+@define
+class PopulationStats:
+    star_palace: np.ndarray = _zeros(_n_slots, 12)         # [slot, palace], palace as in _palace_names
+    star_branch: np.ndarray = _zeros(_n_slots, 12)         # [slot, branch]
+    phase_year_branch: np.ndarray = _zeros(len(_phase_names), 12)
+    body_palace: np.ndarray = _zeros(12)
+    life_master: np.ndarray = _zeros(_n_slots)             # by slot of the master star
+    body_master: np.ndarray = _zeros(_n_slots)
+    gender: np.ndarray = _zeros(len(_genders))
+    total: float = 0.0
+
+    def add_placements(self, placements, year, weights=None):
+        '''counts placements (star_engine.Placements) whose 60 cycle year
+        positions are year; weights, if given, is one weight per chart.
+        Placements don't know their gender, so that's left to the callers.'''
+        n = len(placements)
+        if n == 0:
+            return self
+        year = np.broadcast_to(np.asarray(year, dtype=np.int64), (n,))
+        w = None if weights is None else np.broadcast_to(np.asarray(weights, dtype=np.float64), (n,))
+        life = placements.life.astype(np.int64)
+        positions = placements.positions.astype(np.int64)
+        slot_base = np.arange(_n_slots) * 12
+        slot_w = None if w is None else np.broadcast_to(w[:, None], positions.shape).ravel()
+
+        def count(codes, size, weights=w):
+            return np.bincount(codes.ravel(), weights, minlength=size)
+
+        self.star_branch += count(slot_base + positions, _n_slots * 12, slot_w).reshape(_n_slots, 12)
+        self.star_palace += count(slot_base + (positions - life[:, None]) % 12, _n_slots * 12, slot_w).reshape(_n_slots, 12)
+        self.phase_year_branch += count(placements.phase.astype(np.int64) * 12 + year % 12,
+                                        len(_phase_names) * 12).reshape(len(_phase_names), 12)
+        self.body_palace += count((placements.body.astype(np.int64) - life) % 12, 12)
+        self.life_master += count(placements.life_master.astype(np.int64), _n_slots)
+        self.body_master += count(placements.body_master.astype(np.int64), _n_slots)
+        self.total += float(n if w is None else w.sum())
+        return self
+
+    def add_key_indices(self, indices, weights=None):
+        '''counts charts given as ChartKey.index() values'''
+        year, month, day, hour, gender = np.unravel_index(np.asarray(indices, dtype=np.int64), _key_shape)
+        self.gender += np.bincount(gender, weights, minlength=len(_genders))
+        return self.add_placements(place(year, month + 1, day + 1, hour, gender), year, weights)
+
+    def add_keys(self, keys, weights=None):
+        return self.add_key_indices([key.index() for key in keys], weights)
+
+    def add_batch(self, batch, weights=None):
+        year = cycle_from_pillar(batch.bazi.year_stem.astype(np.int64), batch.bazi.year_branch.astype(np.int64))
+        self.gender += np.bincount(batch.gender.astype(np.int64), weights, minlength=len(_genders))
+        return self.add_placements(batch.placements, year, weights)
+
+    def add(self, chunk, weights=None):
+        '''counts one chunk of charts: a ChartBatch, an array of key indices,
+        or a list of ChartKeys or PurpleStarCharts'''
+        if isinstance(chunk, ChartBatch):
+            return self.add_batch(chunk, weights)
+        if isinstance(chunk, np.ndarray):
+            return self.add_key_indices(chunk, weights)
+        chunk = list(chunk)
+        if chunk and not isinstance(chunk[0], ChartKey):
+            chunk = [chart.key for chart in chunk]
+        return self.add_keys(chunk, weights)
+
+    @classmethod
+    def from_key_weights(cls, weights, chunk_size=1 << 16):
+        '''analytic stats: every key in the key space counted weights[key
+        index] times, e.g. with weights from key_weights()'''
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.shape != (N_KEYS,):
+            raise ValueError(f'need one weight per chart key ({N_KEYS}), got shape {weights.shape}')
+        stats = cls()
+        keys = np.flatnonzero(weights)
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            stats.add_key_indices(chunk, weights[chunk])
+        return stats
+
+    def merge(self, other):
+        '''adds other's counts into this one'''
+        for f in fields(PopulationStats):
+            setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+        return self
+
+    def copy(self):
+        return PopulationStats(*(np.copy(getattr(self, f.name)) if f.name != 'total' else self.total
+                                 for f in fields(PopulationStats)))
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def to_dict(self):
+        '''plain dict of lists, e.g. for json'''
+        out = {f.name: getattr(self, f.name) for f in fields(PopulationStats)}
+        return {name: value.tolist() if isinstance(value, np.ndarray) else value for name, value in out.items()}
+
+    @classmethod
+    def from_dict(cls, d):
+        values = {}
+        for f in fields(PopulationStats):
+            default = getattr(cls(), f.name)
+            if isinstance(default, np.ndarray):
+                value = np.array(d[f.name], dtype=np.float64)
+                if value.shape != default.shape:
+                    raise ValueError(f'{f.name} should have shape {default.shape}, got {value.shape}')
+                values[f.name] = value
+            else:
+                values[f.name] = float(d[f.name])
+        return cls(**values)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def summary(self):
+        '''readable dict of the named distributions, as fractions of total'''
+        total = self.total or 1.0
+        by_name = lambda counts, names: {name: float(counts[i] / total) for i, name in enumerate(names) if counts[i]}
+        return {
+            'total': self.total,
+            'gender': by_name(self.gender, _genders),
+            'phase': by_name(self.phase_year_branch.sum(axis=1), _phase_names),
+            'body_palace': by_name(self.body_palace, _palace_names),
+            'life_master': by_name(self.life_master, _star_slots),
+            'body_master': by_name(self.body_master, _star_slots),
+            'star_palace': {name: by_name(self.star_palace[slot], _palace_names)
+                            for slot, name in enumerate(_star_slots)}
+        }
+
+def collect(chunks):
+    '''streaming reducer: one PopulationStats over an iterable of chunks
+    (anything PopulationStats.add takes)'''
+    stats = PopulationStats()
+    for chunk in chunks:
+        stats.add(chunk)
+    return stats
+
+def stats_chunk(chunk, dt_field='datetime', gender_field='gender'):
+    '''PopulationStats for one chunk of (record number, record) pairs, plus
+    the number of records that couldn't be read. Runs in pipeline workers.'''
+    from src.purple_star_chart.pipeline import _batch_rows
+    from src.purple_star_chart.records import parse_record
+    nums, dts, genders, skipped = [], [], [], 0
+    for num, record in chunk:
+        try:
+            solar_dt, gender = parse_record(record, dt_field, gender_field)
+        except (ValueError, TypeError, AttributeError):
+            skipped += 1
+            continue
+        nums.append(num)
+        dts.append(solar_dt)
+        genders.append(gender)
+    stats = PopulationStats()
+    batches, errors = _batch_rows(nums, dts, genders) if nums else ([], [])
+    for _, batch in batches:
+        stats.add_batch(batch)
+    return stats, skipped + len(errors)
+
+def collect_records(source, in_fmt=None, workers=None, chunk_size=10000, dt_field='datetime',
+                    gender_field='gender'):
+    '''(PopulationStats, records skipped) for every record in a csv or jsonl
+    source, chunks counted across a process pool and merged as they come in'''
+    from src.purple_star_chart.pipeline import map_chunks
+    fn = partial(stats_chunk, dt_field=dt_field, gender_field=gender_field)
+    stats, skipped = PopulationStats(), 0
+    for (partial_stats, chunk_skipped), _ in map_chunks(fn, source, in_fmt, workers, chunk_size):
+        stats.merge(partial_stats)
+        skipped += chunk_skipped
+    return stats, skipped
+
+def key_weights(date_counts=None, start=first_date, end=last_date, male_share=0.5):
+    '''births per chart key, as an N_KEYS array. date_counts maps dates to
+    numbers of births (all dates from start to end count 1 if not given);
+    each day's births are spread evenly over the 24 hours and split by
+    male_share, and land on keys the way BaZiChart.from_solar_date puts
+    them (solar year for the year pillar, 23:00 as zi hour of the same day).'''
+    if date_counts is None:
+        start, end = max(start, first_date), min(end, last_date)
+        ordinals = np.arange(start.toordinal(), end.toordinal() + 1)
+        counts = np.ones(len(ordinals))
+    else:
+        items = sorted(date_counts.items())
+        ordinals = np.array([(d.date() if isinstance(d, datetime) else d).toordinal() for d, _ in items],
+                            dtype=np.int64)
+        counts = np.array([c for _, c in items], dtype=np.float64)
+    weights = np.zeros(N_KEYS)
+    if len(ordinals) == 0:
+        return weights
+    _, lmonth, lday, _ = lunar_arrays(ordinals)
+    ycycle = (_solar_years(ordinals) - 4) % 60
+    day_base = ((ycycle * 12 + lmonth.astype(np.int64) - 1) * 30 + lday.astype(np.int64) - 1) * 12
+    # zi hour is 00-01 plus 23-24, so every branch gets 2 of the 24 hours
+    hour_keys = ((day_base[:, None] + np.arange(12)[None, :]) * 2).ravel()
+    hour_counts = np.repeat(counts / 12, 12)
+    np.add.at(weights, hour_keys, hour_counts * male_share)
+    np.add.at(weights, hour_keys + 1, hour_counts * (1 - male_share))
+    return weights
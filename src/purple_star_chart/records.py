@@ -0,0 +1,65 @@
+'''Reading and validating birth records (a datetime and a gender per row)
+from csv or jsonl. Kept free of numpy and the chart modules so anything that
+only needs to parse input, like a one-off cli call, stays quick to import.'''
+
+import csv
+import json
+import os
+from datetime import datetime
+from src.purple_star_chart import _genders
+from src.purple_star_chart.lunar_index import first_date, last_date
+
+def _open_text(source):
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, newline='')
+    return source
+
+def guess_format(path, default='jsonl'):
+    if isinstance(path, (str, os.PathLike)):
+        ext = os.path.splitext(str(path))[1].lower()
+        if ext == '.csv':
+            return 'csv'
+        if ext in ('.jsonl', '.json', '.ndjson'):
+            return 'jsonl'
+    return default
+
+def read_records(source, fmt=None):
+    '''lazily yields one dict per record from a csv (with a header row) or
+    jsonl file; source is a path or an open text file'''
+    fmt = fmt or guess_format(source)
+    f = _open_text(source)
+    try:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        elif fmt == 'jsonl':
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as err:
+                    # keep going; the bad line becomes an error record
+                    yield {'_error': f'bad json: {err}'}
+        else:
+            raise ValueError(f'unknown input format {fmt}')
+    finally:
+        if f is not source:
+            f.close()
+
+def parse_record(record, dt_field='datetime', gender_field='gender'):
+    '''(datetime, gender) from a raw record, or ValueError saying why not'''
+    if '_error' in record:
+        raise ValueError(record['_error'])
+    raw_dt = record.get(dt_field)
+    if raw_dt is None:
+        raise ValueError(f'missing {dt_field}')
+    solar_dt = raw_dt if isinstance(raw_dt, datetime) else datetime.fromisoformat(str(raw_dt).strip())
+    if solar_dt.tzinfo is not None:
+        raise ValueError('timezone aware datetimes are not supported')
+    if not first_date <= solar_dt.date() <= last_date:
+        raise ValueError(f'{solar_dt} is outside the supported range {first_date} to {last_date}')
+    gender = str(record.get(gender_field, '')).strip().lower()
+    if gender not in _genders:
+        raise ValueError(f'gender must be one of {_genders}, got {gender!r}')
+    return solar_dt, gender
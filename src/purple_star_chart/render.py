@@ -0,0 +1,352 @@
+'''Drawing finished charts: the traditional 4 x 4 board of twelve palaces, as
+SVG, an HTML page around the SVG, or plain text for terminals.
+
+Each palace sits on its branch's fixed square (si top left, going clockwise
+round to chen) and shows its name, pillar, body palace flag and stars, with
+magnitudes where they're known and L / B marking the life and body masters.
+The middle four squares hold the birth data, BaZi pillars and phase.
+
+Everything is drawn from a ChartView, the plain strings for one chart, which
+comes from a PurpleStarChart (walking PSPalaces) or straight from a
+ChartBatch row without building a chart. The SVG layout is worked out once
+when the module is imported: every square, header and star line position is
+baked into a string fragment, so drawing a chart only joins fragments and
+fills in names.
+
+export() streams rendered charts for a whole record file into a directory,
+zip or tar, charted and drawn on a process pool via pipeline.map_chunks.'''
+
+import io
+import json
+import os
+import tarfile
+import time
+import zipfile
+from functools import partial
+from html import escape
+from attrs import define
+from src.purple_star_chart import _stems, _branches, _palace_names, _star_slots, _stage_slots
+from src.purple_star_chart.magnitudes import slot_names as _slot_magnitudes
+
+# (row, column) of each branch's square, in branch order from zi
+_squares = [(3, 2), (3, 1), (3, 0), (2, 0), (1, 0), (0, 0), (0, 1), (0, 2), (0, 3), (1, 3), (2, 3), (3, 3)]
+_n_majors = len(_stage_slots['_plot_ziwei']) + len(_stage_slots['_plot_major_stars'])
+_MAX_STARS = 18  # most stars any palace gets, over the whole key space
+
+def _star_kind(slot):
+    if slot < _n_majors:
+        return 'major'
+    if _star_slots[slot].startswith('hua_'):
+        return 'transform'
+    return 'minor'
+
+def _pretty(name):
+    return name.replace('_', ' ').title()
+
+# (kind, label, magnitude) for every slot on every branch, for batch rows
+_slot_stars = [[(_star_kind(slot), _pretty(name), _slot_magnitudes[slot][br_loc] or '') for br_loc in range(12)]
+               for slot, name in enumerate(_star_slots)]
+
+@define
+class ChartView:
+    '''the strings a renderer draws for one chart. cells is indexed by branch:
+    (palace name, pillar, is body palace, stars), with stars as (kind, label,
+    magnitude, marks) tuples in placement order. info is (label, value)
+    pairs for the middle of the board.'''
+    cells: list
+    info: list
+
+    @classmethod
+    def from_chart(cls, chart):
+        '''from a PurpleStarChart that has had add_stars run'''
+        kinds = {id(star): _star_kind(slot) for slot, star in enumerate(chart._slot_stars())}
+        cells = [None] * 12
+        masters = {}
+        for name in _palace_names:
+            palace = getattr(chart.palaces, name)
+            stars = []
+            for star in palace.stars:
+                marks = ('L' if star.isLifeMaster else '') + ('B' if star.isBodyMaster else '')
+                if star.isLifeMaster:
+                    masters['life'] = star.pretty_str()
+                if star.isBodyMaster:
+                    masters['body'] = star.pretty_str()
+                stars.append((kinds[id(star)], star.pretty_str(), star.magnitude or '', marks))
+            pillar = palace.pillar
+            pillar_str = f'{pillar.stem.name.title()} {pillar.branch.name.title()}'
+            cells[_branches.index(pillar.branch.name)] = (name.title(), pillar_str, palace.is_bodypalace, stars)
+        bazi = chart.bazi
+        pillars = [p for p in (bazi.year, bazi.month, bazi.day, bazi.hour) if p is not None and p.stem is not None]
+        ldate = chart.lunar_date
+        return cls(cells, _info(chart.solar_date, ldate.year, ldate.month, ldate.day, ldate.isLeapMonth, chart.gender,
+                                ' '.join(f'{p.stem.name.title()}-{p.branch.name.title()}' for p in pillars),
+                                chart.elemental_phase, masters.get('life'), masters.get('body')))
+
+    @classmethod
+    def from_batch(cls, batch, i):
+        '''from row i of a ChartBatch, without building the chart'''
+        from src.purple_star_chart import _genders, _phase_names
+
+        placed = batch.placements
+        life = int(placed.life[i])
+        body = int(placed.body[i])
+        palace_start = ((int(batch.bazi.year_stem[i]) % 5) * 2 + 2) % 10
+        cells = [None] * 12
+        for distance, name in enumerate(_palace_names):
+            br_loc = (life + distance) % 12
+            pillar = f'{_stems[(palace_start + (br_loc - 2) % 12) % 10].title()} {_branches[br_loc].title()}'
+            cells[br_loc] = (name.title(), pillar, br_loc == body, [])
+        lm_slot, bm_slot = int(placed.life_master[i]), int(placed.body_master[i])
+        for slot, br_loc in enumerate(placed.positions[i].tolist()):
+            star = _slot_stars[slot][br_loc]
+            if slot == lm_slot or slot == bm_slot:
+                star = star + (('L' if slot == lm_slot else '') + ('B' if slot == bm_slot else ''),)
+            else:
+                star = star + ('',)
+            cells[br_loc][3].append(star)
+        bazi = batch.bazi
+        stem_branch = [(_stems[getattr(bazi, p + '_stem')[i]], _branches[getattr(bazi, p + '_branch')[i]])
+                       for p in ('year', 'month', 'day', 'hour')]
+        pillars = ' '.join(f'{stem.title()}-{branch.title()}' for stem, branch in stem_branch)
+        return cls(cells, _info(bazi.solar_date[i].item(), int(bazi.lunar_year[i]), int(bazi.lunar_month[i]),
+                                int(bazi.lunar_day[i]), bool(bazi.lunar_leap[i]), _genders[batch.gender[i]], pillars,
+                                _phase_names[placed.phase[i]], _pretty(_star_slots[lm_slot]),
+                                _pretty(_star_slots[bm_slot])))
+
+    @classmethod
+    def of(cls, chart):
+        return chart if isinstance(chart, ChartView) else cls.from_chart(chart)
+
+def _info(solar_dt, lyear, lmonth, lday, leap, gender, pillars, phase, life_master, body_master):
+    born = solar_dt.isoformat(sep=' ', timespec='minutes') if solar_dt is not None else '-'
+    return [
+        ('born', born),
+        ('lunar', f'{lyear}-{lmonth:02d}{"L" if leap else ""}-{lday:02d}'),
+        ('gender', gender),
+        ('bazi', pillars or '-'),
+        ('phase', phase),
+        ('life master', life_master or '-'),
+        ('body master', body_master or '-')
+    ]
+
+# SVG layout, compiled once. Squares are _CELL_W x _CELL_H, star lines go
+# down two columns of _ROWS each.
+_CELL_W, _CELL_H = 320, 240
+_PAD, _LINE_H, _ROWS = 12, 20, _MAX_STARS // 2
+_WIDTH, _HEIGHT = 4 * _CELL_W, 4 * _CELL_H
+
+_STYLE = '''
+text { font-family: sans-serif; font-size: 13px; fill: #222; }
+.square { fill: #fff; stroke: #444; }
+.body { fill: #fbf5e6; }
+.palace { font-weight: bold; font-size: 15px; }
+.pillar { fill: #555; }
+.major { font-weight: bold; fill: #7a1712; }
+.transform { fill: #1d4f91; }
+.mag { fill: #888; font-size: 11px; }
+.mark { fill: #c0392b; font-weight: bold; font-size: 11px; }
+.title { font-size: 18px; font-weight: bold; }
+.label { fill: #777; }
+'''
+
+def _compile_svg():
+    head = (f'<svg xmlns="http://www.w3.org/2000/svg" width="{_WIDTH}" height="{_HEIGHT}" '
+            f'viewBox="0 0 {_WIDTH} {_HEIGHT}"><style>{_STYLE}</style>')
+    squares, headers, star_lines = [], [], []
+    for row, col in _squares:
+        x, y = col * _CELL_W, row * _CELL_H
+        squares.append((f'<rect class="square" x="{x}" y="{y}" width="{_CELL_W}" height="{_CELL_H}"/>',
+                        f'<rect class="square body" x="{x}" y="{y}" width="{_CELL_W}" height="{_CELL_H}"/>'))
+        headers.append((f'<text class="palace" x="{x + _PAD}" y="{y + 24}">',
+                        f'</text><text class="pillar" x="{x + _CELL_W - _PAD}" y="{y + 24}" text-anchor="end">',
+                        '</text>'))
+        star_lines.append([f'<text x="{x + _PAD + (k // _ROWS) * _CELL_W // 2}" y="{y + 52 + (k % _ROWS) * _LINE_H}" class="'
+                           for k in range(_MAX_STARS)])
+    cx, cy = _CELL_W, _CELL_H
+    middle = [f'<rect class="square" x="{cx}" y="{cy}" width="{2 * _CELL_W}" height="{2 * _CELL_H}"/>',
+              f'<text class="title" x="{cx + _CELL_W}" y="{cy + 50}" text-anchor="middle">Purple Star Chart</text>']
+    info_lines = [(f'<text class="label" x="{cx + 130}" y="{cy + 100 + n * 30}" text-anchor="end">',
+                   f'</text><text x="{cx + 145}" y="{cy + 100 + n * 30}">', '</text>') for n in range(7)]
+    return head, squares, headers, star_lines, ''.join(middle), info_lines, '</svg>'
+
+_svg_head, _svg_squares, _svg_headers, _svg_star_lines, _svg_middle, _svg_info, _svg_tail = _compile_svg()
+_star_bodies = {}
+
+def _star_body(kind, label, magnitude):
+    '''the part of a star line after its position, cached by content'''
+    key = (kind, label, magnitude)
+    body = _star_bodies.get(key)
+    if body is None:
+        mag = f'<tspan class="mag"> {escape(magnitude)}</tspan>' if magnitude else ''
+        body = _star_bodies[key] = f'{kind}">{escape(label)}{mag}'
+    return body
+
+def svg(chart):
+    '''SVG text for a PurpleStarChart or ChartView'''
+    view = ChartView.of(chart)
+    out = [_svg_head]
+    for br_loc, (palace, pillar, is_body, stars) in enumerate(view.cells):
+        out.append(_svg_squares[br_loc][is_body])
+    for br_loc, (palace, pillar, is_body, stars) in enumerate(view.cells):
+        open_name, open_pillar, close = _svg_headers[br_loc]
+        out += [open_name, palace, ' (body)' if is_body else '', open_pillar, pillar, close]
+        lines = _svg_star_lines[br_loc]
+        for k, (kind, label, magnitude, marks) in enumerate(stars[:_MAX_STARS]):
+            out += [lines[k], _star_body(kind, label, magnitude)]
+            if marks:
+                out.append(f'<tspan class="mark"> {marks}</tspan>')
+            out.append('</text>')
+    out.append(_svg_middle)
+    for (open_label, open_value, close), (label, value) in zip(_svg_info, view.info):
+        out += [open_label, label, open_value, escape(value), close]
+    out.append(_svg_tail)
+    return ''.join(out)
+
+_html_head = '<!doctype html>\n<html><head><meta charset="utf-8"><title>{}</title></head>\n<body style="margin:0">\n'
+_html_tail = '\n</body></html>\n'
+
+def html(chart):
+    '''standalone HTML page holding svg(chart)'''
+    view = ChartView.of(chart)
+    return _html_head.format(escape(f'Purple Star Chart {view.info[0][1]}')) + svg(view) + _html_tail
+
+_TEXT_W = 26
+
+def _text_cell(palace, pillar, is_body, stars):
+    name = palace + (' (body)' if is_body else '')
+    lines = [' ' + name + pillar.rjust(_TEXT_W - len(name) - 2) + ' ']
+    for kind, label, magnitude, marks in stars:
+        line = label + (' ' + magnitude if magnitude else '') + (' [' + marks + ']' if marks else '')
+        lines.append(' ' + line.ljust(_TEXT_W - 1))
+    return lines
+
+def text(chart):
+    '''the board as fixed width text, for terminals'''
+    view = ChartView.of(chart)
+    cells = {_squares[br_loc]: _text_cell(*cell) for br_loc, cell in enumerate(view.cells)}
+    heights = [max(len(cells[rc]) for rc in cells if rc[0] == row) for row in range(4)]
+    middle_w = 2 * _TEXT_W + 1
+    middle = [' Purple Star Chart'.ljust(middle_w), ' ' * middle_w]
+    middle += [f' {label + ":":13}{value}'.ljust(middle_w) for label, value in view.info]
+    # the middle spans rows 1 and 2 and the border between them
+    heights[2] = max(heights[2], len(middle) - heights[1] - 1)
+    middle += [' ' * middle_w] * (heights[1] + 1 + heights[2] - len(middle))
+    blank = ' ' * _TEXT_W
+    line_at = lambda row, col, n: cells[row, col][n] if n < len(cells[row, col]) else blank
+    rule = '+' + ('-' * _TEXT_W + '+') * 4
+    out = [rule]
+    for row in range(4):
+        for n in range(heights[row]):
+            if row in (1, 2):
+                mid = middle[n if row == 1 else heights[1] + 1 + n]
+                out.append(f'|{line_at(row, 0, n)}|{mid}|{line_at(row, 3, n)}|')
+            else:
+                out.append('|' + '|'.join(line_at(row, col, n) for col in range(4)) + '|')
+        if row == 1:
+            out.append(f'+{"-" * _TEXT_W}|{middle[heights[1]]}|{"-" * _TEXT_W}+')
+        else:
+            out.append(rule)
+    return '\n'.join(out) + '\n'
+
+renderers = {'svg': svg, 'html': html, 'text': text}
+_extensions = {'svg': 'svg', 'html': 'html', 'text': 'txt'}
+
+def render_chunk(chunk, fmt='svg', dt_field='datetime', gender_field='gender'):
+    '''([(record number, rendered bytes)], error dicts) for a chunk of
+    (record number, record) pairs; runs in the export workers'''
+    from src.purple_star_chart.pipeline import _batch_rows, _error
+    from src.purple_star_chart.records import parse_record
+
+    draw = renderers[fmt]
+    nums, dts, genders, errors = [], [], [], []
+    for num, record in chunk:
+        try:
+            solar_dt, gender = parse_record(record, dt_field, gender_field)
+        except (ValueError, TypeError, AttributeError) as err:
+            errors.append(_error(num, err))
+            continue
+        nums.append(num)
+        dts.append(solar_dt)
+        genders.append(gender)
+    batches, batch_errors = _batch_rows(nums, dts, genders) if nums else ([], [])
+    out = []
+    for batch_nums, batch in batches:
+        for i, num in enumerate(batch_nums):
+            out.append((num, draw(ChartView.from_batch(batch, i)).encode()))
+    return out, errors + batch_errors
+
+class _DirWriter:
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+
+    def add(self, name, data):
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+class _ZipWriter:
+    def __init__(self, path):
+        self.zf = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+
+    def add(self, name, data):
+        self.zf.writestr(name, data)
+
+    def close(self):
+        self.zf.close()
+
+class _TarWriter:
+    def __init__(self, path):
+        self.tf = tarfile.open(path, 'w:gz' if path.endswith(('.tar.gz', '.tgz')) else 'w')
+        self.now = time.time()
+
+    def add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = self.now
+        self.tf.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.tf.close()
+
+def _writer(dest):
+    if dest.endswith('.zip'):
+        return _ZipWriter(dest)
+    if dest.endswith(('.tar', '.tar.gz', '.tgz')):
+        return _TarWriter(dest)
+    return _DirWriter(dest)
+
+def export(source, dest, fmt='svg', in_fmt=None, workers=None, chunk_size=1000, dt_field='datetime',
+           gender_field='gender', progress=None):
+    '''renders every record in source to its own file in dest: a .zip,
+    .tar, .tar.gz/.tgz, or otherwise a directory. Files are named by record
+    number (00000042.svg); records that can't be charted go in errors.jsonl.
+    Chunks are charted and drawn on a process pool (workers=0 for this
+    process only) and written as they come back, so memory stays flat.
+    Returns the PipelineStats.'''
+    from src.purple_star_chart.pipeline import PipelineStats, map_chunks
+
+    if fmt not in renderers:
+        raise ValueError(f'unknown format {fmt}')
+    fn = partial(render_chunk, fmt=fmt, dt_field=dt_field, gender_field=gender_field)
+    stats = PipelineStats()
+    errors = []
+    writer = _writer(dest)
+    try:
+        for (rendered, chunk_errors), n_records in map_chunks(fn, source, in_fmt, workers, chunk_size):
+            for num, data in rendered:
+                writer.add(f'{num:08d}.{_extensions[fmt]}', data)
+            errors += chunk_errors
+            stats.records += n_records
+            stats.charts += len(rendered)
+            stats.errors += len(chunk_errors)
+            if progress is not None:
+                progress(stats)
+        if errors:
+            errors.sort(key=lambda e: e['record'])
+            writer.add('errors.jsonl', ''.join(json.dumps(e) + '\n' for e in errors).encode())
+        return stats
+    finally:
+        writer.close()
@@ -0,0 +1,340 @@
+'''Local HTTP service for Purple Star and BaZi charts, stdlib asyncio only.
+Single chart requests are queued and collected into micro-batches (up to
+max_batch charts, or whatever has arrived max_delay seconds after the first
+one), and each batch is charted with ChartBatch on a process pool, so the
+event loop only ever parses requests and writes bytes.
+
+Endpoints:
+    GET  /chart?datetime=1990-05-17T08:30&gender=female
+    POST /chart             {"datetime": ..., "gender": ...}
+    GET  /bazi?datetime=1990-05-17T08:30
+    POST /charts            jsonl records in, jsonl charts streamed back
+                            (chunked) as each chunk finishes, tagged with
+                            their record number
+    GET  /health
+    GET  /metrics           OpenMetrics text
+
+Run with `python -m src.purple_star_chart.service [--port 8080] [--workers N]`.'''
+
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from urllib.parse import urlsplit, parse_qsl
+from attrs import define, field
+from src.purple_star_chart.BaZiChart import BaZiChart
+from src.purple_star_chart.instrumentation import Metrics
+from src.purple_star_chart.pipeline import chart_chunk, _batch_rows
+from src.purple_star_chart.records import parse_record
+from src.purple_star_chart.shared_tables import init_worker, publish
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            413: 'Payload Too Large', 422: 'Unprocessable Entity', 500: 'Internal Server Error'}
+_MAX_HEADERS = 100
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def chart_json(dts, genders):
+    '''(status, json text) for each datetime/gender pair. Runs on the worker
+    pool; encoding happens there too so the event loop doesn't have to.'''
+    out = [None] * len(dts)
+    batches, errors = _batch_rows(list(range(len(dts))), dts, genders)
+    for nums, batch in batches:
+        for i, num in enumerate(nums):
+            out[num] = (200, json.dumps(batch.to_dict(i)))
+    for err in errors:
+        out[err['record']] = (422, json.dumps({'error': err['error']}))
+    return out
+
+@define
+class ChartService:
+    '''max_delay is in seconds. workers sizes the process pool (all cores by
+    default); pass executor to use your own instead. shared_tables=True has
+    the pool's workers attach the host's shared placement table (see
+    shared_tables) rather than each computing placements.'''
+    host: str = '127.0.0.1'
+    port: int = 8080
+    workers: int = None
+    max_batch: int = 256
+    max_delay: float = 0.002
+    bulk_chunk: int = 1000
+    max_body: int = 64 * 1024 * 1024
+    executor: object = None
+    shared_tables: bool = False
+    metrics: Metrics = field(factory=Metrics)
+    _queue: asyncio.Queue = field(init=False, default=None, repr=False)
+    _server: object = field(init=False, default=None, repr=False)
+    _batcher: object = field(init=False, default=None, repr=False)
+    _slots: asyncio.Semaphore = field(init=False, default=None, repr=False)
+    _owns_executor: bool = field(init=False, default=False, repr=False)
+    _connections: set = field(init=False, factory=set, repr=False)
+    _batches: set = field(init=False, factory=set, repr=False)
+
+    async def start(self):
+        if self.executor is None:
+            initializer = None
+            if self.shared_tables:
+                # publish before the workers start so they only ever attach
+                publish('placements')
+                initializer = init_worker
+            self.executor = ProcessPoolExecutor(self.workers, initializer=initializer)
+            self._owns_executor = True
+        self._queue = asyncio.Queue()
+        # bounds batches in flight so a flood of requests backs up in the
+        # queue (and gets batched bigger) rather than in the executor
+        self._slots = asyncio.Semaphore(2 * (self.workers or os.cpu_count()))
+        # get the pool's workers forked now: forked any later, they'd inherit
+        # the listening socket and whatever connections are open, and those
+        # would never see EOF when we close them
+        await asyncio.get_running_loop().run_in_executor(self.executor, os.getpid)
+        self._batcher = asyncio.create_task(self._batch_loop())
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        if self._batcher is not None:
+            self._batcher.cancel()
+        await asyncio.gather(*self._batches, return_exceptions=True)
+        if self._owns_executor:
+            self.executor.shutdown(cancel_futures=True)
+
+    async def chart(self, solar_dt, gender):
+        '''(status, json text) for one chart, via the micro-batcher'''
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((solar_dt, gender, future))
+        return await future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                if queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(queue.get_nowait())
+            await self._slots.acquire()
+            # the loop only keeps weak references to tasks, so hold on to
+            # them until they're done
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch):
+        start = perf_counter()
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, chart_json, [b[0] for b in batch], [b[1] for b in batch])
+        except Exception as err:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+            return
+        finally:
+            self._slots.release()
+        self.metrics.stage_finished('batch', perf_counter() - start, None)
+        self.metrics.counted('batches', 1)
+        self.metrics.counted('batched_charts', len(batch))
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader, self.max_body)
+                except HTTPError as err:
+                    await _respond(writer, err.status, json.dumps({'error': str(err)}), close=True)
+                    return
+                if request is None:
+                    return
+                method, target, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                start = perf_counter()
+                try:
+                    handled = await self._route(method, target, body, writer, keep_alive)
+                except HTTPError as err:
+                    handled = await _respond(writer, err.status, json.dumps({'error': str(err)}), not keep_alive)
+                except Exception as err:
+                    handled = await _respond(writer, 500, json.dumps({'error': f'{type(err).__name__}: {err}'}),
+                                             not keep_alive)
+                self.metrics.stage_finished('request', perf_counter() - start, None)
+                self.metrics.counted('requests', 1)
+                if not keep_alive or not handled:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # service shutting down; end quietly so asyncio doesn't log
+            # every idle keep-alive connection
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _route(self, method, target, body, writer, keep_alive):
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        if path == '/health':
+            status = {'status': 'ok', 'queued': self._queue.qsize()}
+            return await _respond(writer, 200, json.dumps(status), not keep_alive)
+        if path == '/metrics':
+            return await _respond(writer, 200, self.metrics.to_openmetrics('purple_star_service'), not keep_alive,
+                                  'application/openmetrics-text; version=1.0.0; charset=utf-8')
+        if path in ('/chart', '/bazi'):
+            record = _request_record(method, url, body)
+            try:
+                solar_dt, gender = parse_record({'gender': 'male', **record} if path == '/bazi' else record)
+            except (ValueError, TypeError) as err:
+                raise HTTPError(400, str(err))
+            if path == '/bazi':
+                return await _respond(writer, 200, json.dumps(BaZiChart.from_solar_date(solar_dt).to_dict()),
+                                      not keep_alive)
+            status, text = await self.chart(solar_dt, gender)
+            return await _respond(writer, status, text, not keep_alive)
+        if path == '/charts':
+            if method != 'POST':
+                raise HTTPError(405, 'POST jsonl records to /charts')
+            return await self._bulk(body, writer, keep_alive)
+        raise HTTPError(404, f'no such endpoint {path}')
+
+    async def _bulk(self, body, writer, keep_alive):
+        records = []
+        for line in body.decode().splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append((len(records), json.loads(line)))
+            except ValueError as err:
+                records.append((len(records), {'_error': f'bad json: {err}'}))
+        loop = asyncio.get_running_loop()
+        futures = [loop.run_in_executor(self.executor, chart_chunk, records[i:i + self.bulk_chunk])
+                   for i in range(0, len(records), self.bulk_chunk)]
+
+        writer.write(_head(200, 'application/x-ndjson', not keep_alive, chunked=True))
+        try:
+            for done in asyncio.as_completed(futures):
+                text, _ = await done
+                if text:
+                    data = text.encode()
+                    writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+                    await writer.drain()
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        except Exception:
+            # headers are gone already, so all we can do is cut the stream
+            # short by dropping the connection without the final chunk
+            for future in futures:
+                future.cancel()
+            return False
+        self.metrics.counted('bulk_charts', len(records))
+        return True
+
+def _request_record(method, url, body):
+    if method == 'GET':
+        return dict(parse_qsl(url.query))
+    if method == 'POST':
+        try:
+            record = json.loads(body or b'{}')
+        except ValueError as err:
+            raise HTTPError(400, f'bad json: {err}')
+        if not isinstance(record, dict):
+            raise HTTPError(400, 'expected a json object')
+        return record
+    raise HTTPError(405, f'{method} not supported')
+
+async def _read_request(reader, max_body):
+    '''(method, target, headers, body), or None once the client is done'''
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HTTPError(400, 'malformed request line')
+    headers = {}
+    for _ in range(_MAX_HEADERS):
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HTTPError(400, 'too many headers')
+    try:
+        length = int(headers.get('content-length', 0) or 0)
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise HTTPError(400, 'bad content-length')
+    if length > max_body:
+        raise HTTPError(413, f'body over {max_body} bytes')
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), target, headers, body
+
+def _head(status, content_type, close, length=None, chunked=False):
+    lines = [f'HTTP/1.1 {status} {_REASONS.get(status, "")}', f'Content-Type: {content_type}']
+    if chunked:
+        lines.append('Transfer-Encoding: chunked')
+    else:
+        lines.append(f'Content-Length: {length}')
+    lines.append('Connection: close' if close else 'Connection: keep-alive')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+async def _respond(writer, status, text, close, content_type='application/json'):
+    data = text.encode()
+    writer.write(_head(status, content_type, close, len(data)) + data)
+    await writer.drain()
+    return not close
+
+async def serve(**kwargs):
+    service = await ChartService(**kwargs).start()
+    print(f'serving on http://{service.host}:{service.port}', flush=True)
+    try:
+        await service.serve_forever()
+    finally:
+        await service.close()
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Purple Star chart HTTP service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-delay-ms', type=float, default=2.0)
+    parser.add_argument('--shared-tables', action='store_true',
+                        help='workers attach a placement table shared across the host')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(host=args.host, port=args.port, workers=args.workers, max_batch=args.max_batch,
+                          max_delay=args.max_delay_ms / 1000, shared_tables=args.shared_tables))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,189 @@
+'''Big read-only tables built once per host and memory-mapped by every worker
+process, instead of each worker building and holding its own copy.
+
+Tables:
+    placements    star_engine.key_space(): every key's placements (~50MB,
+                  a second or two to build). With it installed, place() is
+                  a lookup instead of running the compiled steps.
+    chart_index   ChartIndex bitmaps (~66MB, several seconds to build)
+
+(ChartTable is already a memory-mapped file, so workers share it through
+the page cache as it is.)
+
+Lifecycle:
+    publish     build the table in this process and write it as .npy files
+                into a scratch directory, then rename that into place.
+                The rename is atomic, so readers never see half a table; if
+                another process got there first its copy wins and ours is
+                thrown away.
+    attach      np.load(mmap_mode='r') on each file: zero copy, read only,
+                and the pages are shared by every process that maps them.
+    version     every table directory is named after a hash of what the
+                table depends on (file format, star slots, engine rules,
+                key shape), so new code never attaches an old table.
+    cleanup     remove_stale() deletes table directories for other
+                versions, and scratch directories left by dead publishers;
+                remove() takes down the current ones.
+    fallback    load() attaches if it can, publishes then attaches if the
+                table isn't there yet, and builds a private in-process copy
+                if the shared directory can't be used at all (or with
+                shared=False).
+
+Tables live under $PURPLE_STAR_SHARED_DIR, or /dev/shm (RAM backed) where
+there is one, or the temp directory otherwise. Pass init_worker as the
+initializer of a process pool to attach and install them in every worker;
+pipeline.run_pipeline and ChartService do that with shared_tables=True.'''
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from time import time
+import numpy as np
+from attrs import asdict
+from src.purple_star_chart import _star_slots
+
+_FORMAT = 1
+_PREFIX = 'purple_star-'
+table_names = ('placements', 'chart_index')
+
+def default_root():
+    root = os.environ.get('PURPLE_STAR_SHARED_DIR')
+    if root:
+        return root
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+def _build_placements():
+    from src.purple_star_chart.star_engine import key_space
+    return asdict(key_space(), recurse=False)
+
+def _build_chart_index():
+    from src.purple_star_chart.chart_index import build_bitmaps
+    bitmaps, life = build_bitmaps()
+    return {'bitmaps': bitmaps, 'life': life}
+
+_builders = {'placements': _build_placements, 'chart_index': _build_chart_index}
+
+def table_version(name):
+    '''short hash of everything the named table's contents depend on'''
+    from src.purple_star_chart.chart_key import _key_shape
+    from src.purple_star_chart import star_engine as e
+    if name not in _builders:
+        raise ValueError(f'unknown table {name}')
+    parts = (_FORMAT, name, _star_slots, _key_shape, e._ZIWEI, e._PHASE, e._BACK, e._DERIVED, e._RULES,
+             e._TRANSFORMS, e._LIFE_MASTER, e._BODY_MASTER)
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:12]
+
+def table_path(name, root=None):
+    return os.path.join(root or default_root(), f'{_PREFIX}{name}-{table_version(name)}')
+
+def publish(name, root=None):
+    '''builds the named table and puts it where attach() finds it, unless
+    it's already there; returns its directory'''
+    path = table_path(name, root)
+    if os.path.exists(path):
+        return path
+    scratch = tempfile.mkdtemp(prefix=f'{_PREFIX}tmp-{os.getpid()}-', dir=os.path.dirname(path))
+    try:
+        arrays = _builders[name]()
+        for array_name, array in arrays.items():
+            np.save(os.path.join(scratch, array_name + '.npy'), np.ascontiguousarray(array))
+        manifest = {'name': name, 'version': table_version(name), 'arrays': list(arrays),
+                    'created': time(), 'pid': os.getpid()}
+        with open(os.path.join(scratch, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+        os.rename(scratch, path)
+    except OSError:
+        shutil.rmtree(scratch, ignore_errors=True)
+        # lost the race to another publisher, which is fine
+        if not os.path.exists(path):
+            raise
+    return path
+
+def attach(name, root=None):
+    '''dict of read-only memory-mapped arrays for a published table; raises
+    FileNotFoundError if it hasn't been published (for this version)'''
+    path = table_path(name, root)
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest['version'] != table_version(name):
+        raise ValueError(f'{path} holds version {manifest["version"]} of {name}')
+    return {array_name: np.load(os.path.join(path, array_name + '.npy'), mmap_mode='r')
+            for array_name in manifest['arrays']}
+
+def load(name, root=None, shared=True):
+    '''the named table's arrays: attached if published, published and
+    attached if not, and built privately in this process if shared is False
+    or the shared directory can't be used'''
+    if shared:
+        try:
+            try:
+                return attach(name, root)
+            except FileNotFoundError:
+                publish(name, root)
+                return attach(name, root)
+        except (OSError, ValueError):
+            pass
+    return _builders[name]()
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def remove_stale(root=None):
+    '''deletes tables for versions other than the current ones and scratch
+    directories whose publisher has died; returns the paths removed'''
+    root = root or default_root()
+    current = {os.path.basename(table_path(name, root)) for name in table_names}
+    removed = []
+    for entry in os.listdir(root):
+        if not entry.startswith(_PREFIX) or entry in current:
+            continue
+        if entry.startswith(_PREFIX + 'tmp-'):
+            pid = entry[len(_PREFIX + 'tmp-'):].split('-')[0]
+            if pid.isdigit() and _pid_alive(int(pid)):
+                continue
+        path = os.path.join(root, entry)
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(path)
+    return removed
+
+def remove(names=table_names, root=None):
+    '''deletes the current published tables. Processes that already have
+    them mapped keep working; the memory goes once the last one unmaps.'''
+    for name in names:
+        shutil.rmtree(table_path(name, root), ignore_errors=True)
+
+def placement_table(root=None, shared=True):
+    from src.purple_star_chart.star_engine import Placements
+    return Placements(**load('placements', root, shared))
+
+def chart_index(root=None, shared=True):
+    '''ChartIndex over the shared bitmaps'''
+    from src.purple_star_chart.chart_index import ChartIndex
+    arrays = load('chart_index', root, shared)
+    return ChartIndex(arrays['bitmaps'], arrays['life'])
+
+def init_worker(root=None, shared=True):
+    '''process pool initializer: attaches the placement table and has place()
+    (and so ChartBatch) look placements up in it'''
+    from src.purple_star_chart.star_engine import use_key_table
+    use_key_table(placement_table(root, shared))
+
+if __name__ == '__main__':
+    import sys
+
+    if sys.argv[1:2] == ['clean']:
+        for path in remove_stale():
+            print('removed', path)
+    elif sys.argv[1:2] == ['remove']:
+        remove()
+    else:
+        for name in sys.argv[1:] or table_names:
+            print(publish(name))
@@ -0,0 +1,53 @@
+'''Solar terms (jieqi) from the precomputed table in _solar_term_table.py
+(rebuild it with build_solar_terms.py). Everything here is a bisect on that
+table: no astronomy happens at runtime.
+
+The terms alternate jie and qi, starting from xiao han in early January.
+Traditional BaZi starts each month at a jie (xiao han starts the chou month,
+li chun the yin month, ...), and the year at li chun. Term instants are
+China Standard Time, and are compared against naive datetimes as given.'''
+
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from src.purple_star_chart._solar_term_table import first_year, term_minutes
+
+term_names = ['xiao_han', 'da_han', 'li_chun', 'yu_shui', 'jing_zhe', 'chun_fen',
+              'qing_ming', 'gu_yu', 'li_xia', 'xiao_man', 'mang_zhong', 'xia_zhi',
+              'xiao_shu', 'da_shu', 'li_qiu', 'chu_shu', 'bai_lu', 'qiu_fen',
+              'han_lu', 'shuang_jiang', 'li_dong', 'xiao_xue', 'da_xue', 'dong_zhi']
+
+_EPOCH = datetime(1900, 1, 1)
+
+def _minutes(solar_dt):
+    if not isinstance(solar_dt, datetime):
+        solar_dt = datetime(solar_dt.year, solar_dt.month, solar_dt.day)
+    delta = solar_dt - _EPOCH
+    return delta.days * 1440 + delta.seconds // 60
+
+def term_datetime(n):
+    '''start of term n of the table (term 0 is xiao han of first_year)'''
+    return _EPOCH + timedelta(minutes=term_minutes[n])
+
+def term_loc(solar_dt):
+    '''table index of the term in effect at a date or datetime'''
+    loc = bisect_right(term_minutes, _minutes(solar_dt)) - 1
+    if loc < 0 or loc >= len(term_minutes) - 1:
+        raise ValueError(f'{solar_dt} is outside the solar term table')
+    return loc
+
+def solar_term(solar_dt):
+    '''(name, start datetime) of the term in effect'''
+    loc = term_loc(solar_dt)
+    return term_names[loc % 24], term_datetime(loc)
+
+def pillar_locs(solar_dt):
+    '''(year cycle position, month branch index) by solar terms: the year
+    turns over at li chun and the month at each jie'''
+    loc = term_loc(solar_dt)
+    year = first_year + loc // 24 - (loc % 24 < 2)
+    return (year - 4) % 60, (loc % 24 // 2 + 1) % 12
+
+def month_stem(year_stem, month_branch):
+    '''stem index of a month pillar; the yin month's stem follows from the
+    year stem and the rest count on from it'''
+    return (((year_stem % 5) * 2 + 2) + (month_branch - 2) % 12) % 10
@@ -0,0 +1,365 @@
+'''Compiled star placement engine.
+Every placement rule in PurpleStarChart's _plot_* methods boils down to
+
+    branch = (base + direction * (step + const)) % 12
+
+where base and step are a constant, another value already worked out for
+the chart (an input like the hour branch, a derived value like the ziwei
+location, or another star's branch) or a lookup table on one or two of
+those. _RULES spells all of them out as integer data, including the derived
+values (life palace, phase, ziwei, ...) the stars hang off of.
+
+At import, each rule is evaluated over every combination of its inputs and
+the resulting tables are grouped by dependency level, so placing every star
+for any number of charts is one numpy gather per level plus one for the
+four transformation stars. The _plot_* methods stay as the reference
+implementation and add_stars() here matches them exactly.'''
+
+import numpy as np
+from itertools import product
+from attrs import define, fields
+from src.purple_star_chart import _star_slots
+
+BACK = 'back'
+
+# key inputs and their domain sizes; month and day are zero based here
+_inputs = {'year': 60, 'month': 12, 'day': 30, 'hour': 12, 'gender': 2}
+
+_ZIWEI = (
+    (1, 2, 2, 3, 3, 4, 4, 5, 5, 6, 6, 7, 7, 8, 8, 9, 9, 10, 10, 11, 11, 0, 0, 1, 1, 2, 2, 3, 3, 4),
+    (4, 1, 2, 5, 2, 3, 6, 3, 4, 7, 4, 5, 8, 5, 6, 9, 6, 7, 10, 7, 8, 11, 8, 9, 0, 9, 10, 1, 10, 11),
+    (11, 4, 1, 2, 0, 5, 2, 3, 1, 6, 3, 4, 2, 7, 4, 5, 3, 8, 5, 6, 4, 9, 6, 7, 5, 10, 7, 8, 6, 11),
+    (6, 11, 4, 1, 2, 7, 0, 5, 2, 3, 8, 1, 6, 3, 4, 9, 2, 7, 4, 5, 10, 3, 8, 5, 6, 11, 4, 9, 6, 7),
+    (9, 6, 11, 4, 1, 2, 10, 7, 0, 5, 2, 3, 11, 8, 1, 6, 3, 4, 0, 9, 2, 7, 4, 5, 1, 10, 3, 8, 5, 7)
+)
+# phase index by year stem % 5 and life palace branch // 2
+_PHASE_PAIRS = (
+    (0, 4, 1, 3, 2, 4),
+    (4, 3, 2, 1, 0, 3),
+    (3, 1, 0, 2, 4, 1),
+    (1, 2, 4, 0, 3, 2),
+    (2, 0, 3, 4, 1, 0)
+)
+_PHASE = tuple(tuple(_PHASE_PAIRS[s % 5][b // 2] for b in range(12)) for s in range(10))
+# yang stem and male, or yin stem and female, goes forward
+_BACK = tuple((s % 2 == 1, s % 2 == 0) for s in range(10))
+
+# derived values, in the same rule form as the stars plus a domain size
+_DERIVED = (
+    ('ystem', 10, ('year', tuple(y % 10 for y in range(60))), None, 0, 1),
+    ('ybranch', 12, ('year', tuple(y % 12 for y in range(60))), None, 0, 1),
+    ('life', 12, 'month', 'hour', -2, -1),
+    ('body', 12, 'month', 'hour', 2, 1),
+    ('phase', 5, (('ystem', 'life'), _PHASE), None, 0, 1),
+    ('back', 2, (('ystem', 'gender'), _BACK), None, 0, 1),
+    ('ziwei', 12, (('phase', 'day'), _ZIWEI), None, 0, 1),
+)
+
+# one row per entry in _star_slots: (star, base, step, const, direction)
+_RULES = (
+    # _plot_ziwei, _plot_major_stars
+    ('zi_wei', 'ziwei', None, 0, 1),
+    ('tian_ji', 11, 'ziwei', 0, 1),
+    ('tai_yang', 9, 'ziwei', 0, 1),
+    ('wu_qu', 8, 'ziwei', 0, 1),
+    ('tian_tong', 7, 'ziwei', 0, 1),
+    ('lian_zhen', 4, 'ziwei', 0, 1),
+    ('tian_fu', 4, 'ziwei', 0, -1),
+    ('tai_yin', 5, 'ziwei', 0, -1),
+    ('tan_lang', 6, 'ziwei', 0, -1),
+    ('ju_men', 7, 'ziwei', 0, -1),
+    ('tian_xiang', 8, 'ziwei', 0, -1),
+    ('tian_liang', 9, 'ziwei', 0, -1),
+    ('qi_sha', 10, 'ziwei', 0, -1),
+    ('po_jun', 2, 'ziwei', 0, -1),
+    # _plot_hour_stars
+    ('wen_chang', 10, 'hour', 0, -1),
+    ('wen_qu', 4, 'hour', 0, 1),
+    ('di_jie', 11, 'hour', 0, 1),
+    ('di_kong', 11, 'hour', 0, -1),
+    ('tai_fu', 6, 'hour', 0, 1),
+    ('feng_gao', 2, 'hour', 0, 1),
+    ('ling_xing', ('ybranch', (10, 10, 3, 10, 10, 10, 3, 10, 10, 10, 3, 10)), 'hour', 0, 1),
+    ('huo_xing', ('ybranch', (2, 3, 1, 9, 2, 3, 1, 9, 2, 3, 1, 9)), 'hour', 0, 1),
+    # _plot_month_stars
+    ('zuo_fu', 3, 'month', 1, 1),
+    ('you_bi', 11, 'month', 1, -1),
+    ('tian_xing', 8, 'month', 1, 1),
+    ('tian yao', 0, 'month', 1, 1),
+    ('yue_ma', ('month', (8, 5, 2, 11, 8, 5, 2, 11, 8, 5, 2, 11)), None, 0, 1),
+    ('jie_shen', ('month', (8, 8, 10, 10, 0, 0, 2, 2, 4, 4, 6, 6)), None, 0, 1),
+    ('tian_wu', ('month', (5, 8, 2, 11, 5, 8, 2, 11, 5, 8, 2, 11)), None, 0, 1),
+    ('tian_yue', ('month', (10, 5, 4, 2, 7, 3, 11, 7, 2, 6, 10, 2)), None, 0, 1),
+    ('yin_sha', ('month', (2, 0, 10, 8, 6, 4, 2, 0, 10, 8, 6, 4)), None, 0, 1),
+    # _plot_day_stars
+    ('san_tai', 'zuo_fu', 'day', 0, 1),
+    ('ba_zuo', 'you_bi', 'day', 0, -1),
+    ('en_guang', 'wen_chang', 'day', -1, 1),
+    ('tian_gui', 'wen_qu', 'day', -1, 1),
+    # _plot_year_stars
+    ('lu_cun', ('ystem', (2, 3, 5, 6, 5, 6, 8, 9, 11, 0)), None, 0, 1),
+    ('qing_yang', ('ystem', (3, 4, 6, 7, 6, 7, 9, 10, 0, 1)), None, 0, 1),
+    ('tuo_luo', ('ystem', (1, 2, 4, 5, 4, 5, 7, 8, 10, 11)), None, 0, 1),
+    ('tian_yue', ('ystem', (1, 0, 11, 11, 1, 0, 1, 6, 3, 3)), None, 0, 1),
+    ('tian_kui', ('ystem', (7, 8, 9, 9, 7, 8, 7, 2, 5, 5)), None, 0, 1),
+    ('tian_gong', ('ystem', (7, 4, 5, 2, 3, 9, 11, 9, 10, 6)), None, 0, 1),
+    ('tian_fu', ('ystem', (9, 8, 0, 11, 3, 2, 6, 5, 6, 5)), None, 0, 1),
+    ('hua_lu', None, None, 0, 1),
+    ('hua_quan', None, None, 0, 1),
+    ('hua_ke', None, None, 0, 1),
+    ('hua_ji', None, None, 0, 1),
+    # _plot_boshi
+    ('bo_shi', 'lu_cun', None, 0, BACK),
+    ('li_shi', 'lu_cun', None, 1, BACK),
+    ('qing_long', 'lu_cun', None, 2, BACK),
+    ('xiao_hao', 'lu_cun', None, 3, BACK),
+    ('jiang_jun', 'lu_cun', None, 4, BACK),
+    ('zou_shu', 'lu_cun', None, 5, BACK),
+    ('fei_lian', 'lu_cun', None, 6, BACK),
+    ('xi_shen', 'lu_cun', None, 7, BACK),
+    ('bing_fu', 'lu_cun', None, 8, BACK),
+    ('da hao', 'lu_cun', None, 9, BACK),
+    ('fu_bing', 'lu_cun', None, 10, BACK),
+    ('guan_fu', 'lu_cun', None, 11, BACK),
+    # _plot_yearbr_stars
+    ('tian_ku', 6, 'ybranch', 0, -1),
+    ('tian_xu', 6, 'ybranch', 0, 1),
+    ('long_chi', 4, 'ybranch', 0, 1),
+    ('feng_ge', 10, 'ybranch', 0, -1),
+    ('hong_luan', 3, 'ybranch', 0, -1),
+    ('tian_xi', 9, 'ybranch', 0, -1),
+    ('tian_kong', 1, 'ybranch', 0, 1),
+    ('tai_sui', 0, 'ybranch', 0, 1),
+    ('gu_chen', ('ybranch', (2, 2, 5, 5, 5, 8, 8, 8, 11, 11, 11, 2)), None, 0, 1),
+    ('gua_su', ('ybranch', (10, 10, 1, 1, 1, 4, 4, 4, 7, 7, 7, 10)), None, 0, 1),
+    ('fei_lian', ('ybranch', (8, 9, 10, 5, 6, 7, 2, 3, 4, 11, 0, 1)), None, 0, 1),
+    ('po_sui', ('ybranch', (5, 1, 9, 5, 1, 9, 5, 1, 9, 5, 1, 9)), None, 0, 1),
+    ('tian_cai', 'life', ('ybranch', (0, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1)), 0, 1),
+    ('tian_shou', 'body', 'ybranch', 0, 1),
+    ('tian_ma', ('ybranch', (2, 11, 8, 5, 2, 11, 8, 5, 2, 11, 8, 5)), None, 0, 1),
+    ('hua_gai', ('ybranch', (4, 1, 10, 7, 4, 1, 10, 7, 4, 1, 10, 7)), None, 0, 1),
+    ('xian_chi', ('ybranch', (9, 6, 3, 0, 9, 6, 3, 0, 9, 6, 3, 0)), None, 0, 1),
+    # _plot_changshen
+    ('chang_shen', ('phase', (8, 11, 5, 8, 2)), None, 0, BACK),
+    ('mu_yu', ('phase', (8, 11, 5, 8, 2)), None, 1, BACK),
+    ('guan_dai', ('phase', (8, 11, 5, 8, 2)), None, 2, BACK),
+    ('lin_guan', ('phase', (8, 11, 5, 8, 2)), None, 3, BACK),
+    ('di_wang', ('phase', (8, 11, 5, 8, 2)), None, 4, BACK),
+    ('shuai', ('phase', (8, 11, 5, 8, 2)), None, 5, BACK),
+    ('bing', ('phase', (8, 11, 5, 8, 2)), None, 6, BACK),
+    ('si', ('phase', (8, 11, 5, 8, 2)), None, 7, BACK),
+    ('mu', ('phase', (8, 11, 5, 8, 2)), None, 8, BACK),
+    ('jue', ('phase', (8, 11, 5, 8, 2)), None, 9, BACK),
+    ('tai', ('phase', (8, 11, 5, 8, 2)), None, 10, BACK),
+    ('yang', ('phase', (8, 11, 5, 8, 2)), None, 11, BACK),
+    # _plot_misc_stars
+    ('jie_kong', ('ystem', (8, 9, 6, 7, 4, 5, 2, 3, 0, 1)), None, 0, 1),
+    ('xun_kong', ('ybranch', (2, 2, 4, 4, 6, 6, 8, 8, 10, 10, 0, 0)), 'ystem', 0, 1),
+    ('tian_shang', 'life', None, 7, 1),
+    ('tian_shi', 'life', None, 5, 1),
+)
+
+# the transformation stars land on whichever star the year stem picks
+_TRANSFORMS = {
+    'hua_lu': ('lian_zhen', 'tian_ji', 'tian_tong', 'tai_yin', 'tan_lang',
+               'wu_qu', 'tai_yang', 'ju_men', 'tian_liang', 'po_jun'),
+    'hua_quan': ('po_jun', 'tian_liang', 'tian_ji', 'tian_tong', 'tai_yin',
+                 'tan_lang', 'wu_qu', 'tai_yang', 'zi_wei', 'ju_men'),
+    'hua_ke': ('wu_qu', 'zi_wei', 'wen_chang', 'tian_ji', 'you_bi',
+               'tian_liang', 'tai_yin', 'wen_qu', 'zuo_fu', 'tai_yin'),
+    'hua_ji': ('tai_yang', 'tai_yin', 'lian_zhen', 'ju_men', 'tian_ji',
+               'wen_qu', 'tian_tong', 'wen_chang', 'wu_qu', 'tan_lang')
+}
+
+# life master by life palace branch, body master by year branch
+_LIFE_MASTER = ('tan_lang', 'ju_men', 'lu_cun', 'wen_qu', 'lian_zhen', 'wu_qu',
+                'po_jun', 'wu_qu', 'lian_zhen', 'wen_qu', 'lu_cun', 'ju_men')
+_BODY_MASTER = ('huo_xing', 'tian_xiang', 'tian_liang', 'tian_tong', 'wen_chang', 'tian_ji') * 2
+
+@define
+class _Step:
+    '''one gather: table[k, state[:, cols_a], state[:, cols_b]] -> state[:, out]'''
+    out: np.ndarray
+    cols_a: np.ndarray
+    cols_b: np.ndarray
+    table: np.ndarray
+    indirect: bool = False
+
+def _term_inputs(term):
+    if term is None or isinstance(term, int) or term == BACK:
+        return ()
+    if isinstance(term, str):
+        return (term,)
+    names, _ = term
+    return (names,) if isinstance(names, str) else names
+
+def _term_value(term, env):
+    if term is None:
+        return 0
+    if isinstance(term, int):
+        return term
+    if isinstance(term, str):
+        return env[term]
+    names, table = term
+    if isinstance(names, str):
+        return table[env[names]]
+    return table[env[names[0]]][env[names[1]]]
+
+def _compile():
+    # value name -> state column; star names point at their latest
+    # placement so far, the same way _palace_by_star does
+    columns = {}
+    domains, levels = [], []
+    grouped = {}
+
+    def new_column(name, domain, level):
+        domains.append(domain)
+        levels.append(level)
+        columns[name] = len(domains) - 1
+        return columns[name]
+
+    def add_rule(name, domain, base, step, const, direction):
+        ins = [n for term in (base, step) for n in _term_inputs(term)]
+        if direction == BACK:
+            ins.append('back')
+        ins = list(dict.fromkeys(ins))
+        if len(ins) > 2:
+            raise ValueError(f'{name} depends on more than two values')
+        ins += ['zero'] * (2 - len(ins))
+        cols = [columns[n] for n in ins]
+        table = np.zeros((domains[cols[0]], domains[cols[1]]), dtype=np.uint8)
+        for a, b in product(range(table.shape[0]), range(table.shape[1])):
+            env = {ins[0]: a, ins[1]: b}
+            sign = (-1 if env['back'] else 1) if direction == BACK else direction
+            table[a, b] = (_term_value(base, env) + sign * (_term_value(step, env) + const)) % 12
+        level = 1 + max(levels[c] for c in cols)
+        out = new_column(name, domain, level)
+        grouped.setdefault((level, False), []).append((out, cols[0], cols[1], table))
+        return out
+
+    def add_transform(name):
+        targets = [columns[target] for target in _TRANSFORMS[name]]
+        level = 1 + max(levels[c] for c in targets + [columns['ystem']])
+        out = new_column(name, 12, level)
+        table = np.array(targets, dtype=np.intp)
+        grouped.setdefault((level, True), []).append((out, columns['ystem'], 0, table))
+        return out
+
+    new_column('zero', 1, 0)
+    for name, domain in _inputs.items():
+        new_column(name, domain, 0)
+    for name, domain, base, step, const, direction in _DERIVED:
+        add_rule(name, domain, base, step, const, direction)
+    slot_cols = []
+    for slot, (name, base, step, const, direction) in enumerate(_RULES):
+        if name != _star_slots[slot]:
+            raise ValueError(f'rule {slot} is for {name} but the slot is {_star_slots[slot]}')
+        if name in _TRANSFORMS:
+            slot_cols.append(add_transform(name))
+        else:
+            slot_cols.append(add_rule(name, 12, base, step, const, direction))
+
+    steps = []
+    for level, indirect in sorted(grouped):
+        group = grouped[(level, indirect)]
+        outs = np.array([g[0] for g in group], dtype=np.intp)
+        cols_a = np.array([g[1] for g in group], dtype=np.intp)
+        cols_b = np.array([g[2] for g in group], dtype=np.intp)
+        if indirect:
+            table = np.stack([g[3] for g in group], axis=1)
+        else:
+            dom_a = max(g[3].shape[0] for g in group)
+            dom_b = max(g[3].shape[1] for g in group)
+            table = np.zeros((len(group), dom_a, dom_b), dtype=np.uint8)
+            for k, g in enumerate(group):
+                table[k, :g[3].shape[0], :g[3].shape[1]] = g[3]
+        steps.append(_Step(outs, cols_a, cols_b, table, indirect))
+
+    slot_of = {name: slot for slot, name in enumerate(_star_slots)}
+    life_master = np.array([slot_of[n] for n in _LIFE_MASTER], dtype=np.uint8)
+    body_master = np.array([slot_of[n] for n in _BODY_MASTER], dtype=np.uint8)
+    return columns, len(domains), steps, np.array(slot_cols, dtype=np.intp), life_master, body_master
+
+_columns, _n_columns, _steps, _slot_cols, _life_master, _body_master = _compile()
+
+@define
+class Placements:
+    '''star placements for a batch of charts; positions[n, slot] is the
+    branch index of _star_slots[slot] in chart n'''
+    positions: np.ndarray
+    life: np.ndarray
+    body: np.ndarray
+    phase: np.ndarray
+    traverse_back: np.ndarray
+    life_master: np.ndarray
+    body_master: np.ndarray
+
+    def __len__(self):
+        return len(self.positions)
+
+    def row(self, i):
+        '''(slot branches, life master slot, body master slot) for chart i,
+        ready for PurpleStarChart._apply_placements'''
+        return bytes(self.positions[i]), int(self.life_master[i]), int(self.body_master[i])
+
+    def take(self, rows):
+        '''Placements for just the given rows'''
+        return Placements(*(np.asarray(getattr(self, f.name)[rows]) for f in fields(Placements)))
+
+# key_space() placements to look keys up in rather than placing them; see
+# use_key_table
+_key_table = None
+
+def use_key_table(table):
+    '''have place() look every key up in table, a Placements over the whole
+    key space in ChartKey.index() order (e.g. shared_tables.placement_table()),
+    instead of running the steps. None goes back to computing them.'''
+    global _key_table
+    _key_table = table
+
+def place(year, month, day, hour, gender):
+    '''places every star for arrays of key components: 60 year cycle
+    position, lunar month (1-12), lunar day (1-30), hour branch and gender
+    (0 male, 1 female)'''
+    year, month, day, hour, gender = np.broadcast_arrays(year, month, day, hour, gender)
+    if _key_table is not None:
+        index = (((year.astype(np.int64) * 12 + month - 1) * 30 + day - 1) * 12 + hour) * 2 + gender
+        return _key_table.take(index.reshape(-1))
+    state = np.zeros((year.size, _n_columns), dtype=np.uint8)
+    state[:, _columns['year']] = year.reshape(-1)
+    state[:, _columns['month']] = month.reshape(-1) - 1
+    state[:, _columns['day']] = day.reshape(-1) - 1
+    state[:, _columns['hour']] = hour.reshape(-1)
+    state[:, _columns['gender']] = gender.reshape(-1)
+    for step in _steps:
+        if step.indirect:
+            cols = step.table[state[:, step.cols_a[0]]]
+            state[:, step.out] = np.take_along_axis(state, cols, axis=1)
+        else:
+            state[:, step.out] = step.table[np.arange(len(step.out)), state[:, step.cols_a], state[:, step.cols_b]]
+    life = state[:, _columns['life']]
+    return Placements(
+        state[:, _slot_cols],
+        life,
+        state[:, _columns['body']],
+        state[:, _columns['phase']],
+        state[:, _columns['back']].astype(bool),
+        _life_master[life],
+        _body_master[state[:, _columns['ybranch']]]
+    )
+
+def place_keys(keys):
+    '''place() for a list of ChartKeys'''
+    from src.purple_star_chart import _genders
+    cols = zip(*((k.year, k.month, k.day, k.hour, _genders.index(k.gender)) for k in keys))
+    return place(*(np.array(c, dtype=np.int64) for c in cols))
+
+def key_space():
+    '''place() over the whole key space, rows in ChartKey.index() order'''
+    year, month, day, hour, gender = np.indices((60, 12, 30, 12, 2)).reshape(5, -1)
+    return place(year, month + 1, day + 1, hour, gender)
+
+def add_stars(chart):
+    '''same end result as chart.add_stars(), using the compiled tables'''
+    placed = place_keys([chart.key])
+    chart._apply_placements(*placed.row(0))
@@ -0,0 +1,41 @@
+from datetime import date, datetime, timedelta
+import numpy as np
+import pytest
+from src.purple_star_chart.BaZiChart import BaZiChart
+from src.purple_star_chart.almanac import blocks, days, hours, walk
+
+def assert_matches(records, solar_terms):
+    n = 0
+    for record in records:
+        expected = BaZiChart.from_solar_date(record.solar_date, solar_terms)
+        assert record.chart().to_dict() == expected.to_dict(), record.solar_date
+        n += 1
+    return n
+
+@pytest.mark.parametrize('solar_terms', [False, True])
+def test_days(solar_terms):
+    # crosses lunar new year and a leap month (1990 has a leap 5th month)
+    assert assert_matches(days(date(1990, 1, 1), date(1991, 3, 1), solar_terms), solar_terms) == 425
+
+@pytest.mark.parametrize('solar_terms', [False, True])
+def test_hours(solar_terms):
+    assert assert_matches(hours(date(1999, 12, 30), date(2000, 2, 10), solar_terms), solar_terms) == 43 * 24
+
+@pytest.mark.parametrize('solar_terms', [False, True])
+def test_walk_odd_step(solar_terms):
+    records = walk(datetime(2023, 12, 31, 22, 45), datetime(2024, 3, 1), timedelta(minutes=37), solar_terms)
+    assert assert_matches(records, solar_terms) > 0
+
+@pytest.mark.parametrize('solar_terms', [False, True])
+def test_blocks_match_walk(solar_terms):
+    start, stop, step = datetime(2020, 1, 1), datetime(2020, 3, 1), timedelta(hours=1)
+    expected = np.array([r.pillar_codes() for r in walk(start, stop, step, solar_terms)])
+    codes = np.concatenate([b.pillar_codes() for b in blocks(start, stop, step, solar_terms, block_size=500)])
+    assert np.array_equal(codes, expected)
+
+@pytest.mark.parametrize('step', [timedelta(0), timedelta(hours=-1)])
+def test_non_positive_step(step):
+    with pytest.raises(ValueError):
+        list(walk(datetime(2020, 1, 1), datetime(2020, 1, 2), step))
+    with pytest.raises(ValueError):
+        list(blocks(datetime(2020, 1, 1), datetime(2020, 1, 2), step))
@@ -0,0 +1,82 @@
+import random
+from datetime import datetime, timedelta
+import pytest
+from src.purple_star_chart import _palace_names
+from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+from src.purple_star_chart.chart_batch import ChartBatch
+from src.purple_star_chart.chart_codec import (
+    ChartArchive, ChartView, encode_batch, encode_chart, encode_charts, write_charts)
+from src.purple_star_chart.chart_key import ChartKey
+
+@pytest.fixture(scope='module')
+def sample():
+    rng = random.Random(4)
+    dts = [datetime(1901, 1, 1) + timedelta(seconds=rng.randrange(86400 * 365 * 190)) for _ in range(120)]
+    genders = [rng.choice(['male', 'female']) for _ in dts]
+    charts = []
+    for dt, gender in zip(dts, genders):
+        chart = PurpleStarChart.initialize_chart(dt, gender)
+        chart.add_stars()
+        charts.append(chart)
+    return dts, genders, charts
+
+def test_chart_round_trip(sample):
+    _, _, charts = sample
+    for chart in charts:
+        view = ChartView(encode_chart(chart))
+        assert view.solar_date == chart.solar_date
+        assert view.gender == chart.gender
+        assert view.body_palace == chart.palaces.body.name
+        for palace in _palace_names:
+            assert view.stars(palace) == [star.name for star in getattr(chart.palaces, palace).stars]
+        restored = view.to_chart()
+        assert restored == chart
+        assert restored.to_dict() == chart.to_dict()
+
+def test_batch_encodes_like_charts(sample):
+    dts, genders, charts = sample
+    from_charts = ChartArchive(encode_charts(charts))
+    from_batch = ChartArchive(encode_batch(ChartBatch.from_solar_dates(dts, genders)))
+    assert len(from_charts) == len(from_batch) == len(charts)
+    for a, b in zip(from_charts, from_batch):
+        assert a.tobytes() == b.tobytes()
+
+def test_magnitude_survives():
+    chart = PurpleStarChart.initialize_chart(datetime(1990, 5, 17, 8, 30), 'female')
+    chart.add_stars()
+    chart._placement_star(0).magnitude = 'miao'
+    view = ChartView(encode_chart(chart))
+    assert view.magnitude(0) == 'miao'
+    assert view.to_chart()._placement_star(0).magnitude == 'miao'
+
+def test_key_chart_round_trip():
+    chart = PurpleStarChart.from_key(ChartKey.from_index(777))
+    chart.add_stars()
+    restored = ChartView(encode_chart(chart)).to_chart()
+    assert restored._slot_branches() == chart._slot_branches()
+    assert restored.palaces == chart.palaces
+
+def test_archive_file(sample, tmp_path):
+    dts, genders, charts = sample
+    path = tmp_path / 'charts.bin'
+    write_charts(path, ChartBatch.from_solar_dates(dts, genders))
+    with ChartArchive.open(path) as archive:
+        assert len(archive) == len(charts)
+        assert archive[10].to_chart().to_dict() == charts[10].to_dict()
+
+def test_rejects_other_data():
+    with pytest.raises(ValueError):
+        ChartArchive(b'\0' * 256)
+
+def test_close_with_live_views(sample, tmp_path):
+    dts, genders, charts = sample
+    path = tmp_path / 'charts.bin'
+    write_charts(path, ChartBatch.from_solar_dates(dts, genders))
+    with ChartArchive.open(path) as archive:
+        view = archive[5]
+        branches = view.slot_branches
+        records = archive.records()
+    assert archive._file is None and archive._mm is None
+    assert view.to_chart().to_dict() == charts[5].to_dict()
+    assert list(branches) == charts[5]._slot_branches()
+    assert len(records) == len(charts)
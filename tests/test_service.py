@@ -0,0 +1,79 @@
+import asyncio
+import json
+from datetime import datetime
+from urllib.parse import urlsplit
+import pytest
+from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+from src.purple_star_chart.service import ChartService, HTTPError, _read_request, _request_record
+
+def read(raw, max_body=1 << 20):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await _read_request(reader, max_body)
+    return asyncio.run(run())
+
+def test_get():
+    method, target, headers, body = read(b'get /chart?gender=male HTTP/1.1\r\nHost: x\r\n\r\n')
+    assert (method, target, body) == ('GET', '/chart?gender=male', b'')
+    assert headers == {'host': 'x'}
+
+def test_post_body():
+    raw = b'POST /chart HTTP/1.1\r\nContent-Length: 7\r\n\r\n{"a":1}extra'
+    assert read(raw) == ('POST', '/chart', {'content-length': '7'}, b'{"a":1}')
+
+def test_client_done():
+    assert read(b'') is None
+
+@pytest.mark.parametrize('raw, status', [
+    (b'nonsense\r\n\r\n', 400),
+    (b'POST / HTTP/1.1\r\nContent-Length: -5\r\n\r\n', 400),
+    (b'POST / HTTP/1.1\r\nContent-Length: lots\r\n\r\n', 400),
+    (b'POST / HTTP/1.1\r\nContent-Length: 100\r\n\r\n', 413),
+    (b'GET / HTTP/1.1\r\n' + b'X: y\r\n' * 200 + b'\r\n', 400),
+])
+def test_bad_requests(raw, status):
+    with pytest.raises(HTTPError) as err:
+        read(raw, max_body=10)
+    assert err.value.status == status
+
+def test_record_from_query():
+    url = urlsplit('/chart?datetime=1990-05-17T08:30&gender=female')
+    assert _request_record('GET', url, b'') == {'datetime': '1990-05-17T08:30', 'gender': 'female'}
+
+def test_record_from_json():
+    url = urlsplit('/chart')
+    assert _request_record('POST', url, b'{"gender": "male"}') == {'gender': 'male'}
+    assert _request_record('POST', url, b'') == {}
+
+@pytest.mark.parametrize('method, body, status', [
+    ('POST', b'{bad', 400),
+    ('POST', b'[1, 2]', 400),
+    ('PUT', b'{}', 405),
+])
+def test_bad_records(method, body, status):
+    with pytest.raises(HTTPError) as err:
+        _request_record(method, urlsplit('/chart'), body)
+    assert err.value.status == status
+
+@pytest.mark.parametrize('shared_tables', [False, True])
+def test_close_delimited_first_response(shared_tables):
+    async def run():
+        service = await ChartService(port=0, workers=1, shared_tables=shared_tables).start()
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', service.port)
+            writer.write(b'GET /chart?datetime=1990-05-17T08:30&gender=female HTTP/1.1\r\n'
+                         b'Connection: close\r\n\r\n')
+            await writer.drain()
+            # the first request is the one answered by freshly started workers
+            response = await asyncio.wait_for(reader.read(), 30)
+            writer.close()
+            return response
+        finally:
+            await service.close()
+    head, _, body = asyncio.run(run()).partition(b'\r\n\r\n')
+    assert head.startswith(b'HTTP/1.1 200')
+    chart = PurpleStarChart.initialize_chart(datetime(1990, 5, 17, 8, 30), 'female')
+    chart.add_stars()
+    assert json.loads(body) == chart.to_dict()
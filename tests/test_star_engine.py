@@ -0,0 +1,50 @@
+import random
+import numpy as np
+import pytest
+from src.purple_star_chart import star_engine
+from src.purple_star_chart.PurpleStarChart import PurpleStarChart
+from src.purple_star_chart.chart_key import ChartKey, N_KEYS
+
+_sample = random.Random(4).sample(range(N_KEYS), 300)
+
+def reference(key):
+    chart = PurpleStarChart.from_key(key)
+    chart.add_stars()
+    return chart
+
+@pytest.mark.parametrize('index', _sample[:100])
+def test_add_stars_matches_reference(index):
+    key = ChartKey.from_index(index)
+    expected = reference(key)
+    chart = PurpleStarChart.from_key(key)
+    star_engine.add_stars(chart)
+    assert chart._slot_branches() == expected._slot_branches()
+    assert chart._master_slots() == expected._master_slots()
+    assert chart.palaces == expected.palaces
+
+def test_place_keys_matches_reference():
+    keys = [ChartKey.from_index(i) for i in _sample]
+    placed = star_engine.place_keys(keys)
+    for i, key in enumerate(keys):
+        expected = reference(key)
+        assert placed.row(i) == (bytes(expected._slot_branches()), *expected._master_slots())
+
+def test_key_space_rows_in_index_order():
+    space = star_engine.key_space()
+    assert len(space) == N_KEYS
+    rows = np.array(_sample)
+    placed = star_engine.place_keys([ChartKey.from_index(i) for i in _sample])
+    assert np.array_equal(space.positions[rows], placed.positions)
+    assert np.array_equal(space.life_master[rows], placed.life_master)
+    assert np.array_equal(space.body_master[rows], placed.body_master)
+
+def test_key_table_lookup():
+    keys = [ChartKey.from_index(i) for i in _sample[:50]]
+    computed = star_engine.place_keys(keys)
+    star_engine.use_key_table(star_engine.key_space())
+    try:
+        looked_up = star_engine.place_keys(keys)
+    finally:
+        star_engine.use_key_table(None)
+    assert np.array_equal(looked_up.positions, computed.positions)
+    assert np.array_equal(looked_up.life_master, computed.life_master)